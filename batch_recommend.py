@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from final_anqi import load_model, recommend_movies, recommend_movies_based_on_genre, recommend_movies_with_detailed_info
+from result_cache import ResultCache, data_version
+from shared_model import attach_model, export_model
+
+# The model of the current process. Worker processes attach the model file the parent exported
+# (see shared_model.py) in _init_worker, as (None, None, index).
+_MODEL = None
+# The result cache of the current process, if results are cached; every worker process has its own.
+_CACHE = None
+
+# The list of strings each request type requires, and its optional string arguments.
+_LIST_ARGUMENTS = {'genre': 'genres', 'liked': 'titles', 'pagerank': 'titles'}
+_STRING_ARGUMENTS = {'genre': ('rank_by',), 'preferences': ('genres', 'cast_name', 'crew_name')}
+
+def validate_request(request):
+    """
+    Checks that a request has the type and argument types run_query expects.
+
+    Raises:
+    ValueError: If the request is not a dictionary, its type is unknown, its titles or genres are not
+    a list of strings, a preference is not a string, or num_recommendations is not a non-negative integer.
+    """
+    if not isinstance(request, dict):
+        raise ValueError("A request must be a JSON object")
+    query_type = request.get('type')
+    if query_type not in ('genre', 'liked', 'preferences', 'pagerank'):
+        raise ValueError(f"Unknown request type: {query_type}")
+    num_recommendations = request.get('num_recommendations', 5)
+    if not isinstance(num_recommendations, int) or isinstance(num_recommendations, bool) or num_recommendations < 0:
+        raise ValueError(f"num_recommendations must be a non-negative integer, not {num_recommendations!r}")
+    key = _LIST_ARGUMENTS.get(query_type)
+    if key is not None and (not isinstance(request.get(key), list) or not all(isinstance(item, str) for item in request[key])):
+        raise ValueError(f"{key!r} must be a list of strings")
+    for key in _STRING_ARGUMENTS.get(query_type, ()):
+        if request.get(key) is not None and not isinstance(request[key], str):
+            raise ValueError(f"{key!r} must be a string")
+
+def query_key(model, request):
+    """
+    Normalises a request into the key its result is cached under.
+
+    Requests that the recommenders answer identically get the same key: the genres of a genre query
+    are sorted and deduplicated, and the titles of a liked or pagerank query are replaced by the
+    sorted ids of the movies they name (unknown titles are ignored by the recommenders, so they are left out).
+
+    Args:
+    model (tuple): The (final_df, graph, index) tuple from final_anqi.load_model.
+    request (dict): The request.
+
+    Returns:
+    tuple: The key.
+    """
+    index = model[2]
+    num_recommendations = request.get('num_recommendations', 5)
+    query_type = request.get('type')
+    if query_type == 'genre':
+        return ('genre', tuple(sorted(set(request['genres']))), request.get('rank_by'), num_recommendations)
+    if query_type in ('liked', 'pagerank'):
+        positions = (index['title_positions'].get(title) for title in request['titles'])
+        return (query_type, tuple(sorted({int(index['ids'][position]) for position in positions if position is not None})), num_recommendations)
+    if query_type == 'preferences':
+        return ('preferences',) + tuple(request.get(key) or None for key in ('genres', 'cast_name', 'crew_name')) + (num_recommendations,)
+    raise ValueError(f"Unknown request type: {query_type}")
+
+def run_query(model, request, cache=None):
+    """
+    Answers one batch request with the matching recommender.
+
+    Requests are dictionaries with a 'type' and the recommender's arguments:
+    - {"type": "genre", "genres": ["Action", "Comedy"]} calls recommend_movies_based_on_genre; "rank_by":
+      "vote_average" or "popularity" returns the best rated or most popular matches first.
+    - {"type": "liked", "titles": ["Avatar"]} calls recommend_movies_with_detailed_info.
+    - {"type": "preferences", "genres": "Action", "cast_name": "...", "crew_name": "..."} calls recommend_movies.
+    - {"type": "pagerank", "titles": ["Avatar"]} calls pagerank.recommend_movies_by_pagerank.
+    Each may also set "num_recommendations" (default 5).
+
+    Args:
+    model (tuple): The (final_df, graph, index) tuple from final_anqi.load_model.
+    request (dict): The request.
+    cache (result_cache.ResultCache): Results are looked up in and added to this cache, keyed by query_key.
+
+    Returns:
+    list: The recommended movies as dictionaries with 'id' and 'title'.
+
+    Raises:
+    ValueError: If the request is invalid (see validate_request).
+    """
+    validate_request(request)
+    if cache is not None:
+        return cache.get_or_compute(query_key(model, request), data_version(model[1]), lambda: run_query(model, request))
+    final_df, G, index = model
+    num_recommendations = request.get('num_recommendations', 5)
+    query_type = request.get('type')
+    if query_type == 'genre':
+        return recommend_movies_based_on_genre(request['genres'], G, num_recommendations, index=index, rank_by=request.get('rank_by'))
+    if query_type == 'liked':
+        return recommend_movies_with_detailed_info(request['titles'], final_df, G, num_recommendations, index=index)
+    if query_type == 'preferences':
+        preferences = {key: request[key] for key in ('genres', 'cast_name', 'crew_name') if request.get(key)}
+        return recommend_movies(preferences, final_df, G, num_recommendations, index=index)
+    if query_type == 'pagerank':
+        from pagerank import recommend_movies_by_pagerank
+
+        return recommend_movies_by_pagerank(request['titles'], index, num_recommendations)
+    raise ValueError(f"Unknown request type: {query_type}")
+
+def run_chunk(chunk):
+    """
+    Answers a chunk of (line number, raw JSON line) pairs with the process-wide model.
+
+    Returns:
+    list: (JSON result line, latency in seconds) pairs in the order of the chunk.
+    """
+    results = []
+    for line_number, line in chunk:
+        start = time.perf_counter()
+        try:
+            request = json.loads(line)
+            result = {'line': line_number, 'recommendations': run_query(_MODEL, request, _CACHE)}
+        except (ValueError, KeyError, TypeError) as error:
+            result = {'line': line_number, 'error': f"{type(error).__name__}: {error}"}
+        results.append((json.dumps(result), time.perf_counter() - start))
+    return results
+
+def read_chunks(lines, chunk_size):
+    """
+    Groups the non-blank lines of a JSONL stream into chunks of (line number, line) pairs.
+    """
+    chunk = []
+    for line_number, line in enumerate(lines, start=1):
+        if line.strip():
+            chunk.append((line_number, line))
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+def _init_worker(cache_size=0, model_file=None):
+    global _MODEL, _CACHE
+    if model_file is not None:
+        _MODEL = (None, None, attach_model(model_file))
+    elif _MODEL is None:
+        _MODEL = load_model()
+    _CACHE = ResultCache(cache_size, ttl=None) if cache_size else None
+
+def run_batch(lines, output, model, workers=1, chunk_size=256, cache_size=0, model_file=None):
+    """
+    Answers a stream of JSONL requests and writes one JSONL result per request.
+
+    Results are written in input order as {"line": n, "recommendations": [...]} or
+    {"line": n, "error": "..."}. With several workers, chunks are answered in parallel by
+    worker processes that map the model's index from one file (see shared_model.py) rather than
+    holding copies of the table and graph, so a worker starts in milliseconds and adds little memory.
+
+    Args:
+    lines (iterable): The JSONL request lines.
+    output (file): The stream to write the results to.
+    model (tuple): The (final_df, graph, index) tuple from final_anqi.load_model.
+    workers (int): The number of worker processes; 1 answers the requests in this process.
+    chunk_size (int): The number of requests sent to a worker at a time.
+    cache_size (int): The number of results each process caches (so repeated requests are answered
+    from the cache), or 0 to answer every request with the recommenders.
+    model_file (str): A model file exported from the model's index for the workers to attach; by
+    default a temporary one is written.
+
+    Returns:
+    dict: 'queries', 'elapsed' seconds, 'queries_per_second', the 'p50', 'p90', 'p99' and 'max'
+    latencies in milliseconds and, without workers, the 'cache' statistics if results are cached.
+    """
+    global _MODEL
+    _MODEL = model
+    latencies = []
+    start = time.perf_counter()
+    chunks = read_chunks(lines, chunk_size)
+    if workers > 1:
+        temp_file = None
+        if model_file is None:
+            descriptor, temp_file = tempfile.mkstemp(suffix='.bin')
+            os.close(descriptor)
+            export_model(model[2], temp_file)
+        try:
+            # Workers are forked from a server process that has imported the recommenders but holds no
+            # data, so all they share with this process is the mapped model file.
+            if 'forkserver' in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context('forkserver')
+                context.set_forkserver_preload(['batch_recommend'])
+            else:
+                context = multiprocessing.get_context('spawn')
+            with context.Pool(workers, initializer=_init_worker, initargs=(cache_size, model_file or temp_file)) as pool:
+                for results in pool.imap(run_chunk, chunks):
+                    for result, latency in results:
+                        output.write(result + '\n')
+                        latencies.append(latency)
+        finally:
+            if temp_file is not None:
+                os.remove(temp_file)
+    else:
+        _init_worker(cache_size)
+        for chunk in chunks:
+            for result, latency in run_chunk(chunk):
+                output.write(result + '\n')
+                latencies.append(latency)
+    output.flush()
+    elapsed = time.perf_counter() - start
+
+    stats = {'queries': len(latencies), 'elapsed': elapsed, 'queries_per_second': len(latencies) / elapsed if elapsed else 0.0}
+    percentiles = np.percentile(latencies, [50, 90, 99, 100]) * 1000 if latencies else [0.0] * 4
+    stats.update(zip(('p50', 'p90', 'p99', 'max'), (float(value) for value in percentiles)))
+    if workers <= 1 and _CACHE is not None:
+        stats['cache'] = _CACHE.stats()
+    return stats
+
+def main():
+    """
+    Runs the recommenders over a JSONL file of requests (or standard input) and streams JSONL results to standard output.
+
+    The data and graph are loaded once. The throughput and latency percentiles are printed to
+    standard error at the end.
+    """
+    parser = argparse.ArgumentParser(description='Answer a JSONL stream of recommendation requests.')
+    parser.add_argument('requests', nargs='?', default='-', help="JSONL request file, or '-' for standard input")
+    parser.add_argument('--workers', type=int, default=1, help='number of worker processes')
+    parser.add_argument('--chunk-size', type=int, default=256, help='requests sent to a worker at a time')
+    parser.add_argument('--graph-mode', default='hub', choices=['hub', 'clique', 'similarity'], help='the graph the recommenders use')
+    parser.add_argument('--cache-size', type=int, default=4096, help='results cached per process (0 disables the cache)')
+    parser.add_argument('--model-file', help='a model file from shared_model.py to attach instead of loading the data; rewritten if stale')
+    args = parser.parse_args()
+
+    if args.model_file:
+        from snapshot import INPUT_FILES, hash_input_files
+
+        source_hash = f"{hash_input_files(INPUT_FILES)}:{args.graph_mode}"
+        index = attach_model(args.model_file, source_hash)
+        if index is None:
+            export_model(load_model(graph_mode=args.graph_mode)[2], args.model_file, source_hash)
+            index = attach_model(args.model_file)
+        model = (None, None, index)
+    else:
+        model = load_model(graph_mode=args.graph_mode)
+    lines = sys.stdin if args.requests == '-' else open(args.requests, 'r')
+    try:
+        stats = run_batch(lines, sys.stdout, model, args.workers, args.chunk_size, args.cache_size, args.model_file)
+    finally:
+        if lines is not sys.stdin:
+            lines.close()
+    print(f"{stats['queries']} queries in {stats['elapsed']:.2f}s ({stats['queries_per_second']:.1f} queries/s); "
+          f"latency p50 {stats['p50']:.3f} ms, p90 {stats['p90']:.3f} ms, p99 {stats['p99']:.3f} ms, max {stats['max']:.3f} ms",
+          file=sys.stderr)
+    if 'cache' in stats:
+        print(f"result cache: {stats['cache']['hits']} hits, {stats['cache']['misses']} misses", file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from bulk_recommend import recommend_liked_bulk, recommend_preferences_bulk
+from cache_store import cache_to_dataframe, open_cache
+from construct_graph import create_movie_graph
+from final_anqi import (extract_names_from_json, parse_json_column, recommend_movies, recommend_movies_based_on_genre,
+                        recommend_movies_with_detailed_info)
+from ingest import read_tmdb_csvs
+from movie_index import build_movie_index
+from similar_movies import attach_similar_movies, compute_similar_movies, save_similar_movies
+from snapshot import load_snapshot, save_snapshot
+from synthetic_data import generate_dataset
+
+JSON_COLUMNS = {
+    'credits': ['cast', 'crew'],
+    'movies': ['genres', 'keywords', 'production_companies', 'production_countries', 'spoken_languages'],
+}
+# Modules that are only needed by some menu options and should not be loaded before the menu appears.
+DEFERRED_MODULES = ['matplotlib', 'networkx', 'requests']
+
+# Run in a fresh interpreter: imports the interactive program and loads what it loads before the menu.
+STARTUP_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import final_anqi
+imported = time.perf_counter()
+final_df = final_anqi.load_final_df()
+index = final_anqi.build_lookup_index(final_df)
+ready = time.perf_counter()
+print(json.dumps({'import_s': imported - start, 'menu_s': ready - start,
+                  'loaded': [name for name in %r if name in sys.modules]}))
+"""
+
+NAME_COLUMNS = {
+    'cast_names': 'cast', 'crew_names': 'crew', 'genre_names': 'genres', 'keyword_names': 'keywords',
+    'production_company_names': 'production_companies', 'production_country_names': 'production_countries',
+    'spoken_language_names': 'spoken_languages',
+}
+
+def measure(results, name, function, trace_memory=True):
+    """
+    Runs one benchmark stage, recording its wall time and peak traced memory.
+
+    Args:
+    results (dict): The stage results; an entry {'seconds': ..., 'peak_mb': ...} is added under `name`.
+    name (str): The name of the stage.
+    function (callable): The stage, called without arguments.
+    trace_memory (bool): Whether to measure the peak memory allocated during the stage with tracemalloc.
+
+    Returns:
+    object: The return value of `function`.
+    """
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    value = function()
+    seconds = time.perf_counter() - start
+    entry = {'seconds': seconds}
+    if trace_memory:
+        entry['peak_mb'] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+    results[name] = entry
+    print(f"  {name:<28} {seconds:9.3f} s" + (f" {entry['peak_mb']:10.1f} MB" if trace_memory else ''))
+    return value
+
+def time_queries(name, function, queries):
+    """
+    Runs a recommender over a list of queries and summarises the latencies.
+
+    Returns:
+    dict: The number of 'queries', 'queries_per_second' and the 'p50_ms', 'p90_ms', 'p99_ms' and 'max_ms' latencies.
+    """
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        function(query)
+        latencies.append(time.perf_counter() - start)
+    latencies = np.array(latencies) * 1000
+    p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+    result = {
+        'queries': len(queries), 'queries_per_second': 1000 * len(queries) / latencies.sum(),
+        'p50_ms': p50, 'p90_ms': p90, 'p99_ms': p99, 'max_ms': latencies.max(),
+    }
+    print(f"  query {name:<22} p50 {p50:8.3f} ms  p99 {p99:8.3f} ms  {result['queries_per_second']:10.1f} q/s")
+    return result
+
+def run_benchmark(data_dir, num_queries=200, trace_memory=True, clique_limit=5000, seed=0):
+    """
+    Times every stage of the load/build/query pipeline on one dataset.
+
+    Args:
+    data_dir (str): A directory with tmdb_5000_movies.csv, tmdb_5000_credits.csv and cache.json.
+    num_queries (int): The number of queries run per recommender.
+    trace_memory (bool): Whether to record the peak traced memory of each stage.
+    clique_limit (int): The largest number of movies the quadratic 'clique' graph is built for.
+    seed (int): The random seed for the queries.
+
+    Returns:
+    dict: 'num_movies', 'stages' (seconds and peak MB per stage) and 'queries' (latency summary per recommender).
+    """
+    stages = {}
+    path = lambda filename: os.path.join(data_dir, filename)
+    credits_df = measure(stages, 'read_csv_credits', lambda: pd.read_csv(path('tmdb_5000_credits.csv')), trace_memory)
+    movies_df = measure(stages, 'read_csv_movies', lambda: pd.read_csv(path('tmdb_5000_movies.csv')), trace_memory)
+
+    def parse_columns():
+        for df, columns in ((credits_df, JSON_COLUMNS['credits']), (movies_df, JSON_COLUMNS['movies'])):
+            for column in columns:
+                df[column] = parse_json_column(df, column)
+    measure(stages, 'parse_json_column', parse_columns, trace_memory)
+    merged_df = measure(stages, 'merge', lambda: pd.merge(movies_df, credits_df, how='left', left_on='id', right_on='movie_id'), trace_memory)
+    del credits_df, movies_df
+
+    def extract_names():
+        for name_column, column in NAME_COLUMNS.items():
+            merged_df[name_column] = merged_df[column].apply(extract_names_from_json)
+    measure(stages, 'extract_names_from_json', extract_names, trace_memory)
+    merged_df = merged_df.drop(columns=['title_y', 'movie_id'] + list(NAME_COLUMNS.values()))
+    # The chunked path used by build_final_df; with several workers, their memory is not traced.
+    measure(stages, 'ingest_csv_chunked', lambda: read_tmdb_csvs(path('tmdb_5000_movies.csv'), path('tmdb_5000_credits.csv')), trace_memory)
+    merged_df.dropna(subset=['overview', 'release_date', 'runtime'], inplace=True)
+
+    cache_file = path('cache.sqlite')
+    if os.path.exists(cache_file):
+        os.remove(cache_file)
+    cache = measure(stages, 'cache_migrate_sqlite', lambda: open_cache(cache_file, legacy_json_file=path('cache.json')), trace_memory)
+    final_df = measure(stages, 'cache_join', lambda: pd.merge(merged_df, cache_to_dataframe(cache), on='id', how='left', suffixes=('_csv', '')), trace_memory)
+    cache.close()
+    del merged_df
+
+    snapshot_file = path('movie_data.npz')
+    measure(stages, 'snapshot_save', lambda: save_snapshot(final_df, snapshot_file, 'benchmark'), trace_memory)
+    measure(stages, 'snapshot_load', lambda: load_snapshot(snapshot_file), trace_memory)
+
+    if len(final_df) <= clique_limit:
+        measure(stages, 'create_movie_graph_clique', lambda: create_movie_graph(final_df, mode='clique'), trace_memory)
+    measure(stages, 'create_movie_graph_similarity', lambda: create_movie_graph(final_df, mode='similarity'), trace_memory)
+    G = measure(stages, 'create_movie_graph_hub', lambda: create_movie_graph(final_df, mode='hub'), trace_memory)
+    index = measure(stages, 'build_movie_index', lambda: build_movie_index(final_df, G), trace_memory)
+    table = measure(stages, 'similar_movies', lambda: compute_similar_movies(index), trace_memory)
+    save_similar_movies(path('similar_movies.npz'), index, table)
+    similar_index = dict(index)
+    attach_similar_movies(similar_index, path('similar_movies.npz'))
+
+    rng = random.Random(seed)
+    genres = index['genres']
+    titles = final_df['title_x'].tolist()
+    popular_cast = sorted(index['cast_postings'], key=lambda name: -len(index['cast_postings'][name]))[:100]
+    # Generated in the order of earlier versions, so the queries stay comparable between runs.
+    genre_queries = [rng.sample(genres, rng.randint(1, 2)) for _ in range(num_queries)]
+    liked_queries = [rng.sample(titles, rng.randint(1, 3)) for _ in range(num_queries)]
+    queries = {
+        'genre': (lambda query: recommend_movies_based_on_genre(query, G, index=index), genre_queries),
+        'genre_ranked': (lambda query: recommend_movies_based_on_genre(query, G, index=index, rank_by='vote_average'), genre_queries),
+        'liked': (lambda query: recommend_movies_with_detailed_info(query, final_df, G, index=index), liked_queries),
+        'liked_precomputed': (lambda query: recommend_movies_with_detailed_info(query, final_df, G, index=similar_index), liked_queries),
+        'preferences': (lambda query: recommend_movies(query, final_df, G, index=index),
+                        [{'genres': rng.choice(genres), 'cast_name': rng.choice(popular_cast)} for _ in range(num_queries)]),
+    }
+    query_results = {name: time_queries(name, function, query_list) for name, (function, query_list) in queries.items()}
+    # The same users answered together by the bulk recommenders.
+    measure(stages, 'bulk_liked', lambda: [result for chunk in recommend_liked_bulk(liked_queries, index) for result in chunk], trace_memory)
+    measure(stages, 'bulk_preferences', lambda: [result for chunk in recommend_preferences_bulk(queries['preferences'][1], index) for result in chunk], trace_memory)
+    return {'num_movies': len(final_df), 'stages': stages, 'queries': query_results}
+
+def measure_startup(data_dir, repeats=5):
+    """
+    Measures how long the interactive program takes to show its menu, in fresh interpreters.
+
+    The data directory needs a movie_data.npz snapshot (run_benchmark writes one), so that the
+    movie table is loaded rather than built.
+
+    Args:
+    data_dir (str): The directory the program is started in.
+    repeats (int): The number of interpreters started; the median times are reported.
+
+    Returns:
+    dict: The median 'import_s' (importing final_anqi) and 'menu_s' (until the menu is shown)
+    across the runs, 'process_s' (the whole process, including interpreter start-up and exit), and
+    the deferred modules that were 'loaded' anyway.
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [os.path.dirname(os.path.abspath(__file__)), os.environ.get('PYTHONPATH')])))
+    env.pop('MOVIE_STATS', None)
+    runs = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT % DEFERRED_MODULES], cwd=data_dir, env=env,
+                                capture_output=True, text=True, check=True).stdout
+        run = json.loads(output.strip().splitlines()[-1])
+        run['process_s'] = time.perf_counter() - start
+        runs.append(run)
+    result = {key: float(np.median([run[key] for run in runs])) for key in ('import_s', 'menu_s', 'process_s')}
+    result['loaded'] = runs[-1]['loaded']
+    print(f"  startup import {result['import_s']:.3f} s, menu {result['menu_s']:.3f} s, process {result['process_s']:.3f} s"
+          + (f" (loaded: {', '.join(result['loaded'])})" if result['loaded'] else ''))
+    return result
+
+def compare_results(current, previous):
+    """
+    Prints the ratio of each stage time and query latency to a previous run of the same size.
+    """
+    for size, result in current['runs'].items():
+        if size not in previous.get('runs', {}):
+            continue
+        old = previous['runs'][size]
+        print(f"\n{size} movies compared with {previous.get('timestamp', 'previous run')}:")
+        for stage, entry in result['stages'].items():
+            if stage in old['stages']:
+                print(f"  {stage:<28} x{entry['seconds'] / max(old['stages'][stage]['seconds'], 1e-9):6.2f}")
+        for name, entry in result['queries'].items():
+            if name in old['queries']:
+                print(f"  query {name:<22} x{entry['p50_ms'] / max(old['queries'][name]['p50_ms'], 1e-9):6.2f} (p50)")
+        if 'startup' in result and 'startup' in old:
+            print(f"  {'startup_menu':<28} x{result['startup']['menu_s'] / max(old['startup']['menu_s'], 1e-9):6.2f}")
+
+def main():
+    """
+    Generates synthetic datasets of the requested sizes (once) and benchmarks the pipeline on each.
+
+    The results are written as JSON so that runs can be compared with --compare.
+    """
+    parser = argparse.ArgumentParser(description='Benchmark the load/build/query pipeline on synthetic TMDB data.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--data-dir', default='benchmark_data', help='where the synthetic datasets are generated')
+    parser.add_argument('--queries', type=int, default=200, help='queries per recommender')
+    parser.add_argument('--no-memory', action='store_true', help='skip tracemalloc (faster, no peak memory)')
+    parser.add_argument('--startup', action='store_true', help='also time how long the interactive program takes to show its menu')
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', help='a previous results file to compare with')
+    args = parser.parse_args()
+
+    results = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'versions': {'numpy': np.__version__, 'pandas': pd.__version__},
+        'runs': {},
+    }
+    for size in args.sizes:
+        data_dir = os.path.join(args.data_dir, str(size))
+        if not os.path.exists(os.path.join(data_dir, 'tmdb_5000_movies.csv')):
+            print(f"Generating {size} synthetic movies in {data_dir}")
+            generate_dataset(size, data_dir)
+        print(f"Benchmarking {size} movies")
+        results['runs'][str(size)] = run_benchmark(data_dir, args.queries, not args.no_memory)
+        if args.startup:
+            results['runs'][str(size)]['startup'] = measure_startup(data_dir)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            compare_results(results, json.load(f))
+
+if __name__ == '__main__':
+    main()
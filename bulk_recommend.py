@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import numpy as np
+
+from movie_index import genre_bitmasks, quality_ranks
+from name_lists import concat_ranges
+
+def _bit_counts(words):
+    """
+    Counts the set bits of every row of a uint64 array. np.bitwise_count needs NumPy 2.0; older
+    versions unpack the bytes instead.
+    """
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words).sum(axis=1, dtype=np.int64)
+    return np.unpackbits(np.ascontiguousarray(words).view(np.uint8), axis=1).sum(axis=1, dtype=np.int64)
+
+def _check_index(index):
+    if 'similarity_indptr' in index:
+        raise ValueError("Bulk scoring ranks by genre overlap; use the single-user recommenders with a 'similarity' graph")
+
+def _bulk_tables(index):
+    """
+    Returns the tables every bulk query of an index uses, computing them on first use.
+
+    The movies of the graph are grouped by their set of genres. All movies of a group share the same
+    number of genres with any profile, so a profile is scored once per group instead of once per
+    movie, and the members of every group are kept sorted by rating (see movie_index.quality_ranks).
+    """
+    tables = index.get('bulk_tables')
+    if tables is None:
+        quality = index.get('quality')
+        if quality is None:
+            quality = quality_ranks(index)
+        graph_positions = np.flatnonzero(index['in_graph'])
+        genre_bits = genre_bitmasks(index['genre_matrix'])
+        _, first, set_of_movie = np.unique(genre_bits[graph_positions], axis=0, return_index=True, return_inverse=True)
+        genre_sets = index['genre_matrix'][graph_positions[first]]
+        set_of_movie = set_of_movie.reshape(-1)
+        order = np.lexsort((-quality[graph_positions], set_of_movie))
+        outside = np.flatnonzero(~index['in_graph'])
+        id_order = np.argsort(index['ids'], kind='stable')
+        tables = index['bulk_tables'] = {
+            'quality': quality,
+            'graph_positions': graph_positions,
+            'genre_sets': genre_sets,
+            'set_members': graph_positions[order],
+            'set_starts': np.searchsorted(set_of_movie[order], np.arange(len(genre_sets) + 1)),
+            'outside_by_quality': outside[np.argsort(-quality[outside], kind='stable')],
+            'genre_bits': genre_bits,
+            'id_order': id_order,
+            'sorted_ids': index['ids'][id_order],
+        }
+    return tables
+
+def _rows_of_ids(tables, movie_ids):
+    """
+    Returns every row position of the given movie ids, and the number of rows of each id.
+    """
+    order, sorted_ids = tables['id_order'], tables['sorted_ids']
+    starts, ends = np.searchsorted(sorted_ids, movie_ids, side='left'), np.searchsorted(sorted_ids, movie_ids, side='right')
+    return order[concat_ranges(starts, ends)], ends - starts
+
+def _best_per_group(groups, positions, keys, k):
+    """
+    Keeps the k highest keys of every group.
+
+    Args:
+    groups (numpy.ndarray): The ascending group of every entry.
+    positions (numpy.ndarray): The position of every entry.
+    keys (numpy.ndarray): The int64 key of every entry.
+    k (int): The number of entries kept per group.
+
+    Returns:
+    tuple: The (groups, positions) of the kept entries, by ascending group and best first within a group.
+    """
+    if keys.size == 0:
+        return groups, positions
+    # One sort of a combined key, ascending by group and then descending by key.
+    lowest = keys.min()
+    span = int(keys.max()) - int(lowest) + 1
+    order = np.argsort(groups * span + (span - 1 - (keys - lowest)))
+    groups, positions = groups[order], positions[order]
+    keep = np.arange(len(groups)) - np.searchsorted(groups, groups, side='left') < k
+    return groups[keep], positions[keep]
+
+def _split(groups, positions, num_groups):
+    bounds = np.searchsorted(groups, np.arange(num_groups + 1)).tolist()
+    return [positions[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+def _liked_results(index, tables, profiles, num_recommendations):
+    """
+    Ranks the catalogue for distinct liked-movie profiles, like recommend_movies_with_detailed_info.
+
+    Args:
+    profiles (list): (liked positions in the graph, liked ids) pairs; no row of a liked id is recommended.
+
+    Returns:
+    list: The recommended positions of every profile, best first.
+    """
+    num_rows = len(index['ids'])
+    quality = tables['quality']
+    set_starts = tables['set_starts']
+    set_sizes = np.diff(set_starts)
+
+    # The profile x genre matrix of genre counts times the genre x group matrix: the genre overlap of
+    # every profile with every group of movies.
+    counts = np.stack([index['genre_matrix'][liked].sum(axis=0) for liked, _ in profiles])
+    scores = (counts @ tables['genre_sets'].T).astype(np.int64)
+    liked_ids = np.array([movie_id for _, movie_ids in profiles for movie_id in movie_ids], dtype=index['ids'].dtype)
+    excluded, rows_per_id = _rows_of_ids(tables, liked_ids)
+    excluded_groups = np.repeat(np.repeat(np.arange(len(profiles)), [len(movie_ids) for _, movie_ids in profiles]), rows_per_id)
+    excluded_counts = np.bincount(excluded_groups, minlength=len(profiles))
+    needed = num_recommendations + excluded_counts
+
+    # A profile's best movies lie in the groups scoring at least the highest score at which, counting
+    # the movies of every score and above, `needed` movies are reached; and only the first `needed`
+    # members of a group (by rating) can be among them.
+    levels = int(scores.max()) + 1
+    movies_per_level = np.bincount((np.arange(len(profiles))[:, None] * levels + scores).ravel(),
+                                   weights=np.broadcast_to(set_sizes, scores.shape).ravel(), minlength=len(profiles) * levels)
+    movies_at_or_above = np.cumsum(movies_per_level.reshape(len(profiles), levels)[:, ::-1], axis=1)[:, ::-1]
+    reached = movies_at_or_above >= needed[:, None]
+    cutoff = np.where(reached[:, 0], levels - 1 - reached[:, ::-1].argmax(axis=1), 0)
+    pair_profiles, pair_sets = np.nonzero(scores >= cutoff[:, None])
+    heads = np.minimum(set_sizes[pair_sets], needed[pair_profiles])
+    positions = tables['set_members'][concat_ranges(set_starts[pair_sets], set_starts[pair_sets] + heads)]
+    groups = np.repeat(pair_profiles, heads)
+    keys = np.repeat(scores[pair_profiles, pair_sets], heads) * num_rows + quality[positions]
+
+    keep = ~np.isin(groups * num_rows + positions, excluded_groups * num_rows + excluded)
+    results = _split(*_best_per_group(groups[keep], positions[keep], keys[keep], num_recommendations), len(profiles))
+
+    # Movies outside the graph come after every movie of the graph, by rating.
+    outside = tables['outside_by_quality']
+    for profile, result in enumerate(results):
+        if len(result) < num_recommendations and outside.size:
+            remaining = outside[~np.isin(outside, excluded[excluded_groups == profile])]
+            results[profile] = np.concatenate([result, remaining[:num_recommendations - len(result)]])
+    return results
+
+def _preference_results(index, tables, profiles, attribute_positions, num_recommendations):
+    """
+    Ranks the catalogue for distinct preference profiles, like recommend_movies.
+
+    Args:
+    profiles (list): Tuples of the attributes every recommended movie must have.
+    attribute_positions (list): The sorted positions of the movies of the graph with each attribute.
+
+    Returns:
+    list: The recommended positions of every profile, best first.
+    """
+    num_rows = len(index['ids'])
+    ids = index['ids']
+    quality = tables['quality']
+
+    # The profile x attribute matrix times the sparse attribute x movie incidence, which only needs
+    # the movies of each profile's rarest attribute: they are kept when the postings of every other
+    # attribute of the profile have them, checked with one binary search per attribute over all
+    # profiles asking for it. A profile without attributes matches every movie of the graph.
+    drivers = [min(profile, key=lambda attribute: len(attribute_positions[attribute])) if profile else -1 for profile in profiles]
+    parts = [attribute_positions[driver] if driver >= 0 else tables['graph_positions'] for driver in drivers]
+    lengths = np.array([len(part) for part in parts], dtype=np.int64)
+    groups = np.repeat(np.arange(len(profiles), dtype=np.int64), lengths)
+    positions = np.concatenate(parts)
+    bounds = np.r_[0, np.cumsum(lengths)]
+    checks = {}
+    for profile, (attributes, driver) in enumerate(zip(profiles, drivers)):
+        for attribute in attributes:
+            if attribute != driver:
+                checks.setdefault(attribute, []).append(profile)
+    matched = np.ones(len(positions), dtype=bool)
+    for attribute, checked in checks.items():
+        checked = np.array(checked, dtype=np.int64)
+        entries = concat_ranges(bounds[checked], bounds[checked + 1])
+        postings = attribute_positions[attribute]
+        found = np.minimum(np.searchsorted(postings, positions[entries]), len(postings) - 1)
+        matched[entries] &= postings[found] == positions[entries]
+    groups, positions = groups[matched], positions[matched]
+    if positions.size == 0:
+        return [positions] * len(profiles)
+
+    # Every group is sorted by position, so its last entry is the last match, and the last match with
+    # another id is the largest position whose id differs from it.
+    starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+    last = np.full(len(profiles), -1, dtype=np.int64)
+    last[groups[starts]] = positions[np.r_[starts[1:], len(groups)] - 1]
+    same_as_last = ids[positions] == ids[last[groups]]
+    other = np.full(len(profiles), -1, dtype=np.int64)
+    other[groups[starts]] = np.maximum.reduceat(np.where(same_as_last, -1, positions), starts)
+
+    # The genres every match shares with the last match (or, for the rows with the id of the last
+    # match, with the last match of another id), counted on the genre bitmasks.
+    reference = np.where(same_as_last, other[groups], last[groups])
+    bits = tables['genre_bits']
+    overlap = _bit_counts(bits[positions] & bits[reference])
+    keys = np.where(reference >= 0, overlap * num_rows + quality[positions], quality[positions] - num_rows)
+    return _split(*_best_per_group(groups, positions, keys, num_recommendations), len(profiles))
+
+def _movies(index, positions):
+    return [{'id': int(index['ids'][position]), 'title': index['titles'][position]} for position in positions.tolist()]
+
+def recommend_liked_bulk(liked_lists, index, num_recommendations=5, chunk_size=1024):
+    """
+    Recommends movies to many users at once from the movies each of them liked.
+
+    Every user gets what recommend_movies_with_detailed_info(titles, df, graph, num_recommendations,
+    index) returns. The liked movies of a chunk of users form a users x genres matrix of genre counts,
+    and its product with the genres of the distinct genre sets of the graph scores every user against
+    every group of equally scored movies at once. Each user's movies are then picked from the few
+    best scoring groups, whose members are already sorted by rating. Users who liked the same movies
+    are scored once.
+
+    Args:
+    liked_lists (list): One list of liked movie titles per user.
+    index (dict): The index from movie_index.build_movie_index of a 'hub' or 'clique' graph.
+    num_recommendations (int): The number of movies per user.
+    chunk_size (int): The number of users scored together.
+
+    Returns:
+    generator: One list per chunk, holding the recommendations ('id' and 'title' dictionaries) of each of its users.
+
+    Raises:
+    ValueError: If the index is of a 'similarity' graph.
+    """
+    _check_index(index)
+    tables = _bulk_tables(index)
+    liked_lists = list(liked_lists)
+    for start in range(0, len(liked_lists), chunk_size):
+        profile_numbers, profiles, user_profiles = {}, [], []
+        for titles in liked_lists[start:start + chunk_size]:
+            liked_ids, liked_positions = set(), {}
+            for title in titles:
+                position = index['title_positions'].get(title)
+                if position is not None:
+                    movie_id = index['ids'][position]
+                    liked_ids.add(movie_id)
+                    if index['in_graph'][position]:
+                        liked_positions.setdefault(movie_id, index['id_positions'][movie_id])
+            key = (tuple(sorted(liked_positions.values())), tuple(sorted(liked_ids)))
+            if key not in profile_numbers:
+                profile_numbers[key] = len(profiles)
+                profiles.append((list(key[0]), key[1]))
+            user_profiles.append(profile_numbers[key])
+        if num_recommendations > 0:
+            results = _liked_results(index, tables, profiles, num_recommendations)
+        else:
+            results = [np.zeros(0, dtype=np.int64)] * len(profiles)
+        yield [_movies(index, results[profile]) for profile in user_profiles]
+
+def recommend_preferences_bulk(preferences_list, index, num_recommendations=5, chunk_size=1024):
+    """
+    Recommends movies to many users at once from their favourite genre, cast and crew.
+
+    Every user gets what recommend_movies(preferences, df, graph, num_recommendations, index)
+    returns. The preferences of a chunk of users form a users x attributes matrix over the distinct
+    genres and names they ask for, and its product with the sparse attribute x movie incidence of the
+    inverted indexes finds the matches of every user at once. The matches are scored by the genres
+    they share with the user's last match, counted on the genre bitmasks, and each user's best movies
+    are kept. Users with the same preferences are scored once.
+
+    Args:
+    preferences_list (list): One preferences dictionary ('genres', 'cast_name', 'crew_name') per user.
+    index (dict): The index from movie_index.build_movie_index of a 'hub' or 'clique' graph.
+    num_recommendations (int): The number of movies per user.
+    chunk_size (int): The number of users scored together.
+
+    Returns:
+    generator: One list per chunk, holding the recommendations of each of its users.
+
+    Raises:
+    ValueError: If the index is of a 'similarity' graph.
+    """
+    _check_index(index)
+    tables = _bulk_tables(index)
+    in_graph = index['in_graph']
+    preferences_list = list(preferences_list)
+    for start in range(0, len(preferences_list), chunk_size):
+        attribute_numbers, attribute_positions = {}, []
+        profile_numbers, profiles, user_profiles = {}, [], []
+        for preferences in preferences_list[start:start + chunk_size]:
+            profile = set()
+            for preference, postings in (('genres', 'genre_postings'), ('cast_name', 'cast_postings'), ('crew_name', 'crew_postings')):
+                if preference in preferences and preferences[preference]:
+                    key = (postings, preferences[preference])
+                    if key not in attribute_numbers:
+                        attribute_numbers[key] = len(attribute_positions)
+                        positions = index[postings].get(key[1], tables['graph_positions'][:0])
+                        attribute_positions.append(positions[in_graph[positions]])
+                    # A preference that matches no movie of the graph is ignored.
+                    if attribute_positions[attribute_numbers[key]].size:
+                        profile.add(attribute_numbers[key])
+            profile = tuple(sorted(profile))
+            if profile not in profile_numbers:
+                profile_numbers[profile] = len(profiles)
+                profiles.append(profile)
+            user_profiles.append(profile_numbers[profile])
+        if num_recommendations > 0:
+            results = _preference_results(index, tables, profiles, attribute_positions, num_recommendations)
+        else:
+            results = [np.zeros(0, dtype=np.int64)] * len(profiles)
+        yield [_movies(index, results[profile]) for profile in user_profiles]
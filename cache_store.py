@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import json
+import os
+import sqlite3
+
+import pandas as pd
+
+from tmdb_client import FETCHED_AT_FIELD, TMDB_FIELDS
+
+DEFAULT_CACHE_FILE = 'cache.sqlite'
+LEGACY_CACHE_FILE = 'cache.json'
+# The fields stored per movie: the TMDB fields and the time they were fetched.
+CACHE_FIELDS = (*TMDB_FIELDS, FETCHED_AT_FIELD)
+
+class SqliteCache:
+    """
+    TMDB cache stored in an SQLite table keyed by movie id.
+
+    The store behaves like the cache dictionary it replaces (string movie ids as keys, dictionaries of
+    CACHE_FIELDS as values), so fetch_tmdb_data and fetch_tmdb_data_bulk work with either. Writes are
+    buffered and committed in one transaction every `batch_size` entries, on flush() and on close().
+    """
+
+    def __init__(self, filename, batch_size=100):
+        self.filename = filename
+        self.batch_size = batch_size
+        self.pending = {}
+        self.connection = sqlite3.connect(filename, check_same_thread=False)
+        sql_types = dict(zip(CACHE_FIELDS, ('REAL', 'INTEGER', 'TEXT', 'REAL', 'INTEGER', 'REAL')))
+        columns = ', '.join(f"{field} {sql_type}" for field, sql_type in sql_types.items())
+        self.connection.execute(f"CREATE TABLE IF NOT EXISTS movies (id INTEGER PRIMARY KEY, {columns})")
+        # Stores written before entries were timestamped get the column, with NULL (never fetched) for their entries.
+        existing = {row[1] for row in self.connection.execute("PRAGMA table_info(movies)")}
+        for field in CACHE_FIELDS:
+            if field not in existing:
+                self.connection.execute(f"ALTER TABLE movies ADD COLUMN {field} {sql_types[field]}")
+        self.connection.commit()
+
+    def __contains__(self, movie_id):
+        return self.get(movie_id) is not None
+
+    def __getitem__(self, movie_id):
+        entry = self.get(movie_id)
+        if entry is None:
+            raise KeyError(movie_id)
+        return entry
+
+    def __setitem__(self, movie_id, entry):
+        self.pending[int(movie_id)] = entry
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def __len__(self):
+        self.flush()
+        return self.connection.execute("SELECT COUNT(*) FROM movies").fetchone()[0]
+
+    def get(self, movie_id, default=None):
+        """
+        Returns the cached entry of a movie, or `default` if it is not cached.
+        """
+        movie_id = int(movie_id)
+        if movie_id in self.pending:
+            return self.pending[movie_id]
+        row = self.connection.execute(f"SELECT {', '.join(CACHE_FIELDS)} FROM movies WHERE id = ?", (movie_id,)).fetchone()
+        return default if row is None else dict(zip(CACHE_FIELDS, row))
+
+    def update(self, entries):
+        """
+        Adds or replaces several entries, given as a mapping from movie id to entry.
+        """
+        for movie_id, entry in entries.items():
+            self[movie_id] = entry
+
+    def flush(self):
+        """
+        Commits the buffered entries in one transaction.
+        """
+        if not self.pending:
+            return
+        rows = [(movie_id, *(entry.get(field) for field in CACHE_FIELDS)) for movie_id, entry in self.pending.items()]
+        with self.connection:
+            self.connection.executemany(
+                f"INSERT OR REPLACE INTO movies (id, {', '.join(CACHE_FIELDS)}) VALUES ({', '.join('?' * (len(CACHE_FIELDS) + 1))})", rows)
+        self.pending.clear()
+
+    def compact(self):
+        """
+        Reclaims the space left by replaced entries.
+        """
+        self.flush()
+        self.connection.execute("VACUUM")
+
+    def to_dataframe(self):
+        """
+        Reads the whole cache into a DataFrame with an 'id' column and one column per field of CACHE_FIELDS.
+        """
+        self.flush()
+        return pd.read_sql_query(f"SELECT id, {', '.join(CACHE_FIELDS)} FROM movies", self.connection)
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+class JsonlCache:
+    """
+    TMDB cache stored as an append-only log of JSON lines, one {'id': ..., <CACHE_FIELDS>} object per line.
+
+    A later line for the same movie replaces the earlier ones. Only the byte offset of each movie's
+    latest line is kept in memory. Writes are buffered and appended every `batch_size` entries, on
+    flush() and on close(); a last line cut short by a crash is truncated when the log is opened.
+    """
+
+    def __init__(self, filename, batch_size=100):
+        self.filename = filename
+        self.batch_size = batch_size
+        self.pending = {}
+        self.offsets = {}
+        if os.path.exists(filename):
+            with open(filename, 'rb+') as file:
+                offset = 0
+                for line in file:
+                    if not line.endswith(b'\n'):
+                        file.truncate(offset)
+                        break
+                    entry = _parse_line(line)
+                    if entry is not None:
+                        self.offsets[int(entry['id'])] = offset
+                    offset += len(line)
+
+    def __contains__(self, movie_id):
+        movie_id = int(movie_id)
+        return movie_id in self.pending or movie_id in self.offsets
+
+    def __getitem__(self, movie_id):
+        entry = self.get(movie_id)
+        if entry is None:
+            raise KeyError(movie_id)
+        return entry
+
+    def __setitem__(self, movie_id, entry):
+        self.pending[int(movie_id)] = entry
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def __len__(self):
+        return len(self.offsets.keys() | self.pending.keys())
+
+    def get(self, movie_id, default=None):
+        """
+        Returns the cached entry of a movie, or `default` if it is not cached.
+        """
+        movie_id = int(movie_id)
+        if movie_id in self.pending:
+            return self.pending[movie_id]
+        if movie_id not in self.offsets:
+            return default
+        with open(self.filename, 'rb') as file:
+            file.seek(self.offsets[movie_id])
+            entry = _parse_line(file.readline())
+        return {field: entry.get(field) for field in CACHE_FIELDS}
+
+    def update(self, entries):
+        """
+        Adds or replaces several entries, given as a mapping from movie id to entry.
+        """
+        for movie_id, entry in entries.items():
+            self[movie_id] = entry
+
+    def flush(self):
+        """
+        Appends the buffered entries to the log in a single write.
+        """
+        if not self.pending:
+            return
+        with open(self.filename, 'ab') as file:
+            offset = file.tell()
+            lines = []
+            for movie_id, entry in self.pending.items():
+                line = (json.dumps({'id': movie_id, **{field: entry.get(field) for field in CACHE_FIELDS}}) + '\n').encode('utf-8')
+                self.offsets[movie_id] = offset
+                offset += len(line)
+                lines.append(line)
+            file.write(b''.join(lines))
+            file.flush()
+            os.fsync(file.fileno())
+        self.pending.clear()
+
+    def compact(self):
+        """
+        Rewrites the log with only the latest line of each movie, replacing the file atomically.
+        """
+        self.flush()
+        temp_filename = self.filename + '.tmp'
+        offsets = {}
+        with open(self.filename, 'rb') as source, open(temp_filename, 'wb') as target:
+            for movie_id, offset in self.offsets.items():
+                source.seek(offset)
+                offsets[movie_id] = target.tell()
+                target.write(source.readline())
+            target.flush()
+            os.fsync(target.fileno())
+        os.replace(temp_filename, self.filename)
+        self.offsets = offsets
+
+    def to_dataframe(self):
+        """
+        Reads the whole cache into a DataFrame with an 'id' column and one column per field of CACHE_FIELDS.
+        """
+        self.flush()
+        if not self.offsets:
+            return pd.DataFrame(columns=['id', *CACHE_FIELDS])
+        df = pd.read_json(self.filename, lines=True, dtype=False)
+        # Lines written before entries were timestamped have no fetched_at.
+        return df.drop_duplicates(subset='id', keep='last').reset_index(drop=True).reindex(columns=['id', *CACHE_FIELDS])
+
+    def close(self):
+        self.flush()
+
+def _parse_line(line):
+    """
+    Parses one line of a JSON lines cache, returning None for a truncated or blank line.
+    """
+    try:
+        entry = json.loads(line)
+    except ValueError:
+        return None
+    return entry if isinstance(entry, dict) and 'id' in entry else None
+
+def migrate_json_cache(json_file, cache):
+    """
+    Copies the entries of a legacy cache.json file into a cache store.
+
+    Args:
+    json_file (str): The path of the legacy JSON cache.
+    cache (SqliteCache or JsonlCache): The store to copy the entries into.
+
+    Returns:
+    int: The number of migrated entries.
+    """
+    with open(json_file, 'r') as file:
+        cache_data = json.load(file)
+    cache.update(cache_data)
+    cache.flush()
+    return len(cache_data)
+
+def open_cache(filename=DEFAULT_CACHE_FILE, batch_size=100, legacy_json_file=LEGACY_CACHE_FILE):
+    """
+    Opens a TMDB cache store, choosing the backend from the file extension.
+
+    '.jsonl' files use the JSON lines log; any other file is an SQLite database. A new, empty store
+    is filled from the legacy cache.json once, if that file exists.
+
+    Args:
+    filename (str): The path of the store.
+    batch_size (int): The number of entries buffered before they are written.
+    legacy_json_file (str): The legacy JSON cache to migrate from, or None to skip the migration.
+
+    Returns:
+    SqliteCache or JsonlCache: The opened store.
+    """
+    cache = JsonlCache(filename, batch_size) if filename.endswith('.jsonl') else SqliteCache(filename, batch_size)
+    if legacy_json_file and len(cache) == 0 and os.path.exists(legacy_json_file):
+        migrate_json_cache(legacy_json_file, cache)
+    return cache
+
+def cache_to_dataframe(cache_data, fields=TMDB_FIELDS):
+    """
+    Converts a TMDB cache into the DataFrame joined onto the movie table.
+
+    Args:
+    cache_data (dict or SqliteCache or JsonlCache): A cache dictionary keyed by string movie id, or a cache store.
+    fields (tuple): The fields to keep; by default the TMDB fields, without the fetch times.
+
+    Returns:
+    pandas.DataFrame: One row per cached movie with an integer 'id' column and the fields (NaN where an entry lacks one).
+    """
+    if isinstance(cache_data, dict):
+        tmdb_data_df = pd.DataFrame.from_dict(cache_data, orient='index').reset_index()
+        tmdb_data_df.rename(columns={'index': 'id'}, inplace=True)
+    else:
+        tmdb_data_df = cache_data.to_dataframe()
+    tmdb_data_df = tmdb_data_df.reindex(columns=['id', *fields])
+    tmdb_data_df['id'] = tmdb_data_df['id'].astype(int)
+    return tmdb_data_df
@@ -4,10 +4,25 @@
 # In[1]:
 
 
+import numpy as np
 import pandas as pd
-import networkx as nx
 import json
 import os
+import shutil
+from cache_store import cache_to_dataframe, open_cache
+from ingest import read_tmdb_csvs
+from instrumentation import enable, format_report, is_enabled, stage
+from movie_index import build_movie_index
+from similar_movies import SIMILAR_MOVIES_FILE, compute_similar_movies, save_similar_movies
+from snapshot import load_or_build
+from tmdb_client import TMDB_API_KEY
+from visualize_graph import LAYOUT_FILE, compute_layout, graph_signature, save_layout
+
+GENRE_NODE_PREFIX = 'genre:'
+
+# Number of movies fetched from TMDB and added to the graph. The 'hub' graph grows linearly
+# with the number of movies, so this can be raised (or set to None) without running out of memory.
+MOVIE_LIMIT = 1035
 
 def parse_json_column(df, column_name):
     """
@@ -36,14 +51,19 @@ def extract_names_from_json(json_data):
 
 def load_cache(cache_file):
     """
-    Loads JSON data from a specified file if it exists.
+    Loads the TMDB cache from a specified file.
+
+    A '.json' file is loaded into a dictionary. Any other file is opened as a cache store (an SQLite
+    database, or a JSON lines log for '.jsonl'), which is filled from cache.json the first time.
 
     Args:
-    cache_file (str): File path of the JSON cache file.
+    cache_file (str): File path of the cache.
 
     Returns:
-    dict: The loaded JSON data as a dictionary, or an empty dictionary if the file does not exist.
+    dict or cache_store.SqliteCache or cache_store.JsonlCache: The cache, empty if the file does not exist.
     """
+    if not cache_file.endswith('.json'):
+        return open_cache(cache_file)
     if os.path.exists(cache_file):
         with open(cache_file, 'r') as file:
             return json.load(file)
@@ -85,24 +105,139 @@ def add_genre_edges(graph, df):
             else:
                 genre_dict[genre] = [movie_id]
 
-def create_movie_graph(df):
+def genre_node(genre):
+    """
+    Returns the node key used for the hub node of a genre.
+
+    Args:
+    genre (str): The name of the genre.
+
+    Returns:
+    str: The hub node key, e.g. 'genre:Drama'. Movie nodes are keyed by integer ids, so the keys never collide.
+    """
+    return GENRE_NODE_PREFIX + genre
+
+def add_genre_hub_edges(graph, df):
+    """
+    Connects every movie to one hub node per genre instead of to every other movie of that genre.
+
+    The number of edges equals the number of (movie, genre) pairs, so the graph grows linearly
+    with the dataset rather than quadratically like add_genre_edges.
+
+    Args:
+    graph (networkx.Graph): The graph to which the hub nodes and edges will be added.
+    df (pandas.DataFrame): The DataFrame containing movie data, including genres.
+    """
+    for movie_id, genres in zip(df['id'], df['genre_names']):
+        for genre in genres:
+            hub = genre_node(genre)
+            if hub not in graph:
+                graph.add_node(hub, kind='genre', title=genre, genres=[genre])
+            graph.add_edge(movie_id, hub)
+
+def movie_nodes(graph):
+    """
+    Iterates over the movie nodes of a graph, skipping genre hub nodes.
+
+    Args:
+    graph (networkx.Graph): A movie graph built in either 'clique' or 'hub' mode.
+
+    Returns:
+    generator: Yields (movie_id, node_data) tuples like graph.nodes(data=True).
+    """
+    return ((node_id, data) for node_id, data in graph.nodes(data=True) if data.get('kind', 'movie') == 'movie')
+
+def genre_neighbors(graph, movie_id):
+    """
+    Returns the movies sharing at least one genre with a movie.
+
+    In 'hub' mode the neighbours are found two hops away through the genre hubs; in 'clique'
+    mode they are the direct neighbours. A 'similarity' graph does not encode genres in its edges,
+    so all movies are scanned.
+
+    Args:
+    graph (networkx.Graph): A movie graph built in either 'clique' or 'hub' mode.
+    movie_id (int): The id of the movie.
+
+    Returns:
+    set: The ids of the neighbouring movies, excluding the movie itself.
+    """
+    if graph.graph.get('mode') == 'similarity':
+        genres = set(graph.nodes[movie_id]['genres'])
+        return {node_id for node_id, data in movie_nodes(graph) if node_id != movie_id and genres.intersection(data['genres'])}
+    if graph.graph.get('mode') != 'hub':
+        return set(graph.neighbors(movie_id))
+    neighbors = set()
+    for hub in graph.neighbors(movie_id):
+        neighbors.update(graph.neighbors(hub))
+    neighbors.discard(movie_id)
+    return neighbors
+
+def genre_overlap(graph, movie_id, other_movie_id):
+    """
+    Counts the genres two movies have in common.
+
+    Args:
+    graph (networkx.Graph): A movie graph built in either 'clique' or 'hub' mode.
+    movie_id (int): The id of the first movie.
+    other_movie_id (int): The id of the second movie.
+
+    Returns:
+    int: The number of shared genres.
+    """
+    return len(set(graph.nodes[movie_id]['genres']).intersection(graph.nodes[other_movie_id]['genres']))
+
+def add_similarity_edges(graph, df, k=10):
+    """
+    Connects every movie to its approximately k most similar movies, weighted by similarity.
+
+    Similarity is the Jaccard similarity of the movies' genres, cast, crew, keywords and production
+    companies, estimated with MinHash and locality-sensitive hashing (see similarity_graph.py), so
+    the graph is built in sub-quadratic time and has at most about 2k edges per movie on average.
+
+    Args:
+    graph (networkx.Graph): The graph to which the edges will be added.
+    df (pandas.DataFrame): The DataFrame containing movie data.
+    k (int): The number of neighbours each movie keeps.
+    """
+    from similarity_graph import similarity_edges
+
+    pairs, weights = similarity_edges(df, k=k)
+    ids = df['id'].to_numpy()
+    graph.add_weighted_edges_from(zip(ids[pairs[:, 0]].tolist(), ids[pairs[:, 1]].tolist(), weights.tolist()))
+
+def create_movie_graph(df, mode='hub', k=10):
     """
     Creates a graph from a DataFrame of movie data.
 
     Each movie in the DataFrame is represented as a node in the graph, with attributes such as
-    title and genres. Edges are added between movies that share genres.
+    title and genres. In 'hub' mode every movie is connected to a hub node for each of its genres;
+    in 'clique' mode edges are added directly between movies that share genres; in 'similarity'
+    mode every movie is connected to its k most similar movies, with the similarity as edge 'weight'.
 
     Args:
     df (pandas.DataFrame): The DataFrame containing movie data.
+    mode (str): 'hub' (movie-genre bipartite graph), 'clique' (movie-movie graph) or 'similarity' (weighted k-nearest-neighbour graph).
+    k (int): The number of neighbours per movie in 'similarity' mode.
 
     Returns:
     networkx.Graph: A graph representing the movies and their relationships based on shared genres.
     """
-    G = nx.Graph()
-    for index, row in df.iterrows():
-        G.add_node(row['id'], title=row['original_title'], genres=row['genre_names'])
-    
-    add_genre_edges(G, df)
+    if mode not in ('hub', 'clique', 'similarity'):
+        raise ValueError(f"Unknown graph mode: {mode}")
+
+    import networkx as nx
+
+    G = nx.Graph(mode=mode)
+    for movie_id, title, genres in zip(df['id'], df['original_title'], df['genre_names']):
+        G.add_node(movie_id, title=title, genres=genres)
+
+    if mode == 'hub':
+        add_genre_hub_edges(G, df)
+    elif mode == 'similarity':
+        add_similarity_edges(G, df, k)
+    else:
+        add_genre_edges(G, df)
     return G
 
 def save_graph_to_json(graph, filename):
@@ -110,71 +245,173 @@ def save_graph_to_json(graph, filename):
     Saves a graph to a JSON file.
 
     This function converts a graph into a JSON format and writes it to a file, allowing
-    the graph to be saved and later reloaded.
+    the graph to be saved and later reloaded. The graph mode ('hub' or 'clique') is stored
+    with the graph attributes so the loaded graph can be queried the same way.
 
     Args:
     graph (networkx.Graph): The graph to be saved.
     filename (str): The path of the file where the graph should be saved.
     """
+    import networkx as nx
+
     graph_data = nx.readwrite.json_graph.node_link_data(graph)
     with open(filename, 'w') as f:
         json.dump(graph_data, f)
 
-def main():
+def save_graph_binary(graph, dirname):
     """
-    The main function of construct graph.
+    Saves a graph as CSR adjacency arrays plus a node attribute table in a directory.
 
-    This function performs several key tasks:
-    - Loads and processes movie data from CSV files.
-    - Creates a graph representing the relationships between movies.
-    - Saves the graph to a JSON file for later use.
+    The directory holds header.json (format version, graph mode, node/edge/movie counts and the genre
+    vocabulary) and .npy arrays that read_json_graph.load_graph_binary memory-maps:
+    - indptr, indices: the CSR adjacency over node positions, with both directions of every edge.
+    - node_kinds, node_ids: 0 and the movie id for movies, 1 and the genre code for genre hubs.
+    - sorted_ids, sorted_positions: the movie ids in ascending order and their node positions, for binary search.
+    - title_data, title_offsets: the UTF-8 titles of all nodes and their offsets.
+    - genre_indptr, genre_codes: the genre codes of every node, as a CSR list.
+    - weights: for 'similarity' graphs, the weight of every entry of indices.
 
-    The function is the entry point of the system and does not take any arguments or return any value.
-    """
-    credits_df = pd.read_csv('tmdb_5000_credits.csv')
-    movies_df = pd.read_csv('tmdb_5000_movies.csv')
+    The arrays are written to a temporary directory which then replaces `dirname`.
 
-    credits_df['cast'] = parse_json_column(credits_df, 'cast')
-    credits_df['crew'] = parse_json_column(credits_df, 'crew')
-    movies_df['genres'] = parse_json_column(movies_df, 'genres')
-    movies_df['keywords'] = parse_json_column(movies_df, 'keywords')
-    movies_df['production_companies'] = parse_json_column(movies_df, 'production_companies')
-    movies_df['production_countries'] = parse_json_column(movies_df, 'production_countries')
-    movies_df['spoken_languages'] = parse_json_column(movies_df, 'spoken_languages')
+    Args:
+    graph (networkx.Graph): The graph to be saved, built in either 'clique' or 'hub' mode.
+    dirname (str): The path of the directory where the graph should be saved.
+    """
+    nodes = list(graph.nodes(data=True))
+    positions = {node_id: position for position, (node_id, _) in enumerate(nodes)}
+    genre_codes = {}
+    node_kinds = np.zeros(len(nodes), dtype=np.uint8)
+    node_ids = np.zeros(len(nodes), dtype=np.int64)
+    node_genre_codes, genre_counts, titles = [], [], []
+    for position, (node_id, data) in enumerate(nodes):
+        codes = [genre_codes.setdefault(genre, len(genre_codes)) for genre in data.get('genres', [])]
+        if data.get('kind', 'movie') == 'genre':
+            node_kinds[position] = 1
+            node_ids[position] = genre_codes.setdefault(data['title'], len(genre_codes))
+        else:
+            node_ids[position] = node_id
+        node_genre_codes.extend(codes)
+        genre_counts.append(len(codes))
+        titles.append(str(data.get('title', '')).encode('utf-8'))
+
+    edges = np.array([(positions[u], positions[v]) for u, v in graph.edges()], dtype=np.int64).reshape(-1, 2)
+    weights = None
+    if graph.graph.get('mode') == 'similarity':
+        weights = np.array([weight for _, _, weight in graph.edges(data='weight', default=1.0)], dtype=np.float32)
+    sources = np.concatenate([edges[:, 0], edges[:, 1]])
+    targets = np.concatenate([edges[:, 1], edges[:, 0]])
+    order = np.argsort(sources, kind='stable')
+    indptr = np.zeros(len(nodes) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=len(nodes)), out=indptr[1:])
+
+    movie_positions = np.flatnonzero(node_kinds == 0)
+    id_order = np.argsort(node_ids[movie_positions], kind='stable')
+
+    arrays = {
+        'indptr': indptr,
+        'indices': targets[order].astype(np.int32 if len(nodes) < 2 ** 31 else np.int64),
+        'node_kinds': node_kinds,
+        'node_ids': node_ids,
+        'sorted_ids': node_ids[movie_positions][id_order],
+        'sorted_positions': movie_positions[id_order],
+        'title_data': np.frombuffer(b''.join(titles), dtype=np.uint8),
+        'title_offsets': np.concatenate([[0], np.cumsum([len(title) for title in titles], dtype=np.int64)]).astype(np.int64),
+        'genre_indptr': np.concatenate([[0], np.cumsum(genre_counts, dtype=np.int64)]).astype(np.int64),
+        'genre_codes': np.array(node_genre_codes, dtype=np.int32),
+    }
+    if weights is not None:
+        arrays['weights'] = np.concatenate([weights, weights])[order]
+    header = {
+        'format': 'movie-graph-csr',
+        'version': 1,
+        'mode': graph.graph.get('mode', 'clique'),
+        'num_nodes': len(nodes),
+        'num_edges': graph.number_of_edges(),
+        'num_movies': int(movie_positions.size),
+        'genres': list(genre_codes),
+    }
+
+    temp_dirname = dirname + '.tmp'
+    shutil.rmtree(temp_dirname, ignore_errors=True)
+    os.makedirs(temp_dirname)
+    for name, array in arrays.items():
+        np.save(os.path.join(temp_dirname, name + '.npy'), array)
+    with open(os.path.join(temp_dirname, 'header.json'), 'w') as f:
+        json.dump(header, f)
+    shutil.rmtree(dirname, ignore_errors=True)
+    os.replace(temp_dirname, dirname)
+
+def build_final_df(cache_file, api_key):
+    """
+    Builds the merged movie table from the TMDB CSV files and the TMDB cache.
 
-    merged_df = pd.merge(movies_df, credits_df, how='left', left_on='id', right_on='movie_id')
+    Reads both CSVs chunk by chunk, keeping only the names from their JSON columns, merges the two files,
+    fetches the first MOVIE_LIMIT movies into the cache and joins the cached TMDB data.
 
-    merged_df['cast_names'] = merged_df['cast'].apply(extract_names_from_json)
-    merged_df['crew_names'] = merged_df['crew'].apply(extract_names_from_json)
-    merged_df['genre_names'] = merged_df['genres'].apply(extract_names_from_json)
-    merged_df['keyword_names'] = merged_df['keywords'].apply(extract_names_from_json)
-    merged_df['production_company_names'] = merged_df['production_companies'].apply(extract_names_from_json)
-    merged_df['production_country_names'] = merged_df['production_countries'].apply(extract_names_from_json)
-    merged_df['spoken_language_names'] = merged_df['spoken_languages'].apply(extract_names_from_json)
+    Args:
+    cache_file (str): The file path of the TMDB cache.
+    api_key (str): TMDb API key used to fetch movies missing from the cache.
 
-    merged_df = merged_df.drop(columns=['title_y', 'movie_id', 'cast', 'crew', 'genres', 'keywords', 'production_companies', 'production_countries', 'spoken_languages'])
+    Returns:
+    pandas.DataFrame: The merged movie table (final_df).
+    """
+    with stage('ingest_csv') as timer:
+        # Reads both CSVs in chunks (in parallel on several cores) and keeps only the names from the JSON columns.
+        merged_df = read_tmdb_csvs('tmdb_5000_movies.csv', 'tmdb_5000_credits.csv')
+        timer.count(rows=len(merged_df))
 
     merged_df.dropna(subset=['overview', 'release_date', 'runtime'], inplace=True)
 
-    cache_file = 'cache.json'
-    cache_data = load_cache(cache_file)
+    with stage('cache_join') as timer:
+        cache_data = load_cache(cache_file)
 
-    api_key = "2bd7f718b7eaf4479d7e043103aaaaaf"
+        for movie_id in merged_df['id'][:MOVIE_LIMIT]:
+            fetch_tmdb_data(movie_id, api_key, cache_data, cache_file)
 
-    for movie_id in merged_df['id'][:1035]:
-        fetch_tmdb_data(movie_id, api_key, cache_data, cache_file)
+        tmdb_data_df = cache_to_dataframe(cache_data)
+        if not isinstance(cache_data, dict):
+            cache_data.close()
 
-    with open(cache_file, 'r') as file:
-        cache_data = json.load(file)
+        final_df = pd.merge(merged_df, tmdb_data_df, on='id', how='left', suffixes=('_csv', ''))
+        timer.count(rows=len(final_df), cached=len(tmdb_data_df))
+    return final_df
 
-    tmdb_data_df = pd.DataFrame.from_dict(cache_data, orient='index').reset_index()
-    tmdb_data_df.rename(columns={'index': 'id'}, inplace=True)
-    tmdb_data_df['id'] = tmdb_data_df['id'].astype(int)
+def main():
+    """
+    The main function of construct graph.
 
-    final_df = pd.merge(merged_df, tmdb_data_df, on='id', how='left')
-    df=final_df[:1035]
-    G = create_movie_graph(df)
-    save_graph_to_json(G, 'movie_graph.json')
+    This function performs several key tasks:
+    - Loads and processes movie data from CSV files.
+    - Creates a graph representing the relationships between movies.
+    - Saves the graph to a JSON file and to the binary CSR format for later use.
+    - Computes the layout used to draw the graph and saves it next to the graph files.
+    - Precomputes the most similar movies of every movie for option 5 (see similar_movies.py).
+
+    The function is the entry point of the system and does not take any arguments or return any value.
+    """
+    cache_file = 'cache.sqlite'
+    api_key = TMDB_API_KEY
+    if os.environ.get('MOVIE_STATS'):
+        enable(trace_memory=os.environ['MOVIE_STATS'] == 'memory')
+    with stage('load_final_df') as timer:
+        final_df = load_or_build(lambda: build_final_df(cache_file, api_key))
+        timer.count(rows=len(final_df))
+    df = final_df[:MOVIE_LIMIT]
+    with stage('create_movie_graph') as timer:
+        G = create_movie_graph(df)
+        timer.count(nodes=G.number_of_nodes(), edges=G.number_of_edges())
+    with stage('save_graph'):
+        save_graph_to_json(G, 'movie_graph.json')
+        save_graph_binary(G, 'movie_graph')
+    with stage('network_layout'):
+        nodes, positions = compute_layout(G)
+        save_layout(LAYOUT_FILE, graph_signature(G), nodes, positions)
+    with stage('similar_movies') as timer:
+        index = build_movie_index(final_df, G)
+        save_similar_movies(SIMILAR_MOVIES_FILE, index, compute_similar_movies(index))
+        timer.count(movies=int(index['in_graph'].sum()))
+    if is_enabled():
+        print(format_report())
 
 if __name__ == '__main__':
     main()
@@ -4,14 +4,22 @@
 # In[1]:
 
 
+import numpy as np
 import pandas as pd
-import requests
-import time
 import json
 import os
-import networkx as nx
-import ast
-import matplotlib.pyplot as plt
+import time
+# matplotlib, networkx and requests are imported where they are used, so that the menu appears
+# without loading them; see load_model and main.
+from construct_graph import MOVIE_LIMIT, create_movie_graph, movie_nodes
+from movie_index import (build_lookup_index, build_movie_index, find_id_position, find_title_position, genre_matches, neighbor_scores,
+                         suggest_titles, top_k_positions)
+from cache_store import cache_to_dataframe, open_cache
+from ingest import read_tmdb_csvs
+from tmdb_client import TMDB_API_KEY
+from instrumentation import add_counts, enable, format_report, instrumented, is_enabled, stage
+from similar_movies import attach_similar_movies, similar_movie_positions
+from snapshot import load_or_build
 
 
 # In[2]:
@@ -44,14 +52,19 @@ def extract_names_from_json(json_data):
 
 def load_cache(cache_file):
     """
-    Loads JSON data from a specified file if it exists.
+    Loads the TMDB cache from a specified file.
+
+    A '.json' file is loaded into a dictionary. Any other file is opened as a cache store (an SQLite
+    database, or a JSON lines log for '.jsonl'), which is filled from cache.json the first time.
 
     Args:
-    cache_file (str): File path of the JSON cache file.
+    cache_file (str): File path of the cache.
 
     Returns:
-    dict: The loaded JSON data as a dictionary, or an empty dictionary if the file does not exist.
+    dict or cache_store.SqliteCache or cache_store.JsonlCache: The cache, empty if the file does not exist.
     """
+    if not cache_file.endswith('.json'):
+        return open_cache(cache_file)
     if os.path.exists(cache_file):
         with open(cache_file, 'r') as file:
             return json.load(file)
@@ -59,14 +72,22 @@ def load_cache(cache_file):
 
 def save_cache(cache_data, cache_file):
     """
-    Saves a dictionary as JSON to a specified file.
+    Saves the TMDB cache.
+
+    A dictionary is written as JSON to a temporary file that then replaces the cache file, so a crash
+    never leaves a half-written cache. A cache store only commits its buffered entries.
 
     Args:
-    cache_data (dict): The data to save.
+    cache_data (dict or cache_store.SqliteCache or cache_store.JsonlCache): The data to save.
     cache_file (str): File path where the JSON data should be saved.
     """
-    with open(cache_file, 'w') as file:
+    if not isinstance(cache_data, dict):
+        cache_data.flush()
+        return
+    temp_file = cache_file + '.tmp'
+    with open(temp_file, 'w') as file:
         json.dump(cache_data, file)
+    os.replace(temp_file, cache_file)
 
 def fetch_tmdb_data(movie_id, api_key, cache_data, cache_file):
     """
@@ -84,6 +105,8 @@ def fetch_tmdb_data(movie_id, api_key, cache_data, cache_file):
     if str(movie_id) in cache_data:  
         return cache_data[str(movie_id)]
 
+    import requests
+
     url = f"https://api.themoviedb.org/3/movie/{movie_id}?api_key={api_key}"
     response = requests.get(url)
     if response.status_code == 200:
@@ -93,7 +116,8 @@ def fetch_tmdb_data(movie_id, api_key, cache_data, cache_file):
             'revenue': data.get('revenue'),
             'tagline': data.get('tagline'),
             'vote_average': data.get('vote_average'),
-            'vote_count': data.get('vote_count')
+            'vote_count': data.get('vote_count'),
+            'fetched_at': time.time()
         }
         save_cache(cache_data, cache_file) 
         return cache_data[str(movie_id)]
@@ -123,179 +147,303 @@ def add_genre_edges(graph, df):
 # In[3]:
 
 
-def recommend_movies_based_on_genre(genres, graph, num_recommendations=5):
+@instrumented()
+def recommend_movies_based_on_genre(genres, graph, num_recommendations=5, index=None, rank_by=None):
     """
     Recommends movies based on specified genres from a given graph.
 
+    Without an index, the movie nodes are walked in the order they were added to the graph and the
+    first movies having all the genres are returned. With the index, the same movies are found with
+    bitmask comparisons over the whole catalogue (see movie_index.genre_matches), and they can be
+    ranked instead.
+
     Args:
     genres (list): A list of genres to filter movies by.
     graph (networkx.Graph): The graph representing movies and their relationships.
     num_recommendations (int): The number of recommended movies to return.
+    index (dict): The index from movie_index.build_movie_index(df, graph), if it was built.
+    rank_by (str): None to keep the graph order, or 'vote_average' or 'popularity' to return the
+    best rated or most popular matches first, with the other one breaking ties. Ranking needs the index.
 
     Returns:
     list: A list of dictionaries, each containing 'id' and 'title' of the recommended movies.
+
+    Raises:
+    ValueError: If rank_by is not one of the above, or is given without an index.
     """
+    if rank_by not in (None, 'vote_average', 'popularity'):
+        raise ValueError(f"Cannot rank by {rank_by!r}")
+    if index is not None:
+        if rank_by is None:
+            positions = genre_matches(index, genres, num_recommendations)
+        else:
+            matches = genre_matches(index, genres)
+            keys = [index['vote_average'], index['popularity']]
+            positions = top_k_positions(keys if rank_by == 'vote_average' else keys[::-1], matches, num_recommendations)
+        add_counts(matches=len(positions))
+        slots = np.searchsorted(index['node_positions'], positions).tolist()
+        return [{'id': int(index['ids'][position]), 'title': index['node_titles'][slot]} for position, slot in zip(positions.tolist(), slots)]
+    if rank_by is not None:
+        raise ValueError("Ranking the movies of a genre needs the movie index")
+
     recommended_movies = []
 
-    for node in graph.nodes(data=True):
+    scored = 0
+    for node in movie_nodes(graph):
+        scored += 1
         if all(genre in node[1]['genres'] for genre in genres):
             recommended_movies.append({'id': node[0], 'title': node[1]['title']})
+    add_counts(candidates=scored, matches=len(recommended_movies))
 
     return recommended_movies[:num_recommendations]
 
-def recommend_movies_with_detailed_info(liked_movie_titles, df, graph, num_recommendations=5):
+@instrumented()
+def recommend_movies_with_detailed_info(liked_movie_titles, df, graph, num_recommendations=5, index=None):
     """
     Recommends movies based on detailed information like genres overlap with liked movies.
 
+    Movies are ranked by the total number of genres they share with the liked movies, then by
+    vote_average and popularity. The overlap of every movie is computed at once as a product of the
+    precomputed multi-hot genre matrix with the liked movies' genre counts, and only the best
+    candidates are sorted. When the index has the precomputed similar-movies table (see
+    similar_movies.py), the answer is taken from the merged lists of the liked movies whenever they
+    are enough to decide it. With a 'similarity' graph, movies are first ranked by the sum of their
+    similarities to the liked movies, and the genre overlap only breaks ties.
+
     Args:
     liked_movie_titles (list): A list of movie titles that the user likes.
     df (pandas.DataFrame): DataFrame containing movie data.
     graph (networkx.Graph): The graph representing movies and their relationships.
     num_recommendations (int): Number of recommendations to return.
+    index (dict): The index from movie_index.build_movie_index(df, graph). It is built on the fly if not given.
 
     Returns:
     list: A list of dictionaries with recommended movies' 'id' and 'title'.
     """
-    genre_overlap_count = {}
-    liked_movies_info = {}
-    liked_movie_ids = [] 
+    if index is None:
+        index = build_movie_index(df, graph)
 
+    liked_movie_ids = []
+    liked_positions = {}
     for movie_title in liked_movie_titles:
-        movie_row = df[df['title_x'] == movie_title]
-        if not movie_row.empty:
-            movie_id = movie_row.iloc[0]['id']
-            liked_movie_ids.append(movie_id) 
-            if movie_id in graph:
-                movie_info = graph.nodes[movie_id]
-                liked_movies_info[movie_id] = {'title': movie_info['title'], 'genres': movie_info['genres']}  
-
-    for node in graph.nodes(data=True):
-        movie_genres = set(node[1]['genres'])
-        total_overlap = sum(len(movie_genres.intersection(liked_genres['genres'])) for liked_genres in liked_movies_info.values())
-        genre_overlap_count[node[0]] = total_overlap
-
-    df_copy = df.copy()
-    df_copy['genre_overlap'] = df_copy['id'].map(genre_overlap_count)
-
-    sorted_movies = df_copy.sort_values(by=['genre_overlap', 'vote_average', 'popularity'], ascending=[False, False, False])
-    sorted_movies = sorted_movies[~sorted_movies['id'].isin(liked_movie_ids)]  
-    
-    recommended_movies_info = sorted_movies.head(num_recommendations)
-    return [{'id': row['id'], 'title': row['title_x']} for _, row in recommended_movies_info.iterrows()]
-
-
-def recommend_movies(preferences, df, graph, num_recommendations=5):
+        position = index['title_positions'].get(movie_title)
+        if position is not None:
+            movie_id = index['ids'][position]
+            liked_movie_ids.append(movie_id)
+            if index['in_graph'][position]:
+                liked_positions.setdefault(movie_id, index['id_positions'][movie_id])
+
+    if 'similar_movies' in index and 'similarity_indptr' not in index:
+        positions = similar_movie_positions(index, list(liked_positions.values()), liked_movie_ids, num_recommendations)
+        if positions is not None:
+            add_counts(candidates=0, precomputed=1)
+            return [{'id': int(index['ids'][position]), 'title': index['titles'][position]} for position in positions]
+
+    liked_genre_counts = index['genre_matrix'][list(liked_positions.values())].sum(axis=0)
+    genre_overlap = index['genre_matrix'] @ liked_genre_counts
+    genre_overlap = np.where(index['in_graph'], genre_overlap, -np.inf)
+
+    candidates = np.flatnonzero(~np.isin(index['ids'], liked_movie_ids))
+    add_counts(candidates=candidates.size)
+    keys = [genre_overlap, index['vote_average'], index['popularity']]
+    if 'similarity_indptr' in index:
+        keys.insert(0, neighbor_scores(index, list(liked_positions.values())))
+    positions = top_k_positions(keys, candidates, num_recommendations)
+    return [{'id': int(index['ids'][position]), 'title': index['titles'][position]} for position in positions]
+
+
+@instrumented()
+def recommend_movies(preferences, df, graph, num_recommendations=5, index=None):
     """
     Recommends movies based on a set of user preferences including genres, cast, and crew.
 
+    The movies matching each preference are read from the inverted indexes and intersected; a
+    preference that matches no movie is ignored. Each remaining movie is scored by the number of
+    genres it shares with the last matching movie (or, for that movie itself, with the last other
+    matching movie), then ranked by vote_average and popularity. Only movies in the graph are recommended.
+    With a 'similarity' graph, the matching movies are first ranked by the sum of their similarities
+    to the other matching movies, so the most typical matches come first.
+
     Args:
     preferences (dict): A dictionary of user preferences.
     df (pandas.DataFrame): DataFrame containing movie data.
     graph (networkx.Graph): The graph representing movies and their relationships.
     num_recommendations (int): Number of recommendations to return.
+    index (dict): The index from movie_index.build_movie_index(df, graph). It is built on the fly if not given.
 
     Returns:
     list: A list of dictionaries with recommended movies' 'id' and 'title'.
     """
-    genre_filtered = cast_filtered = crew_filtered = pd.DataFrame()
-    if 'genres' in preferences and preferences['genres']:
-        genre_filtered = df[df['genre_names'].apply(lambda x: preferences['genres'] in x)]
-    if 'cast_name' in preferences and preferences['cast_name']:
-        cast_filtered = df[df['cast_names'].apply(lambda x: preferences['cast_name'] in x)]
-    if 'crew_name' in preferences and preferences['crew_name']:
-        crew_filtered = df[df['crew_names'].apply(lambda x: preferences['crew_name'] in x)]
-
-    filtered_movies = df.copy()
-    if not genre_filtered.empty:
-        filtered_movies = filtered_movies[filtered_movies['id'].isin(genre_filtered['id'])]
-    if not cast_filtered.empty:
-        filtered_movies = filtered_movies[filtered_movies['id'].isin(cast_filtered['id'])]
-    if not crew_filtered.empty:
-        filtered_movies = filtered_movies[filtered_movies['id'].isin(crew_filtered['id'])]
-
-    genre_overlap_count = {}
-    for node_id, node_data in graph.nodes(data=True):
-        node_genres = set(node_data['genres'])
-        for _, movie_row in filtered_movies.iterrows():
-            if node_id == movie_row['id']:
-                continue
-            movie_genres = set(graph.nodes[movie_row['id']]['genres']) if movie_row['id'] in graph else set()
-            total_overlap = len(node_genres.intersection(movie_genres))
-            genre_overlap_count[node_id] = total_overlap
-
-    filtered_movies['genre_overlap'] = filtered_movies['id'].map(genre_overlap_count)
-
-    sorted_movies = filtered_movies.sort_values(by=['genre_overlap', 'vote_average', 'popularity'], ascending=[False, False, False])
-
-    recommended_movies_info = sorted_movies.head(num_recommendations)
-    return [{'id': row['id'], 'title': row['title_x']} for _, row in recommended_movies_info.iterrows()]
+    if index is None:
+        index = build_movie_index(df, graph)
+
+    in_graph = np.flatnonzero(index['in_graph'])
+    filtered = in_graph
+    for preference, postings in (('genres', 'genre_postings'), ('cast_name', 'cast_postings'), ('crew_name', 'crew_postings')):
+        if preference in preferences and preferences[preference]:
+            matches = np.intersect1d(in_graph, index[postings].get(preferences[preference], in_graph[:0]), assume_unique=True)
+            if matches.size:
+                filtered = np.intersect1d(filtered, matches, assume_unique=True)
+    if filtered.size == 0:
+        return []
+
+    add_counts(candidates=filtered.size)
+    filtered_ids = index['ids'][filtered]
+    genre_matrix = index['genre_matrix']
+    genre_overlap = np.full(len(index['ids']), -np.inf)
+    genre_overlap[filtered] = genre_matrix[filtered] @ genre_matrix[filtered[-1]]
+    is_last_movie = filtered_ids == filtered_ids[-1]
+    other_movies = filtered[~is_last_movie]
+    if other_movies.size:
+        genre_overlap[filtered[is_last_movie]] = genre_matrix[filtered[is_last_movie]] @ genre_matrix[other_movies[-1]]
+    else:
+        genre_overlap[filtered[is_last_movie]] = -np.inf
+
+    keys = [genre_overlap, index['vote_average'], index['popularity']]
+    if 'similarity_indptr' in index:
+        keys.insert(0, neighbor_scores(index, filtered))
+    positions = top_k_positions(keys, filtered, num_recommendations)
+    return [{'id': int(index['ids'][position]), 'title': index['titles'][position]} for position in positions]
 
 
 # In[4]:
 
 
-def main():
+def print_title_suggestions(index, query):
     """
-    Main function to run the Movie Recommendation System. It performs several tasks including:
-    - Loading and merging movie datasets.
-    - Parsing JSON columns in the datasets.
-    - Creating a graph structure to represent movies and their relationships.
-    - Providing an interactive command-line interface for users to interact with the system.
-
-    The user can query movie details, view genres, visualize the movie network, and get movie recommendations based on different criteria.
+    Prints "did you mean" suggestions for a title that was not found.
 
-    The function does not take any arguments and returns nothing. It continuously runs an interactive loop until the user decides to exit.
+    Args:
+    index (dict): The index from movie_index.build_movie_index.
+    query (str): The title the user typed.
     """
-    credits_df = pd.read_csv('tmdb_5000_credits.csv')
-    movies_df = pd.read_csv('tmdb_5000_movies.csv')
+    suggestions = suggest_titles(index, query)
+    if suggestions:
+        print(f"Did you mean: {', '.join(suggestions)}?")
 
-    credits_df['cast'] = parse_json_column(credits_df, 'cast')
-    credits_df['crew'] = parse_json_column(credits_df, 'crew')
-    movies_df['genres'] = parse_json_column(movies_df, 'genres')
-    movies_df['keywords'] = parse_json_column(movies_df, 'keywords')
-    movies_df['production_companies'] = parse_json_column(movies_df, 'production_companies')
-    movies_df['production_countries'] = parse_json_column(movies_df, 'production_countries')
-    movies_df['spoken_languages'] = parse_json_column(movies_df, 'spoken_languages')
+def build_final_df(cache_file, api_key):
+    """
+    Builds the merged movie table from the TMDB CSV files and the TMDB cache.
 
-    merged_df = pd.merge(movies_df, credits_df, how='left', left_on='id', right_on='movie_id')
+    Reads both CSVs chunk by chunk, keeping only the names from their JSON columns, merges the two files,
+    fetches the first MOVIE_LIMIT movies into the cache concurrently and joins the cached TMDB data.
 
-    merged_df['cast_names'] = merged_df['cast'].apply(extract_names_from_json)
-    merged_df['crew_names'] = merged_df['crew'].apply(extract_names_from_json)
-    merged_df['genre_names'] = merged_df['genres'].apply(extract_names_from_json)
-    merged_df['keyword_names'] = merged_df['keywords'].apply(extract_names_from_json)
-    merged_df['production_company_names'] = merged_df['production_companies'].apply(extract_names_from_json)
-    merged_df['production_country_names'] = merged_df['production_countries'].apply(extract_names_from_json)
-    merged_df['spoken_language_names'] = merged_df['spoken_languages'].apply(extract_names_from_json)
+    Args:
+    cache_file (str): The file path of the TMDB cache.
+    api_key (str): TMDb API key used to fetch movies missing from the cache.
 
-    merged_df = merged_df.drop(columns=['title_y', 'movie_id', 'cast', 'crew', 'genres', 'keywords', 'production_companies', 'production_countries', 'spoken_languages'])
+    Returns:
+    pandas.DataFrame: The merged movie table (final_df).
+    """
+    with stage('ingest_csv') as timer:
+        # Reads both CSVs in chunks (in parallel on several cores) and keeps only the names from the JSON columns.
+        merged_df = read_tmdb_csvs('tmdb_5000_movies.csv', 'tmdb_5000_credits.csv')
+        timer.count(rows=len(merged_df))
 
     merged_df.dropna(subset=['overview', 'release_date', 'runtime'], inplace=True)
 
-    cache_file = 'cache.json'
-    cache_data = load_cache(cache_file)
+    with stage('cache_join') as timer:
+        cache_data = load_cache(cache_file)
 
-    api_key = "2bd7f718b7eaf4479d7e043103aaaaaf"
+        with stage('fetch_tmdb') as fetch_timer:
+            from tmdb_client import fetch_tmdb_data_bulk
+            fetch_stats = fetch_tmdb_data_bulk(merged_df['id'][:MOVIE_LIMIT].tolist(), api_key, cache_data)
+            if fetch_stats['fetched']:
+                save_cache(cache_data, cache_file)
+            fetch_timer.count(fetched=fetch_stats['fetched'], failed=fetch_stats['failed'], cached=fetch_stats['cached'])
 
-    for movie_id in merged_df['id'][:1035]:
-        fetch_tmdb_data(movie_id, api_key, cache_data, cache_file)
+        tmdb_data_df = cache_to_dataframe(cache_data)
+        if not isinstance(cache_data, dict):
+            cache_data.close()
 
-    with open(cache_file, 'r') as file:
-        cache_data = json.load(file)
+        final_df = pd.merge(merged_df, tmdb_data_df, on='id', how='left', suffixes=('_csv', ''))
+        timer.count(rows=len(final_df), cached=len(tmdb_data_df))
+    return final_df
 
-    tmdb_data_df = pd.DataFrame.from_dict(cache_data, orient='index').reset_index()
-    tmdb_data_df.rename(columns={'index': 'id'}, inplace=True)
-    tmdb_data_df['id'] = tmdb_data_df['id'].astype(int)
+def load_model(cache_file='cache.sqlite', api_key=TMDB_API_KEY, graph_mode='hub'):
+    """
+    Loads everything the recommenders need: the movie table, the genre graph and the movie index.
 
-    final_df = pd.merge(merged_df, tmdb_data_df, on='id', how='left')
-    df=final_df[:1035]
-    G = nx.Graph()
-    for index, row in df.iterrows():
-        genres = row['genre_names']
-        G.add_node(row['id'], title=row['original_title'], genres=genres)
-    add_genre_edges(G, df)
+    Args:
+    cache_file (str): The file path of the TMDB cache.
+    api_key (str): TMDb API key used to fetch movies missing from the cache.
+    graph_mode (str): The create_movie_graph mode: 'hub', 'clique' or 'similarity'.
+
+    Returns:
+    tuple: (final_df, graph, index) - the merged movie table, the graph of its first MOVIE_LIMIT
+    movies and the index from movie_index.build_movie_index.
+    """
+    final_df = load_final_df(cache_file, api_key)
+    G, index = build_graph_model(final_df, mode=graph_mode)
+    return final_df, G, index
+
+def load_final_df(cache_file='cache.sqlite', api_key=TMDB_API_KEY):
+    """
+    Loads the movie table from the snapshot, or builds it (and the snapshot) from the source files.
+
+    Args:
+    cache_file (str): The file path of the TMDB cache.
+    api_key (str): TMDb API key used to fetch movies missing from the cache.
 
-    num_nodes = G.number_of_nodes()
-    num_edges = G.number_of_edges()
+    Returns:
+    pandas.DataFrame: The merged movie table (final_df).
+    """
+    with stage('load_final_df') as timer:
+        final_df = load_or_build(lambda: build_final_df(cache_file, api_key))
+        timer.count(rows=len(final_df))
+    return final_df
+
+def build_graph_model(final_df, lookup=None, mode='hub'):
+    """
+    Builds the genre graph of the first MOVIE_LIMIT movies and the movie index used by the recommenders.
+
+    Args:
+    final_df (pandas.DataFrame): The merged movie table.
+    lookup (dict): The result of movie_index.build_lookup_index(final_df), if it was already built.
+    mode (str): The create_movie_graph mode; 'similarity' also makes options 5 and 6 rank by similarity.
+    In the other modes the precomputed similar-movies table is attached to the index when it is up to date.
+
+    Returns:
+    tuple: (graph, index).
+    """
+    with stage('create_movie_graph') as timer:
+        G = create_movie_graph(final_df[:MOVIE_LIMIT], mode=mode)
+        timer.count(nodes=G.number_of_nodes(), edges=G.number_of_edges())
+    with stage('build_movie_index') as timer:
+        index = build_movie_index(final_df, G, lookup)
+        timer.count(rows=len(index['ids']), genres=len(index['genres']))
+    if mode != 'similarity':
+        with stage('load_similar_movies') as timer:
+            timer.count(loaded=int(attach_similar_movies(index)))
+    return G, index
+
+def main():
+    """
+    Main function to run the Movie Recommendation System. It performs several tasks including:
+    - Loading and merging movie datasets.
+    - Parsing JSON columns in the datasets.
+    - Creating a graph structure to represent movies and their relationships.
+    - Providing an interactive command-line interface for users to interact with the system.
+
+    The user can query movie details, view genres, visualize the movie network, and get movie recommendations based on different criteria.
+
+    The function does not take any arguments and returns nothing. It continuously runs an interactive loop until the user decides to exit.
+
+    Only the movie table and its title/id lookups are loaded before the menu is shown. The graph and
+    the recommender index are built the first time an option needs them (3 to 6). Set
+    MOVIE_GRAPH_MODE=similarity to recommend from the weighted similarity graph instead of the genre graph.
+    """
+    if os.environ.get('MOVIE_STATS'):
+        enable(trace_memory=os.environ['MOVIE_STATS'] == 'memory')
+    final_df = load_final_df()
+    with stage('build_lookup_index'):
+        index = build_lookup_index(final_df)
+    graph_model = {}
+
+    def get_graph_model():
+        if not graph_model:
+            graph_model['G'], graph_model['index'] = build_graph_model(final_df, index, os.environ.get('MOVIE_GRAPH_MODE', 'hub'))
+        return graph_model['G'], graph_model['index']
 
     while True:
         print("\nMovie Recommendation System")
@@ -306,13 +454,15 @@ def main():
         print("5 - Recommend Movies Based on Liked Movie History")
         print("6 - Recommend Movies Based on Favorite Genre, Cast, and Crew")
         print("7 - Exit")
+        print("8 - Show Performance Statistics")
 
         choice = input("Enter the number of your choice: ")
         
         
         if choice == '1':
             query = input("Enter the movie title to query: ")
-            movie_details = final_df[final_df['title_x'] == query]
+            position = find_title_position(index, query)
+            movie_details = final_df.iloc[[] if position is None else [position]]
             if not movie_details.empty:
                 print("\nSelect information to display:")
                 print("1 - Basic Information")
@@ -339,8 +489,11 @@ def main():
                 print(movie_details[display_cols].iloc[0])
             else:
                 print("Movie not found.")
+                print_title_suggestions(index, query)
         
         elif choice == "2":
+            import matplotlib.pyplot as plt
+
             genre_counts = final_df['genre_names'].explode().value_counts()
             plt.figure(figsize=(12, 6))
             genre_counts.plot(kind='bar')
@@ -351,14 +504,11 @@ def main():
             plt.show()
             
         elif choice == '3':
-            sub_nodes = list(G.nodes)
-            sub_graph = G.subgraph(sub_nodes)
-            plt.figure(figsize=(12, 12))
-            pos = nx.spring_layout(sub_graph)
-            nx.draw_networkx_nodes(sub_graph, pos, node_size=10)
-            nx.draw_networkx_edges(sub_graph, pos, width=0.0005)
-            plt.title("Network Visualization")
-            plt.show()
+            from visualize_graph import draw_network
+
+            G, _ = get_graph_model()
+            filename, reused = draw_network(G)
+            print(f"Network visualization written to {filename}" + (" (saved layout reused)" if reused else ''))
 
         elif choice == '4':
             while True:
@@ -368,7 +518,8 @@ def main():
 
                 not_found_genres = [genre for genre in genres if genre not in available_genres]
                 if not not_found_genres:
-                    recommendations = recommend_movies_based_on_genre(genres, G, num_recommendations=5)
+                    G, index = get_graph_model()
+                    recommendations = recommend_movies_based_on_genre(genres, G, num_recommendations=5, index=index)
                     print("Recommended Movies (ID - Title): ")
                     for movie in recommendations:
                         print(f"{movie['id']} - {movie['title']}")
@@ -380,15 +531,20 @@ def main():
             while True:
                 movie_titles_input = input("Enter desired movie titles, separated by commas: ")
                 movie_titles = [title.strip() for title in movie_titles_input.split(',')]
-                not_found_titles = [title for title in movie_titles if final_df[final_df['title_x'] == title].empty]
+                positions = [find_title_position(index, title) for title in movie_titles]
+                not_found_titles = [title for title, position in zip(movie_titles, positions) if position is None]
                 if not not_found_titles:
-                    recommendations = recommend_movies_with_detailed_info(movie_titles, final_df, G, num_recommendations=5)
+                    movie_titles = [index['titles'][position] for position in positions]
+                    G, graph_index = get_graph_model()
+                    recommendations = recommend_movies_with_detailed_info(movie_titles, final_df, G, num_recommendations=5, index=graph_index)
                     print("Recommended Movies (ID - Title): ")
                     for movie in recommendations:
                         print(f"{movie['id']} - {movie['title']}")
                     break
                 else:
                     print(f"These titles were not found: {', '.join(not_found_titles)}. Please try again.")
+                    for title in not_found_titles:
+                        print_title_suggestions(index, title)
 
         elif choice == '6':
             preferences = {}
@@ -402,7 +558,8 @@ def main():
             if crew_pref:
                 preferences['crew_name'] = crew_pref
 
-            recommended_movies = recommend_movies(preferences, df, graph = G, num_recommendations=5)
+            G, graph_index = get_graph_model()
+            recommended_movies = recommend_movies(preferences, final_df, graph = G, num_recommendations=5, index=graph_index)
             print("Recommended Movies (ID - Title): ")
             for movie in recommended_movies:
                 print(f"{movie['id']} - {movie['title']}")
@@ -411,6 +568,12 @@ def main():
             print("Thank you for using the Movie Recommendation System!")
             break
 
+        elif choice == '8':
+            if is_enabled():
+                print(format_report())
+            else:
+                print("Statistics are off. Start the program with MOVIE_STATS=1 (or MOVIE_STATS=memory to also trace memory).")
+
         else:
             print("Invalid input, please try again!")
 
@@ -421,7 +584,8 @@ def main():
                     break
                 elif detail_choice.isdigit():
                     movie_id = int(detail_choice)
-                    movie_details = final_df[final_df['id'] == movie_id]
+                    position = find_id_position(index, movie_id)
+                    movie_details = final_df.iloc[[] if position is None else [position]]
                     if not movie_details.empty:
                         print("\nSelect information to display:")
                         print("1 - Basic Information")
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import json
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from name_lists import NameListArray
+
+# The JSON list columns of each CSV and the name list column each one is reduced to.
+MOVIE_NAME_COLUMNS = {
+    'genres': 'genre_names', 'keywords': 'keyword_names', 'production_companies': 'production_company_names',
+    'production_countries': 'production_country_names', 'spoken_languages': 'spoken_language_names',
+}
+CREDIT_NAME_COLUMNS = {'cast': 'cast_names', 'crew': 'crew_names'}
+# The order of the name columns in final_df, as produced by the original pipeline.
+NAME_COLUMN_ORDER = ['cast_names', 'crew_names', 'genre_names', 'keyword_names', 'production_company_names',
+                     'production_country_names', 'spoken_language_names']
+
+def extract_names(text):
+    """
+    Parses one JSON list cell and keeps only the 'name' of each item.
+    """
+    return [item['name'] for item in json.loads(text) if 'name' in item]
+
+def reduce_chunk(chunk, name_columns):
+    """
+    Replaces the JSON list columns of a CSV chunk by the lists of names they contain.
+
+    Args:
+    chunk (pandas.DataFrame): Rows of tmdb_5000_movies.csv or tmdb_5000_credits.csv.
+    name_columns (dict): The JSON columns to reduce and the name of the resulting column.
+
+    Returns:
+    pandas.DataFrame: The chunk without the JSON text, with the name columns appended as NameListArrays.
+    """
+    names = {name_column: NameListArray.from_lists(extract_names(text) for text in chunk[column])
+             for column, name_column in name_columns.items()}
+    chunk = chunk.drop(columns=list(name_columns))
+    for name_column, values in names.items():
+        chunk[name_column] = values
+    return chunk
+
+def read_reduced_csv(filename, name_columns, chunk_size=2000, workers=None):
+    """
+    Reads a TMDB CSV in chunks and reduces the JSON columns of every chunk to name lists as soon as it is read.
+
+    The chunks are reduced in a pool of worker processes. At most two chunks per worker are read
+    ahead, so the raw JSON text of only a bounded number of rows is in memory at any time, and the
+    results are kept in file order. A file that fits in one chunk is reduced in this process.
+
+    Args:
+    filename (str): The CSV file.
+    name_columns (dict): The JSON columns to reduce (MOVIE_NAME_COLUMNS or CREDIT_NAME_COLUMNS).
+    chunk_size (int): The number of rows per chunk.
+    workers (int): The number of worker processes; all cores by default, 1 to reduce in this process.
+
+    Returns:
+    pandas.DataFrame: The file without its JSON columns, with one name list column per JSON column.
+    """
+    workers = workers or os.cpu_count() or 1
+    chunks = pd.read_csv(filename, chunksize=chunk_size)
+    first = next(chunks, None)
+    if first is None:
+        return reduce_chunk(pd.read_csv(filename), name_columns)
+    second = next(chunks, None)
+    if second is None or workers == 1:
+        reduced = [reduce_chunk(first, name_columns)]
+        if second is not None:
+            reduced.append(reduce_chunk(second, name_columns))
+            reduced.extend(reduce_chunk(chunk, name_columns) for chunk in chunks)
+        return pd.concat(reduced, ignore_index=True)
+
+    context = multiprocessing.get_context('fork' if 'fork' in multiprocessing.get_all_start_methods() else None)
+    reduced, pending = [], deque()
+    with ProcessPoolExecutor(workers, mp_context=context) as executor:
+        for chunk in _chain(first, second, chunks):
+            pending.append(executor.submit(reduce_chunk, chunk, name_columns))
+            del chunk
+            if len(pending) >= 2 * workers:
+                reduced.append(pending.popleft().result())
+        reduced.extend(future.result() for future in pending)
+    return pd.concat(reduced, ignore_index=True)
+
+def _chain(first, second, rest):
+    yield first
+    yield second
+    yield from rest
+
+def read_tmdb_csvs(movies_file='tmdb_5000_movies.csv', credits_file='tmdb_5000_credits.csv', chunk_size=2000, workers=None):
+    """
+    Reads and merges the TMDB movies and credits CSVs, keeping only the names from their JSON columns.
+
+    The result has the same columns, in the same order, as parsing every JSON column with
+    parse_json_column, merging the files, extracting the names with extract_names_from_json and
+    dropping the raw columns, but no parsed cast or crew dictionaries are ever kept. The name
+    columns are stored as NameListArrays, which hold the same lists as integer codes.
+
+    Args:
+    movies_file (str): The movies CSV.
+    credits_file (str): The credits CSV.
+    chunk_size (int): The number of rows reduced at a time.
+    workers (int): The number of worker processes (see read_reduced_csv).
+
+    Returns:
+    pandas.DataFrame: The merged table, before rows without overview, release date or runtime are dropped.
+    """
+    credits_df = read_reduced_csv(credits_file, CREDIT_NAME_COLUMNS, chunk_size, workers)
+    movies_df = read_reduced_csv(movies_file, MOVIE_NAME_COLUMNS, chunk_size, workers)
+    credits_df = credits_df.drop(columns=['title'])
+    merged_df = pd.merge(movies_df.rename(columns={'title': 'title_x'}), credits_df, how='left', left_on='id', right_on='movie_id')
+    merged_df = merged_df.drop(columns=['movie_id'])
+    other_columns = [column for column in merged_df.columns if column not in NAME_COLUMN_ORDER]
+    return merged_df[other_columns + NAME_COLUMN_ORDER]
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import functools
+import json
+import sys
+import threading
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Instrumentation is off until enable() is called; stage() then costs one flag check.
+_enabled = False
+_trace_memory = False
+_records = {}
+# The stack of running stages is per thread, so concurrent requests (e.g. in recommend_server) do not mix.
+_local = threading.local()
+_records_lock = threading.Lock()
+
+def enable(trace_memory=False):
+    """
+    Turns on the recording of stages.
+
+    Args:
+    trace_memory (bool): Whether to also record the peak memory allocated in each stage with tracemalloc,
+    which slows down allocation-heavy stages noticeably.
+    """
+    global _enabled, _trace_memory
+    _enabled = True
+    _trace_memory = trace_memory
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+def disable():
+    """
+    Turns off the recording of stages. The records collected so far are kept.
+    """
+    global _enabled
+    _enabled = False
+    if _trace_memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+def is_enabled():
+    return _enabled
+
+def reset():
+    """
+    Forgets all recorded stages.
+    """
+    with _records_lock:
+        _records.clear()
+
+def _max_rss_mb():
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss / 2 ** 20 if sys.platform == 'darwin' else max_rss / 2 ** 10
+
+def _active():
+    """
+    Returns the stack of the stages running in the calling thread, innermost last.
+    """
+    if not hasattr(_local, 'stages'):
+        _local.stages = []
+    return _local.stages
+
+class _Stage:
+    """
+    Times one run of a stage and adds it to the records when it exits.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.counts = {}
+
+    def count(self, **counts):
+        """
+        Attaches counts (rows, nodes, edges, candidates, ...) to this run of the stage.
+        """
+        self.counts.update(counts)
+
+    def __enter__(self):
+        active = _active()
+        if _trace_memory:
+            # reset_peak is global, so hand the peak reached so far to the enclosing stage first.
+            current, peak = tracemalloc.get_traced_memory()
+            if active:
+                active[-1].peak = max(active[-1].peak, peak)
+            self.memory_start = current
+            self.peak = current
+            tracemalloc.reset_peak()
+        active.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        seconds = time.perf_counter() - self.start
+        active = _active()
+        active.remove(self)
+        max_rss_mb = _max_rss_mb()
+        if _trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            peak = max(self.peak, peak)
+            if active:
+                active[-1].peak = max(active[-1].peak, peak)
+        with _records_lock:
+            record = _records.setdefault(self.name, {'calls': 0, 'total_s': 0.0, 'max_s': 0.0})
+            record['calls'] += 1
+            record['total_s'] += seconds
+            record['max_s'] = max(record['max_s'], seconds)
+            record['last_s'] = seconds
+            record['max_rss_mb'] = max_rss_mb
+            if _trace_memory:
+                record['memory_delta_mb'] = (current - self.memory_start) / 2 ** 20
+                record['memory_peak_mb'] = max(record.get('memory_peak_mb', 0.0), (peak - self.memory_start) / 2 ** 20)
+            if self.counts:
+                record['counts'] = self.counts
+        return False
+
+class _NullStage:
+    """
+    Stands in for _Stage while instrumentation is disabled.
+    """
+
+    def count(self, **counts):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+_NULL_STAGE = _NullStage()
+
+def stage(name):
+    """
+    Returns a context manager that records the wall time, memory and counts of a block.
+
+    Example:
+    with stage('read_csv') as timer:
+        df = pd.read_csv(...)
+        timer.count(rows=len(df))
+
+    Args:
+    name (str): The name the block is recorded under; repeated runs are aggregated.
+
+    Returns:
+    A context manager whose count(**counts) method attaches counts to the run.
+    """
+    return _Stage(name) if _enabled else _NULL_STAGE
+
+def add_counts(**counts):
+    """
+    Attaches counts to the innermost stage that is currently running, e.g. from inside an instrumented function.
+    """
+    active = _active() if _enabled else None
+    if active:
+        active[-1].count(**counts)
+
+def instrumented(name=None):
+    """
+    Decorator recording every call of a function as a stage.
+
+    Args:
+    name (str): The stage name; the function name by default.
+    """
+    def decorator(function):
+        stage_name = name or function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            with _Stage(stage_name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def report():
+    """
+    Returns the recorded stages.
+
+    Returns:
+    dict: For each stage, 'calls', 'total_s', 'max_s', 'last_s', 'max_rss_mb' (the peak resident set
+    size of the process so far), the 'counts' of the last run and, when memory is traced,
+    'memory_delta_mb' and 'memory_peak_mb'.
+    """
+    with _records_lock:
+        return {name: dict(record) for name, record in _records.items()}
+
+def format_report():
+    """
+    Formats the recorded stages as a table.
+    """
+    lines = [f"{'stage':<32} {'calls':>6} {'total s':>10} {'max s':>10} {'rss MB':>9} {'peak MB':>9}  counts"]
+    for name, record in report().items():
+        rss = '' if record.get('max_rss_mb') is None else f"{record['max_rss_mb']:.1f}"
+        peak = f"{record['memory_peak_mb']:.1f}" if 'memory_peak_mb' in record else ''
+        counts = ', '.join(f"{key}={value}" for key, value in record.get('counts', {}).items())
+        lines.append(f"{name:<32} {record['calls']:>6} {record['total_s']:>10.4f} {record['max_s']:>10.4f} {rss:>9} {peak:>9}  {counts}")
+    return '\n'.join(lines)
+
+def dump_report(filename):
+    """
+    Writes the recorded stages to a JSON file.
+    """
+    with open(filename, 'w') as f:
+        json.dump(report(), f, indent=2)
@@ -0,0 +1,374 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import bisect
+import difflib
+import re
+
+import numpy as np
+
+from name_lists import concat_ranges, name_codes
+
+
+def build_lookup_index(df):
+    """
+    Builds the id and title lookup tables of a movie table, which do not need the graph.
+
+    Args:
+    df (pandas.DataFrame): DataFrame containing movie data.
+
+    Returns:
+    dict: The keys 'ids', 'titles', 'id_positions', 'title_positions', 'normalized_title_positions',
+    'sorted_titles' and 'sorted_title_positions'.
+    """
+    ids = df['id'].to_numpy()
+    titles = df['title_x'].tolist()
+
+    id_positions = {}
+    for position, movie_id in enumerate(ids.tolist()):
+        id_positions.setdefault(movie_id, position)
+    title_positions = {}
+    normalized_title_positions = {}
+    for position, title in enumerate(titles):
+        title_positions.setdefault(title, position)
+        normalized_title_positions.setdefault(normalize_title(title), position)
+    sorted_titles = sorted(normalized_title_positions)
+
+    return {
+        'ids': ids,
+        'titles': titles,
+        'id_positions': id_positions,
+        'title_positions': title_positions,
+        'normalized_title_positions': normalized_title_positions,
+        'sorted_titles': sorted_titles,
+        'sorted_title_positions': [normalized_title_positions[title] for title in sorted_titles],
+    }
+
+def build_movie_index(df, graph, lookup=None):
+    """
+    Precomputes the arrays used by the vectorized recommenders.
+
+    Every row of the DataFrame gets a row in a multi-hot genre matrix (movies x genres), taken from
+    the genres stored on its graph node. Rows whose movie is not in the graph have an all-zero row
+    and are flagged in 'in_graph'. vote_average and popularity are stored with NaN replaced by -inf
+    so that "higher is better" comparisons put missing values last, like pandas' na_position='last'.
+
+    Args:
+    df (pandas.DataFrame): DataFrame containing movie data, in the order used for tie-breaking.
+    graph (networkx.Graph): The graph representing movies and their relationships.
+    lookup (dict): The result of build_lookup_index(df), if it was already built.
+
+    Returns:
+    dict: The build_lookup_index tables plus the keys 'genres', 'genre_positions', 'genre_matrix',
+    'in_graph', 'node_positions', 'node_titles' and 'node_genre_bits' (see genre_matches), 'vote_average',
+    'popularity', 'genre_postings', 'cast_postings' and 'crew_postings'.
+    For a 'similarity' graph, 'similarity_indptr', 'similarity_indices' and 'similarity_weights'
+    hold its weighted edges as a CSR matrix over DataFrame positions (see neighbor_scores).
+    """
+    index = dict(lookup if lookup is not None else build_lookup_index(df))
+    ids = index['ids']
+
+    genre_positions = {}
+    in_graph = np.zeros(len(ids), dtype=bool)
+    rows, cols = [], []
+    for position, movie_id in enumerate(ids.tolist()):
+        if movie_id not in graph:
+            continue
+        in_graph[position] = True
+        for genre in set(graph.nodes[movie_id]['genres']):
+            rows.append(position)
+            cols.append(genre_positions.setdefault(genre, len(genre_positions)))
+
+    genre_matrix = np.zeros((len(ids), len(genre_positions)), dtype=np.float32)
+    genre_matrix[rows, cols] = 1
+    # The first row of every movie of the graph, in the order the graph's movie nodes were added.
+    _, first_positions = np.unique(ids, return_index=True)
+    node_positions = np.sort(first_positions[in_graph[first_positions]])
+
+    index.update({
+        'genres': list(genre_positions),
+        'genre_positions': genre_positions,
+        'genre_matrix': genre_matrix,
+        'in_graph': in_graph,
+        'node_positions': node_positions,
+        # The titles stored on the graph's movie nodes, which the genre recommender returns.
+        'node_titles': [graph.nodes[movie_id]['title'] for movie_id in ids[node_positions].tolist()],
+        'node_genre_bits': genre_bitmasks(genre_matrix[node_positions]),
+        'vote_average': _descending_key(df, 'vote_average'),
+        'popularity': _descending_key(df, 'popularity'),
+        'genre_postings': build_inverted_index(df['genre_names']),
+        'cast_postings': build_inverted_index(df['cast_names']),
+        'crew_postings': build_inverted_index(df['crew_names']),
+    })
+    if graph.graph.get('mode') == 'similarity':
+        index.update(build_similarity_csr(graph, index['id_positions'], len(ids)))
+    return index
+
+def build_similarity_csr(graph, id_positions, num_rows):
+    """
+    Converts the weighted edges of a 'similarity' graph into a CSR matrix over DataFrame positions.
+
+    Returns:
+    dict: 'similarity_indptr', 'similarity_indices' and 'similarity_weights'; the neighbours of
+    the movie at position p are similarity_indices[similarity_indptr[p]:similarity_indptr[p + 1]].
+    """
+    edges = [(id_positions[u], id_positions[v], weight) for u, v, weight in graph.edges(data='weight', default=1.0)]
+    sources = np.array([u for u, _, _ in edges] + [v for _, v, _ in edges], dtype=np.int64)
+    targets = np.array([v for _, v, _ in edges] + [u for u, _, _ in edges], dtype=np.int64)
+    weights = np.array([weight for _, _, weight in edges] * 2, dtype=np.float32)
+    order = np.argsort(sources, kind='stable')
+    indptr = np.zeros(num_rows + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=num_rows), out=indptr[1:])
+    return {'similarity_indptr': indptr, 'similarity_indices': targets[order], 'similarity_weights': weights[order]}
+
+def neighbor_scores(index, positions):
+    """
+    Sums, for every movie, the similarity weights of its edges to the movies at `positions`.
+
+    Args:
+    index (dict): An index built from a 'similarity' graph.
+    positions (numpy.ndarray): Distinct DataFrame positions.
+
+    Returns:
+    numpy.ndarray: A float64 array with one score per DataFrame position (0 for movies that are not
+    neighbours of any of the positions).
+    """
+    indptr = index['similarity_indptr']
+    positions = np.asarray(positions, dtype=np.int64)
+    starts = indptr[positions]
+    entries = concat_ranges(starts, indptr[positions + 1])
+    return np.bincount(index['similarity_indices'][entries], weights=index['similarity_weights'][entries], minlength=len(indptr) - 1)
+
+def genre_bitmasks(genre_matrix):
+    """
+    Encodes the rows of a multi-hot genre matrix as bitmasks.
+
+    Args:
+    genre_matrix (numpy.ndarray): A (rows x genres) matrix of zeros and ones.
+
+    Returns:
+    numpy.ndarray: A uint64 array of shape (rows, words); bit j % 64 of word j // 64 is set when the row has genre j.
+    """
+    num_words = max(1, -(-genre_matrix.shape[1] // 64))
+    bits = np.zeros((len(genre_matrix), num_words * 64), dtype=bool)
+    bits[:, :genre_matrix.shape[1]] = genre_matrix > 0
+    return np.packbits(bits, axis=1, bitorder='little').view('<u8')
+
+def genre_matches(index, genres, limit=None):
+    """
+    Finds the movies of the graph that have all the given genres.
+
+    Every movie's genres are a bitmask, so a movie matches when its bitmask AND the bitmask of the
+    genres equals the bitmask of the genres, which is checked for a whole block of movies at once.
+    With a limit, the movies are checked in blocks of growing size until enough of them match.
+
+    Args:
+    index (dict): The index from build_movie_index.
+    genres (list): The genres every match must have.
+    limit (int): Stop once this many matches are found, or None to find all of them.
+
+    Returns:
+    numpy.ndarray: The positions of the matching movies (the first row of each), in the order of the graph's movie nodes.
+    """
+    rows = index['node_positions']
+    if any(genre not in index['genre_positions'] for genre in genres):
+        return rows[:0]
+    required = np.zeros((1, len(index['genres'])), dtype=np.float32)
+    required[0, [index['genre_positions'][genre] for genre in genres]] = 1
+    mask = genre_bitmasks(required)[0]
+    bits = index['node_genre_bits']
+    if bits.shape[1] == 1:
+        bits, mask = bits[:, 0], mask[0]
+
+    def matching(start, stop):
+        block = bits[start:stop] & mask
+        found = block == mask if block.ndim == 1 else (block == mask).all(axis=1)
+        return rows[start + np.flatnonzero(found)]
+
+    if limit is None:
+        return matching(0, len(rows))
+    found, start, block_size = [], 0, 4096
+    while start < len(rows) and sum(map(len, found)) < limit:
+        found.append(matching(start, start + block_size))
+        start, block_size = start + block_size, block_size * 2
+    return np.concatenate(found)[:limit] if found else rows[:0]
+
+def build_inverted_index(name_lists):
+    """
+    Maps every name in a list column to the positions of the rows containing it.
+
+    Args:
+    name_lists (pandas.Series): A column whose entries are lists of names, e.g. cast_names.
+
+    Returns:
+    dict: A dictionary mapping each name to a sorted NumPy array of unique row positions.
+    """
+    rows, codes, vocabulary = name_codes(name_lists)
+    # Sorting the (code, row) pairs groups the rows of every name, in row order and without repeats.
+    pairs = np.unique(codes * (len(name_lists) + 1) + rows)
+    if pairs.size == 0:
+        return {}
+    codes, rows = pairs // (len(name_lists) + 1), pairs % (len(name_lists) + 1)
+    bounds = np.flatnonzero(np.diff(codes)) + 1
+    starts = np.concatenate([[0], bounds]).astype(np.int64)
+    return {vocabulary[code]: positions for code, positions in zip(codes[starts].tolist(), np.split(rows, bounds))}
+
+def normalize_title(title):
+    """
+    Normalizes a movie title for case-insensitive lookups.
+
+    Args:
+    title (str): A movie title or user input.
+
+    Returns:
+    str: The title case-folded, with surrounding whitespace removed and inner whitespace collapsed.
+    """
+    return re.sub(r'\s+', ' ', str(title)).strip().casefold()
+
+def find_id_position(index, movie_id):
+    """
+    Returns the row position of a movie id, or None if there is no such movie.
+    """
+    return index['id_positions'].get(movie_id)
+
+def find_title_position(index, title):
+    """
+    Returns the row position of a movie title.
+
+    The exact title is tried first, then the normalized title, so 'the dark knight' finds 'The Dark Knight'.
+    The first row is used when several movies share a title.
+
+    Args:
+    index (dict): The index from build_movie_index.
+    title (str): The title to look up.
+
+    Returns:
+    int: The row position, or None if no movie has this title.
+    """
+    position = index['title_positions'].get(title)
+    if position is None:
+        position = index['normalized_title_positions'].get(normalize_title(title))
+    return position
+
+def complete_title(index, prefix, limit=10):
+    """
+    Returns the titles starting with a prefix, ignoring case.
+
+    The normalized titles are kept sorted, so the matches are found by binary search in
+    O(log n + limit) time regardless of the catalogue size.
+
+    Args:
+    index (dict): The index from build_movie_index.
+    prefix (str): The beginning of a title.
+    limit (int): The maximum number of titles to return.
+
+    Returns:
+    list: Up to `limit` matching titles in alphabetical order.
+    """
+    prefix = normalize_title(prefix)
+    sorted_titles = index['sorted_titles']
+    start = bisect.bisect_left(sorted_titles, prefix)
+    matches = []
+    for position in range(start, min(start + limit, len(sorted_titles))):
+        if not sorted_titles[position].startswith(prefix):
+            break
+        matches.append(index['titles'][index['sorted_title_positions'][position]])
+    return matches
+
+def suggest_titles(index, query, limit=5, min_prefix_length=3, max_candidates=50):
+    """
+    Suggests titles for a query that did not match any movie ("did you mean").
+
+    Candidates are the titles sharing the longest possible prefix with the query (at least
+    `min_prefix_length` characters), ranked by their similarity to the whole query. Only a bounded
+    number of candidates is compared, so the cost does not grow with the catalogue.
+
+    Args:
+    index (dict): The index from build_movie_index.
+    query (str): The title the user typed.
+    limit (int): The maximum number of suggestions.
+    min_prefix_length (int): The shortest shared prefix considered.
+    max_candidates (int): The number of candidates compared with the query.
+
+    Returns:
+    list: Up to `limit` suggested titles, most similar first.
+    """
+    normalized_query = normalize_title(query)
+    for length in range(len(normalized_query), min_prefix_length - 1, -1):
+        candidates = complete_title(index, normalized_query[:length], max_candidates)
+        if candidates:
+            matcher = difflib.SequenceMatcher(b=normalized_query)
+            scores = []
+            for candidate in candidates:
+                matcher.set_seq1(normalize_title(candidate))
+                scores.append(matcher.ratio())
+            ranked = sorted(range(len(candidates)), key=lambda i: -scores[i])
+            return [candidates[i] for i in ranked[:limit]]
+    return []
+
+def _descending_key(df, column_name):
+    """
+    Returns a float column as a NumPy array with missing values replaced by -inf.
+    """
+    values = df[column_name].to_numpy(dtype=np.float64, na_value=np.nan)
+    return np.where(np.isnan(values), -np.inf, values)
+
+def top_k_positions(keys, candidates, k):
+    """
+    Selects the k best candidates ordered by several keys, without sorting every candidate.
+
+    Candidates are compared on keys[0], then keys[1], and so on (higher is better), and finally by
+    ascending position, which reproduces a stable pandas sort_values on the same keys. Only the
+    candidates that can still reach the top k are ever sorted: np.partition finds the k-th best
+    value of the current key, everything strictly better is kept, and the ties at that value are
+    resolved recursively on the next key.
+
+    Args:
+    keys (list): NumPy float arrays indexed by position, with missing values set to -inf.
+    candidates (numpy.ndarray): Ascending positions eligible for selection.
+    k (int): Number of positions to return.
+
+    Returns:
+    numpy.ndarray: At most k positions in ranking order.
+    """
+    if k <= 0 or candidates.size == 0:
+        return candidates[:0]
+    if candidates.size <= k:
+        return _sort_positions(keys, candidates)
+    if not keys:
+        return candidates[:k]
+
+    values = keys[0][candidates]
+    kth_value = np.partition(values, candidates.size - k)[candidates.size - k]
+    better = candidates[values > kth_value]
+    tied = candidates[values == kth_value]
+    return np.concatenate([
+        _sort_positions(keys, better),
+        top_k_positions(keys[1:], tied, k - better.size),
+    ])
+
+def quality_ranks(index):
+    """
+    Ranks every position by vote_average, then popularity, then ascending position.
+
+    Comparing two ranks gives the order top_k_positions uses after its first key, so a ranking by an
+    integer score and then by rating can be done on the single integer score * len(ids) + rank.
+
+    Args:
+    index (dict): The index from build_movie_index.
+
+    Returns:
+    numpy.ndarray: Distinct int64 values, higher for better movies, in [0, number of positions).
+    """
+    num_rows = len(index['ids'])
+    order = np.lexsort((np.arange(num_rows), -index['popularity'], -index['vote_average']))
+    ranks = np.empty(num_rows, dtype=np.int64)
+    ranks[order] = np.arange(num_rows - 1, -1, -1)
+    return ranks
+
+def _sort_positions(keys, positions):
+    """
+    Sorts positions by the keys (higher is better) and then by ascending position.
+    """
+    order = np.lexsort([positions] + [-key[positions] for key in reversed(keys)])
+    return positions[order]
@@ -0,0 +1,316 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import sys
+
+import numpy as np
+import pandas as pd
+from pandas.api.extensions import ExtensionArray, ExtensionDtype, register_extension_dtype
+
+# The number of rows decoded at a time when a column is iterated.
+_ITER_BLOCK = 4096
+# Up to this many names assigned at once are looked up by scanning the vocabulary rather than indexing it.
+_SCAN_NAMES = 16
+
+def _is_missing(value):
+    return value is None or (isinstance(value, float) and np.isnan(value))
+
+def concat_ranges(starts, ends):
+    """
+    Concatenates np.arange(start, end) for every (start, end) pair, without a Python loop.
+
+    Used wherever CSR-style rows (offsets into one array) are gathered: name lists, postings, graph adjacency.
+    """
+    lengths = np.maximum(ends - starts, 0)
+    return np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(int(lengths.sum()))
+
+@register_extension_dtype
+class NameListDtype(ExtensionDtype):
+    """
+    The dtype of a column of name lists stored as a NameListArray.
+    """
+    name = 'name_list'
+    type = list
+    kind = 'O'
+    na_value = np.nan
+
+    @classmethod
+    def construct_array_type(cls):
+        return NameListArray
+
+class NameListArray(ExtensionArray):
+    """
+    A column of name lists (cast_names, genre_names, ...) stored as integer codes into one vocabulary.
+
+    Row i holds the names vocabulary[code] for code in codes[offsets[i]:offsets[i + 1]]. Every
+    distinct name is stored once, and every row costs four bytes per name plus eight bytes, instead
+    of a Python list of its own string objects. The column behaves like an object column of lists:
+    rows, iteration, explode() and printing give the names back, decoded from the shared vocabulary.
+    Slices share the codes of the column they were taken from.
+    """
+
+    def __init__(self, vocabulary, codes, offsets):
+        """
+        Args:
+        vocabulary (list): The distinct names.
+        codes (numpy.ndarray): int32 positions in the vocabulary.
+        offsets (numpy.ndarray): int64 bounds of the rows in `codes`, one more than the number of rows.
+        """
+        self.vocabulary = vocabulary
+        self.codes = np.asarray(codes, dtype=np.int32)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        # (vocabulary, dictionary from names to codes), built by _encode_rows when it is worth it.
+        self._lookup = None
+
+    def _with_rows(self, codes, offsets):
+        """
+        Returns an array of other rows over the same vocabulary, sharing its name dictionary.
+        """
+        array = NameListArray(self.vocabulary, codes, offsets)
+        array._lookup = self._lookup
+        return array
+
+    @classmethod
+    def from_lists(cls, values):
+        """
+        Encodes a sequence of name lists; missing values (None or NaN) become empty lists.
+
+        Returns:
+        NameListArray: The encoded column, with the names numbered in order of first appearance.
+        """
+        vocabulary = {}
+        codes = []
+        lengths = []
+        for names in values:
+            if _is_missing(names):
+                lengths.append(0)
+                continue
+            lengths.append(len(names))
+            codes.extend(vocabulary.setdefault(name, len(vocabulary)) for name in names)
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        return cls(list(vocabulary), np.array(codes, dtype=np.int32), offsets)
+
+    @classmethod
+    def _from_sequence(cls, scalars, *, dtype=None, copy=False):
+        if isinstance(scalars, NameListArray):
+            return scalars.copy() if copy else scalars
+        return cls.from_lists(scalars)
+
+    @classmethod
+    def _concat_same_type(cls, to_concat):
+        to_concat = list(to_concat)
+        vocabulary = to_concat[0].vocabulary
+        if all(array.vocabulary is vocabulary for array in to_concat):
+            parts = [array.row_codes() for array in to_concat]
+        else:
+            # Merges the vocabularies, keeping the codes of the first array.
+            positions = {name: code for code, name in enumerate(vocabulary)}
+            parts = []
+            for array in to_concat:
+                mapping = np.array([positions.setdefault(name, len(positions)) for name in array.vocabulary], dtype=np.int32)
+                parts.append(mapping[array.row_codes()])
+            vocabulary = list(positions)
+        lengths = np.concatenate([np.diff(array.offsets) for array in to_concat]) if to_concat else np.zeros(0, dtype=np.int64)
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        return cls(vocabulary, np.concatenate(parts) if parts else np.zeros(0, dtype=np.int32), offsets)
+
+    @property
+    def dtype(self):
+        return NameListDtype()
+
+    @property
+    def nbytes(self):
+        """
+        The bytes used by the codes, the offsets and the vocabulary strings.
+        """
+        return self.codes.nbytes + self.offsets.nbytes + sys.getsizeof(self.vocabulary) + sum(sys.getsizeof(name) for name in self.vocabulary)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def row_codes(self):
+        """
+        Returns the codes of all rows, concatenated in row order.
+        """
+        return self.codes[self.offsets[0]:self.offsets[-1]]
+
+    def row_positions(self):
+        """
+        Returns the row position of every code returned by row_codes().
+        """
+        return np.repeat(np.arange(len(self), dtype=np.int64), np.diff(self.offsets))
+
+    def __getitem__(self, item):
+        if isinstance(item, (int, np.integer)):
+            position = int(item)
+            if position < 0:
+                position += len(self)
+            if not 0 <= position < len(self):
+                raise IndexError(f"index {item} is out of bounds for a column of {len(self)} rows")
+            vocabulary = self.vocabulary
+            return [vocabulary[code] for code in self.codes[self.offsets[position]:self.offsets[position + 1]].tolist()]
+        if isinstance(item, slice) and item.step in (None, 1):
+            start, stop, _ = item.indices(len(self))
+            return self._with_rows(self.codes, self.offsets[start:max(start, stop) + 1])
+        item = pd.api.indexers.check_array_indexer(self, item)
+        if item.dtype == bool:
+            item = np.flatnonzero(item)
+        return self.take(item)
+
+    def __iter__(self):
+        vocabulary = self.vocabulary
+        for start in range(0, len(self), _ITER_BLOCK):
+            bounds = self.offsets[start:start + _ITER_BLOCK + 1]
+            names = [vocabulary[code] for code in self.codes[bounds[0]:bounds[-1]].tolist()]
+            bounds = (bounds - bounds[0]).tolist()
+            for row_start, row_end in zip(bounds[:-1], bounds[1:]):
+                yield names[row_start:row_end]
+
+    def __array__(self, dtype=None, copy=None):
+        values = np.empty(len(self), dtype=object)
+        for position, names in enumerate(self):
+            values[position] = names
+        return values
+
+    def __setitem__(self, key, value):
+        """
+        Replaces rows in place. Only the codes of the replaced rows are written: new names are appended
+        to the vocabulary, and the codes and offsets of the other rows are moved up or down as a block.
+        """
+        positions = np.arange(len(self))[key]
+        if np.ndim(positions) == 0:
+            rows = {int(positions): value}
+        else:
+            rows = dict(zip(positions.tolist(), value))
+        rows = {position: [] if _is_missing(names) else list(names) for position, names in rows.items()}
+        replaced = self._encode_rows(rows)
+
+        offsets = self.offsets
+        pieces, previous_end = [], offsets[0]
+        for position in sorted(replaced):
+            pieces.append(self.codes[previous_end:offsets[position]])
+            pieces.append(replaced[position])
+            previous_end = offsets[position + 1]
+        pieces.append(self.codes[previous_end:offsets[-1]])
+        lengths = np.diff(offsets)
+        for position, codes in replaced.items():
+            lengths[position] = len(codes)
+        self.offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=self.offsets[1:])
+        self.codes = np.concatenate(pieces)
+
+    def _encode_rows(self, rows):
+        """
+        Returns the codes of the names of each row of `rows`, appending the names missing from the vocabulary.
+
+        A few names are looked up by scanning the vocabulary; more names build a dictionary of the
+        vocabulary, which is then kept, and shared by the slices and copies of this array.
+        """
+        vocabulary = self.vocabulary
+        lookup = self._lookup[1] if self._lookup is not None and self._lookup[0] is vocabulary else None
+        if lookup is None and sum(len(names) for names in rows.values()) > _SCAN_NAMES:
+            lookup = {}
+            self._lookup = (vocabulary, lookup)
+        if lookup is not None:
+            # The vocabulary only grows, possibly through another array sharing it.
+            for code in range(len(lookup), len(vocabulary)):
+                lookup.setdefault(vocabulary[code], code)
+
+        replaced = {}
+        for position, names in rows.items():
+            codes = []
+            for name in names:
+                if lookup is not None:
+                    code = lookup.get(name)
+                else:
+                    try:
+                        code = vocabulary.index(name)
+                    except ValueError:
+                        code = None
+                if code is None:
+                    code = len(vocabulary)
+                    vocabulary.append(name)
+                    if lookup is not None:
+                        lookup[name] = code
+                codes.append(code)
+            replaced[position] = np.array(codes, dtype=np.int32)
+        return replaced
+
+    def __eq__(self, other):
+        if isinstance(other, (NameListArray, pd.Series, np.ndarray, list)) and len(other) == len(self):
+            return np.array([left == list(right) for left, right in zip(self, other)], dtype=bool)
+        return np.zeros(len(self), dtype=bool)
+
+    def isna(self):
+        return np.zeros(len(self), dtype=bool)
+
+    def take(self, indices, allow_fill=False, fill_value=None):
+        indices = np.asarray(indices, dtype=np.int64)
+        fill = np.zeros(len(indices), dtype=bool)
+        if allow_fill:
+            if (indices < -1).any():
+                raise ValueError("Invalid value in 'indices'; only -1 marks a missing row")
+            if fill_value is not None and not _is_missing(fill_value) and len(fill_value):
+                raise ValueError("Missing rows can only be filled with empty lists")
+            fill = indices == -1
+            indices = np.where(fill, 0, indices)
+        else:
+            indices = np.where(indices < 0, indices + len(self), indices)
+        if len(indices) and (indices.min() < 0 or indices.max() >= max(len(self), 1) or (len(self) == 0 and not fill.all())):
+            raise IndexError("take indices are out of bounds")
+        starts = self.offsets[indices] if len(self) else np.zeros(len(indices), dtype=np.int64)
+        ends = np.where(fill, starts, self.offsets[indices + 1] if len(self) else starts)
+        offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+        np.cumsum(ends - starts, out=offsets[1:])
+        return self._with_rows(self.codes[concat_ranges(starts, ends)], offsets)
+
+    def copy(self):
+        return self._with_rows(self.row_codes().copy(), self.offsets - self.offsets[0])
+
+    def _explode(self):
+        lengths = np.diff(self.offsets)
+        # Like exploding an object column, an empty list becomes one missing value.
+        values = np.full(int(np.maximum(lengths, 1).sum()), np.nan, dtype=object)
+        targets = np.cumsum(np.maximum(lengths, 1)) - np.maximum(lengths, 1)
+        vocabulary = np.array(self.vocabulary + [np.nan], dtype=object)
+        values[concat_ranges(targets, targets + lengths)] = vocabulary[self.row_codes()]
+        return values, np.maximum(lengths, 1).astype(np.uint64)
+
+    def _values_for_factorize(self):
+        return np.array([tuple(names) for names in self] + [()], dtype=object)[:-1], None
+
+def compact_name_columns(df, columns=None):
+    """
+    Stores the name list columns of a table as NameListArrays, in place.
+
+    Args:
+    df (pandas.DataFrame): The movie table, e.g. final_df.
+    columns (list): The columns to convert; by default every column ending in '_names'.
+
+    Returns:
+    pandas.DataFrame: The same table.
+    """
+    for column in columns if columns is not None else [column for column in df.columns if column.endswith('_names')]:
+        if not isinstance(df[column].dtype, NameListDtype):
+            df[column] = pd.Series(NameListArray.from_lists(df[column]), index=df.index)
+    return df
+
+def name_codes(name_lists):
+    """
+    Returns the names of a list column as parallel arrays of row positions and integer codes.
+
+    Args:
+    name_lists (pandas.Series): A column of name lists, stored as a NameListArray or as Python lists.
+
+    Returns:
+    tuple: (rows, codes, vocabulary) - the row position and vocabulary code of every name, in row
+    order, and the list of names the codes refer to (it may contain names no row uses).
+    """
+    values = name_lists.array if isinstance(name_lists, pd.Series) else name_lists
+    if isinstance(values, NameListArray):
+        return values.row_positions(), values.row_codes().astype(np.int64), values.vocabulary
+    exploded = pd.Series(list(values), dtype=object).explode().dropna()
+    codes, vocabulary = pd.factorize(exploded)
+    return exploded.index.to_numpy(dtype=np.int64), codes.astype(np.int64), list(vocabulary)
@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import numpy as np
+
+from movie_index import top_k_positions
+
+POSTINGS = ('genre_postings', 'cast_postings', 'crew_postings')
+
+def _position_slots(index):
+    """
+    Returns the movie node of every row position: its slot in index['node_positions'], or -1 if the movie is not in the graph.
+    """
+    node_ids = index['ids'][index['node_positions']]
+    if node_ids.size == 0:
+        return np.full(len(index['ids']), -1, dtype=np.int64)
+    order = np.argsort(node_ids, kind='stable')
+    slots = order[np.minimum(np.searchsorted(node_ids[order], index['ids']), len(order) - 1)]
+    return np.where(index['in_graph'] & (node_ids[slots] == index['ids']), slots, -1)
+
+def _walk_model(index, sources, targets, weights, num_nodes):
+    """
+    Builds the random-walk model of an undirected weighted graph whose first nodes are the movies of index['node_positions'].
+    """
+    from scipy import sparse
+
+    sources, targets = np.concatenate([sources, targets]), np.concatenate([targets, sources])
+    weights = np.concatenate([weights, weights]).astype(np.float64)
+    degrees = np.bincount(sources, weights=weights, minlength=num_nodes)
+    # Column j spreads the walk at node j over its neighbours in proportion to the edge weights.
+    transitions = sparse.csr_matrix((weights / degrees[sources], (targets, sources)), shape=(num_nodes, num_nodes))
+    return {
+        'transitions': transitions,
+        'dangling': degrees == 0,
+        'num_movies': len(index['node_positions']),
+        'position_slots': _position_slots(index),
+    }
+
+def graph_walk_model(graph, index):
+    """
+    Turns a movie graph into a sparse transition matrix for random walks.
+
+    The movie nodes come first, in the order of index['node_positions'], followed by the other
+    nodes (the genre hubs of a 'hub' graph). Edges are weighted by their 'weight' (1 by default).
+
+    Args:
+    graph (networkx.Graph): A graph from construct_graph.create_movie_graph, in any mode.
+    index (dict): The index from movie_index.build_movie_index(df, graph).
+
+    Returns:
+    dict: The model: 'transitions' (a column-stochastic scipy.sparse CSR matrix over the nodes),
+    'dangling' (the nodes without edges), 'num_movies' and 'position_slots' (the movie node of every row, or -1).
+    """
+    slots = {movie_id: slot for slot, movie_id in enumerate(index['ids'][index['node_positions']].tolist())}
+    for node in graph.nodes:
+        slots.setdefault(node, len(slots))
+    edges = list(graph.edges(data='weight', default=1.0))
+    sources = np.array([slots[u] for u, _, _ in edges], dtype=np.int64)
+    targets = np.array([slots[v] for _, v, _ in edges], dtype=np.int64)
+    weights = np.array([weight for _, _, weight in edges], dtype=np.float64)
+    return _walk_model(index, sources, targets, weights, len(slots))
+
+def attribute_walk_model(index, postings=POSTINGS):
+    """
+    Builds the random-walk model of the bipartite graph between the movies of the graph and their genres, cast and crew.
+
+    Every genre, cast and crew name is a node connected to the movies it appears in, so a walk
+    moves from a movie to one of its names and on to another movie with that name. The graph is
+    built from the inverted indexes, without the networkx graph.
+
+    Args:
+    index (dict): The index from movie_index.build_movie_index.
+    postings (tuple): The inverted indexes whose names become nodes.
+
+    Returns:
+    dict: The model, as returned by graph_walk_model.
+    """
+    position_slots = _position_slots(index)
+    num_movies = len(index['node_positions'])
+    names, positions = [], []
+    for key in postings:
+        for name_positions in index[key].values():
+            names.append(np.full(len(name_positions), len(names), dtype=np.int64))
+            positions.append(name_positions)
+    names = np.concatenate(names) if names else np.zeros(0, dtype=np.int64)
+    movie_slots = position_slots[np.concatenate(positions)] if positions else names
+    # One edge per (name, movie of the graph); names with no movie of the graph are left out.
+    pairs = np.unique(names[movie_slots >= 0] * max(num_movies, 1) + movie_slots[movie_slots >= 0])
+    _, name_nodes = np.unique(pairs // max(num_movies, 1), return_inverse=True)
+    name_nodes = name_nodes.reshape(-1)
+    return _walk_model(index, pairs % max(num_movies, 1), num_movies + name_nodes, np.ones(len(pairs)),
+                       num_movies + (int(name_nodes.max()) + 1 if name_nodes.size else 0))
+
+def walk_model(index):
+    """
+    Returns the random-walk model the batch and server requests use, building it on first use.
+
+    It is the attribute_walk_model of the genres alone: the same movie-genre graph as a 'hub' graph,
+    but available from the index without the networkx graph. It is kept in index['walk_model'].
+    """
+    model = index.get('walk_model')
+    if model is None:
+        model = index['walk_model'] = attribute_walk_model(index, ('genre_postings',))
+    return model
+
+def personalized_pagerank(model, seeds, alpha=0.85, tol=1e-6, max_iter=100):
+    """
+    Runs personalized PageRank (random walk with restart) for a batch of seed sets at once.
+
+    The scores of all seed sets are the columns of one dense matrix, which every iteration
+    multiplies with the sparse transition matrix: the walk follows an edge with probability alpha
+    and restarts at a random seed otherwise (and always when it reaches a node without edges).
+    A column stops once its scores change by less than tol (in L1 norm) in an iteration.
+
+    Args:
+    model (dict): A model from graph_walk_model or attribute_walk_model.
+    seeds (list): One list of seed nodes per walk; seed sets without nodes get all-zero scores.
+    alpha (float): The probability of following an edge rather than restarting.
+    tol (float): The L1 change below which a column has converged.
+    max_iter (int): The largest number of iterations.
+
+    Returns:
+    tuple: (scores, iterations) - a (nodes x walks) float64 array of visit probabilities, and the
+    number of iterations run.
+    """
+    transitions = model['transitions']
+    dangling = np.flatnonzero(model['dangling'])
+    # The restart distributions, as (node, walk, probability) entries: each seed gets an equal share.
+    seed_nodes = [np.unique(np.asarray(nodes, dtype=np.int64)) for nodes in seeds]
+    restart_nodes = np.concatenate(seed_nodes) if seed_nodes else np.zeros(0, dtype=np.int64)
+    restart_walks = np.repeat(np.arange(len(seeds)), [nodes.size for nodes in seed_nodes])
+    restart_shares = np.concatenate([np.full(nodes.size, 1.0 / nodes.size) for nodes in seed_nodes if nodes.size] or [np.zeros(0)])
+
+    scores = np.zeros((transitions.shape[0], len(seeds)))
+    scores[restart_nodes, restart_walks] = restart_shares
+    # The columns still iterating, and their scores as one contiguous matrix.
+    active = np.flatnonzero(np.bincount(restart_walks, minlength=len(seeds)))
+    current = scores[:, active]
+    columns = np.full(len(seeds), -1, dtype=np.int64)
+    iterations = 0
+    while active.size and iterations < max_iter:
+        columns[active] = np.arange(active.size)
+        entries = np.flatnonzero(columns[restart_walks] >= 0)
+        restart_columns = columns[restart_walks[entries]]
+        # The walks at nodes without edges restart, as do the others with probability 1 - alpha.
+        restarting = alpha * current[dangling].sum(axis=0) + (1 - alpha)
+        updated = transitions @ current
+        updated *= alpha
+        updated[restart_nodes[entries], restart_columns] += restart_shares[entries] * restarting[restart_columns]
+        np.subtract(current, updated, out=current)
+        converged = np.abs(current, out=current).sum(axis=0) < tol
+        current = updated
+        iterations += 1
+        if converged.any():
+            scores[:, active[converged]] = current[:, converged]
+            columns[active] = -1
+            active, current = active[~converged], current[:, ~converged]
+    scores[:, active] = current
+    return scores, iterations
+
+def recommend_pagerank_bulk(liked_lists, index, model=None, num_recommendations=5, chunk_size=16, alpha=0.85, tol=1e-6, max_iter=100):
+    """
+    Recommends movies to many users at once by personalized PageRank from the movies each of them liked.
+
+    The walks of a chunk of users run together in personalized_pagerank. Movies are ranked by their
+    score, then by vote_average and popularity; the liked movies are never recommended, and movies
+    outside the graph come last.
+
+    Args:
+    liked_lists (list): One list of liked movie titles per user.
+    index (dict): The index from movie_index.build_movie_index.
+    model (dict): The random-walk model; by default walk_model(index).
+    num_recommendations (int): The number of movies per user.
+    chunk_size (int): The number of users whose walks run together. Small chunks keep the dense
+    scores of a chunk in the CPU cache, which is faster per user than large ones.
+    alpha, tol, max_iter: See personalized_pagerank.
+
+    Returns:
+    generator: One list per chunk, holding the recommendations ('id' and 'title' dictionaries) of each of its users.
+    """
+    model = model if model is not None else walk_model(index)
+    position_slots = model['position_slots']
+    liked_lists = list(liked_lists)
+    for start in range(0, len(liked_lists), chunk_size):
+        seeds, liked_ids = [], []
+        for titles in liked_lists[start:start + chunk_size]:
+            positions = [position for position in map(index['title_positions'].get, titles) if position is not None]
+            liked_ids.append(index['ids'][positions])
+            seeds.append([slot for slot in position_slots[positions].tolist() if slot >= 0])
+        scores, _ = personalized_pagerank(model, seeds, alpha, tol, max_iter)
+        results = []
+        for column, movie_ids in enumerate(liked_ids):
+            movie_scores = np.where(position_slots >= 0, scores[:model['num_movies'], column][position_slots], -np.inf)
+            candidates = np.flatnonzero(~np.isin(index['ids'], movie_ids))
+            positions = top_k_positions([movie_scores, index['vote_average'], index['popularity']], candidates, num_recommendations)
+            results.append([{'id': int(index['ids'][position]), 'title': index['titles'][position]} for position in positions.tolist()])
+        yield results
+
+def recommend_movies_by_pagerank(liked_movie_titles, index, num_recommendations=5, model=None, **options):
+    """
+    Recommends movies by personalized PageRank from the liked movies (see recommend_pagerank_bulk).
+
+    Returns:
+    list: A list of dictionaries with recommended movies' 'id' and 'title'.
+    """
+    return next(recommend_pagerank_bulk([liked_movie_titles], index, model, num_recommendations, **options))[0]
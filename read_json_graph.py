@@ -5,7 +5,11 @@
 
 
 import networkx as nx
+import numpy as np
 import json
+import os
+
+from construct_graph import GENRE_NODE_PREFIX
 
 def load_graph_from_json(filename):
     """
@@ -24,17 +28,162 @@ def load_graph_from_json(filename):
         data = json.load(f)
     return nx.readwrite.json_graph.node_link_graph(data)
 
+def read_graph_header(dirname):
+    """
+    Reads the header of a graph saved by construct_graph.save_graph_binary.
+
+    Args:
+    dirname (str): The directory containing the binary graph.
+
+    Returns:
+    dict: The header, including 'mode', 'num_nodes', 'num_edges', 'num_movies' and 'genres'.
+    """
+    with open(os.path.join(dirname, 'header.json'), 'r') as f:
+        return json.load(f)
+
+def load_graph_binary(dirname, mmap=True):
+    """
+    Loads a graph saved by construct_graph.save_graph_binary without building a networkx graph.
+
+    The arrays are memory-mapped by default, so loading takes constant time and only the pages
+    touched by queries are read from disk. Use graph_degree and graph_neighbors to query the result,
+    or binary_graph_to_networkx to convert it.
+
+    Args:
+    dirname (str): The directory containing the binary graph.
+    mmap (bool): Whether to memory-map the arrays instead of reading them into memory.
+
+    Returns:
+    dict: The header entries plus the arrays described in save_graph_binary.
+    """
+    graph_data = read_graph_header(dirname)
+    for filename in os.listdir(dirname):
+        if filename.endswith('.npy'):
+            graph_data[filename[:-4]] = np.load(os.path.join(dirname, filename), mmap_mode='r' if mmap else None)
+    return graph_data
+
+def node_position(graph_data, node):
+    """
+    Finds the position of a node in a binary graph.
+
+    Args:
+    graph_data (dict): A graph loaded with load_graph_binary.
+    node (int or str): A movie id, or a genre hub key such as 'genre:Drama'.
+
+    Returns:
+    int: The position of the node, used to index the CSR arrays.
+
+    Raises:
+    KeyError: If the node is not in the graph.
+    """
+    if isinstance(node, str) and node.startswith(GENRE_NODE_PREFIX):
+        if node[len(GENRE_NODE_PREFIX):] in graph_data['genres']:
+            code = graph_data['genres'].index(node[len(GENRE_NODE_PREFIX):])
+            hubs = np.flatnonzero((graph_data['node_kinds'] == 1) & (graph_data['node_ids'] == code))
+            if hubs.size:
+                return int(hubs[0])
+        raise KeyError(node)
+    sorted_ids = graph_data['sorted_ids']
+    index = int(np.searchsorted(sorted_ids, node))
+    if index == len(sorted_ids) or sorted_ids[index] != node:
+        raise KeyError(node)
+    return int(graph_data['sorted_positions'][index])
+
+def node_key(graph_data, position):
+    """
+    Returns the networkx node key of the node at a position: the movie id, or 'genre:<name>' for a genre hub.
+    """
+    if graph_data['node_kinds'][position] == 1:
+        return GENRE_NODE_PREFIX + graph_data['genres'][int(graph_data['node_ids'][position])]
+    return int(graph_data['node_ids'][position])
+
+def graph_degree(graph_data, node):
+    """
+    Returns the degree of a node in a binary graph.
+
+    Args:
+    graph_data (dict): A graph loaded with load_graph_binary.
+    node (int or str): A movie id, or a genre hub key such as 'genre:Drama'.
+
+    Returns:
+    int: The number of neighbours of the node.
+    """
+    position = node_position(graph_data, node)
+    return int(graph_data['indptr'][position + 1] - graph_data['indptr'][position])
+
+def graph_neighbors(graph_data, node):
+    """
+    Returns the neighbours of a node in a binary graph.
+
+    Args:
+    graph_data (dict): A graph loaded with load_graph_binary.
+    node (int or str): A movie id, or a genre hub key such as 'genre:Drama'.
+
+    Returns:
+    list: The keys of the neighbouring nodes.
+    """
+    position = node_position(graph_data, node)
+    start, end = graph_data['indptr'][position], graph_data['indptr'][position + 1]
+    return [node_key(graph_data, neighbor) for neighbor in graph_data['indices'][start:end].tolist()]
+
+def binary_graph_to_networkx(graph_data):
+    """
+    Converts a binary graph back into a networkx graph, e.g. for visualisation.
+
+    Args:
+    graph_data (dict): A graph loaded with load_graph_binary.
+
+    Returns:
+    networkx.Graph: A graph with the same nodes, node attributes ('title', 'genres' and 'kind' for hubs) and edges
+    (with their 'weight' for 'similarity' graphs).
+    """
+    G = nx.Graph(mode=graph_data['mode'])
+    title_data = graph_data['title_data'].tobytes()
+    title_offsets = graph_data['title_offsets'].tolist()
+    genre_indptr = graph_data['genre_indptr'].tolist()
+    genre_codes = graph_data['genre_codes'].tolist()
+    keys = [node_key(graph_data, position) for position in range(graph_data['num_nodes'])]
+    for position, key in enumerate(keys):
+        attributes = {
+            'title': title_data[title_offsets[position]:title_offsets[position + 1]].decode('utf-8'),
+            'genres': [graph_data['genres'][code] for code in genre_codes[genre_indptr[position]:genre_indptr[position + 1]]],
+        }
+        if graph_data['node_kinds'][position] == 1:
+            attributes['kind'] = 'genre'
+        G.add_node(key, **attributes)
+
+    indptr = graph_data['indptr']
+    sources = np.repeat(np.arange(graph_data['num_nodes']), np.diff(indptr))
+    targets = np.asarray(graph_data['indices'])
+    upper = sources < targets
+    if 'weights' in graph_data:
+        weights = np.asarray(graph_data['weights'])[upper].tolist()
+        G.add_weighted_edges_from((keys[u], keys[v], weight) for u, v, weight in zip(sources[upper].tolist(), targets[upper].tolist(), weights))
+    else:
+        G.add_edges_from((keys[u], keys[v]) for u, v in zip(sources[upper].tolist(), targets[upper].tolist()))
+    return G
+
 def main():
     """
     Main function to demonstrate the loading and basic analysis of a graph.
 
-    This function loads a graph from a JSON file and prints the number of nodes and edges
-    in the graph. It serves as a simple demonstration of how to work with the saved graph data.
+    This function prints the number of nodes and edges in the saved graph. The counts are read
+    from the header of the binary graph (movie_graph/) when it exists, and otherwise by loading
+    the JSON file. It serves as a simple demonstration of how to work with the saved graph data.
 
     No arguments are required.
     """
+    if os.path.exists(os.path.join('movie_graph', 'header.json')):
+        header = read_graph_header('movie_graph')
+        print(f"Graph mode: {header['mode']}")
+        print(f"Number of nodes: {header['num_nodes']} ({header['num_nodes'] - header['num_movies']} genre hubs)")
+        print(f"Number of edges: {header['num_edges']}")
+        return
+
     G = load_graph_from_json('movie_graph.json')
-    print(f"Number of nodes: {G.number_of_nodes()}")
+    num_genre_hubs = sum(1 for _, data in G.nodes(data=True) if data.get('kind') == 'genre')
+    print(f"Graph mode: {G.graph.get('mode', 'clique')}")
+    print(f"Number of nodes: {G.number_of_nodes()} ({num_genre_hubs} genre hubs)")
     print(f"Number of edges: {G.number_of_edges()}")
 
 if __name__ == '__main__':
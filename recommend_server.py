@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import argparse
+import bisect
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from batch_recommend import run_query
+from final_anqi import load_model
+from movie_index import find_id_position
+from result_cache import ResultCache
+from tmdb_client import TMDB_API_KEY, TMDB_API_URL
+
+# Upper bounds (in milliseconds) of the latency histogram buckets; the last bucket is unbounded.
+LATENCY_BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+RECOMMEND_PATH = re.compile(r'^/recommend/(genre|liked|preferences|pagerank)$')
+MOVIE_PATH = re.compile(r'^/movies/(\d+)$')
+
+class LatencyHistogram:
+    """
+    Thread-safe request counts and latency histograms per endpoint.
+    """
+
+    def __init__(self, buckets_ms=LATENCY_BUCKETS_MS):
+        self.buckets_ms = buckets_ms
+        self.endpoints = {}
+        self.lock = threading.Lock()
+
+    def record(self, endpoint, status, seconds):
+        """
+        Records one request to `endpoint` that answered `status` after `seconds`.
+        """
+        milliseconds = seconds * 1000
+        with self.lock:
+            stats = self.endpoints.setdefault(endpoint, {
+                'count': 0, 'errors': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'buckets': [0] * (len(self.buckets_ms) + 1),
+            })
+            stats['count'] += 1
+            stats['errors'] += status >= 400
+            stats['total_ms'] += milliseconds
+            stats['max_ms'] = max(stats['max_ms'], milliseconds)
+            stats['buckets'][bisect.bisect_left(self.buckets_ms, milliseconds)] += 1
+
+    def snapshot(self):
+        """
+        Returns the metrics as a JSON-serialisable dictionary.
+        """
+        labels = [f"le_{bound}ms" for bound in self.buckets_ms] + ['le_inf']
+        with self.lock:
+            return {
+                endpoint: {
+                    'count': stats['count'],
+                    'errors': stats['errors'],
+                    'mean_ms': stats['total_ms'] / stats['count'],
+                    'max_ms': stats['max_ms'],
+                    'histogram': dict(zip(labels, stats['buckets'])),
+                }
+                for endpoint, stats in self.endpoints.items()
+            }
+
+def create_server(model, host='127.0.0.1', port=8000, cache_size=1024, cache_ttl=300):
+    """
+    Creates the recommendation HTTP server around a loaded model.
+
+    Endpoints (all JSON):
+    - POST /recommend/genre, /recommend/liked, /recommend/preferences, /recommend/pagerank: the body is a batch request
+      without 'type' (see batch_recommend.run_query); the answer is {"recommendations": [...]}.
+    - GET /movies/<id>: all columns of a movie.
+    - GET /health: status and the size of the loaded data.
+    - GET /metrics: request counts and latency histograms per endpoint, the result cache counters under 'result_cache'
+      and, with a server.refresher, the TMDB refresh counters under 'tmdb_refresh'.
+
+    Each connection is handled in its own thread and kept alive between requests (HTTP/1.1). The model
+    is server.model, which may be replaced at any time (see tmdb_refresh.StatsRefresher): every
+    request is answered from the model that was current when it started.
+
+    Args:
+    model (tuple): The (final_df, graph, index) tuple from final_anqi.load_model.
+    host (str): The address to bind; the default only accepts local connections.
+    port (int): The port to listen on; 0 picks a free port (see server.server_address).
+    cache_size (int): The number of recommendation results cached, or 0 to disable the cache.
+    cache_ttl (float): The number of seconds a cached result is served for.
+
+    Returns:
+    http.server.ThreadingHTTPServer: The server. Call serve_forever() to run it.
+    """
+    metrics = LatencyHistogram()
+    cache = ResultCache(cache_size, cache_ttl) if cache_size else None
+    started = time.time()
+
+    class RecommendHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            start = time.perf_counter()
+            final_df, G, index = self.server.model
+            movie_match = MOVIE_PATH.match(self.path)
+            if self.path == '/health':
+                endpoint = '/health'
+                status, body = 200, {
+                    'status': 'ok', 'movies': len(final_df), 'graph_nodes': G.number_of_nodes(), 'uptime_s': time.time() - started,
+                }
+            elif self.path == '/metrics':
+                endpoint = '/metrics'
+                status, body = 200, metrics.snapshot()
+                if cache is not None:
+                    body['result_cache'] = cache.stats()
+                if self.server.refresher is not None:
+                    body['tmdb_refresh'] = self.server.refresher.stats()
+            elif movie_match:
+                endpoint = '/movies'
+                position = find_id_position(index, int(movie_match.group(1)))
+                if position is None:
+                    status, body = 404, {'error': 'Movie ID not found.'}
+                else:
+                    status, body = 200, json.loads(final_df.iloc[position].to_json())
+            else:
+                endpoint = 'other'
+                status, body = 404, {'error': f"Unknown path: {self.path}"}
+            self.send_json(status, body)
+            metrics.record(endpoint, status, time.perf_counter() - start)
+
+        def do_POST(self):
+            start = time.perf_counter()
+            match = RECOMMEND_PATH.match(self.path)
+            length = int(self.headers.get('Content-Length') or 0)
+            payload = self.rfile.read(length)
+            if match is None:
+                endpoint = 'other'
+                status, body = 404, {'error': f"Unknown path: {self.path}"}
+            else:
+                endpoint = self.path
+                try:
+                    request = json.loads(payload or b'{}')
+                    request['type'] = match.group(1)
+                    status, body = 200, {'recommendations': run_query(self.server.model, request, cache)}
+                except (ValueError, KeyError, TypeError) as error:
+                    status, body = 400, {'error': f"{type(error).__name__}: {error}"}
+                except Exception as error:
+                    # Any other failure is the server's: it is answered and counted as an error rather than dropping the connection.
+                    status, body = 500, {'error': f"{type(error).__name__}: {error}"}
+            self.send_json(status, body)
+            metrics.record(endpoint, status, time.perf_counter() - start)
+
+        def send_json(self, status, body):
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), RecommendHandler)
+    server.daemon_threads = True
+    server.model = model
+    server.refresher = None
+    server.metrics = metrics
+    server.result_cache = cache
+    return server
+
+def main():
+    """
+    Loads the model once and serves recommendations over HTTP until interrupted.
+
+    With --refresh-ttl, a background thread re-fetches the stale TMDB entries of the served movies
+    and swaps in an updated model (see tmdb_refresh.StatsRefresher).
+    """
+    parser = argparse.ArgumentParser(description='Serve the movie recommenders over HTTP.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--graph-mode', default='hub', choices=['hub', 'clique', 'similarity'], help='the graph the recommenders use')
+    parser.add_argument('--cache-size', type=int, default=1024, help='recommendation results cached (0 disables the cache)')
+    parser.add_argument('--cache-ttl', type=float, default=300, help='seconds a cached result is served for')
+    parser.add_argument('--refresh-ttl', type=float, default=None,
+                        help='re-fetch TMDB entries older than this many seconds in the background (off by default)')
+    parser.add_argument('--refresh-interval', type=float, default=3600, help='seconds between two background refreshes')
+    parser.add_argument('--refresh-batch', type=int, default=500, help='largest number of entries re-fetched per refresh')
+    parser.add_argument('--tmdb-url', default=TMDB_API_URL, help='the TMDB API root, e.g. http://127.0.0.1:8765/3 for tmdb_stub.py')
+    args = parser.parse_args()
+
+    cache_file, api_key = 'cache.sqlite', TMDB_API_KEY
+    server = create_server(load_model(cache_file, api_key, args.graph_mode), args.host, args.port, args.cache_size, args.cache_ttl)
+    if args.refresh_ttl is not None:
+        from tmdb_refresh import StatsRefresher
+
+        server.refresher = StatsRefresher(server, cache_file, api_key, args.refresh_ttl, args.refresh_interval, args.refresh_batch,
+                                          base_url=args.tmdb_url)
+        server.refresher.start()
+    print(f"Recommendation service listening on http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if server.refresher is not None:
+            server.refresher.stop()
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+class ResultCache:
+    """
+    A thread-safe LRU cache of recommendation results with a time-to-live and hit/miss counters.
+
+    Every entry is stored with the data version it was computed for (see data_version). Looking up
+    a key with a different version empties the cache, so results computed before the movie table
+    or graph changed are never served.
+    """
+
+    def __init__(self, max_size=1024, ttl=300, clock=time.monotonic):
+        """
+        Args:
+        max_size (int): The largest number of results kept; the least recently used is evicted first.
+        ttl (float): The number of seconds a result is served for, or None to keep results until evicted.
+        clock (callable): Returns the current time in seconds.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.version = None
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.expirations = self.invalidations = 0
+
+    def get(self, key, version):
+        """
+        Returns the result cached for `key` at data `version`, or None (counted as a miss).
+        """
+        with self.lock:
+            if version != self.version:
+                if self.entries:
+                    self.invalidations += 1
+                self.entries.clear()
+                self.version = version
+            entry = self.entries.get(key)
+            if entry is not None and self.ttl is not None and self.clock() - entry[1] > self.ttl:
+                del self.entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, version, result):
+        """
+        Caches the result of `key` computed at data `version`.
+        """
+        with self.lock:
+            if version != self.version:
+                return
+            self.entries[key] = (result, self.clock())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_compute(self, key, version, compute):
+        """
+        Returns the cached result of `key`, or calls `compute()` and caches what it returns.
+
+        Results are lists of movie dictionaries; they are stored as tuples and every caller gets its
+        own copy, so a caller changing its result does not change the cache.
+        """
+        result = self.get(key, version)
+        if result is None:
+            result = tuple(compute())
+            self.put(key, version, result)
+        return [dict(movie) for movie in result]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        """
+        Returns the counters as a dictionary: 'size', 'max_size', 'ttl', 'hits', 'misses', 'hit_rate',
+        'evictions' (least recently used), 'expirations' (older than ttl) and 'invalidations' (data changed).
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self.entries), 'max_size': self.max_size, 'ttl': self.ttl,
+                'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions, 'expirations': self.expirations, 'invalidations': self.invalidations,
+            }
+
+def data_version(graph):
+    """
+    Returns a value that changes whenever the data behind the recommenders changes.
+
+    A reloaded or refreshed model has a new graph object, and update_movies.apply_changes increments
+    graph.graph['version'] when it changes the table and graph in place. The graph is identified by
+    a weak reference, which equals another reference to the same live graph but never one to a
+    different graph, so the version does not keep a replaced graph in memory. A model attached from
+    a shared model file (see shared_model.attach_model) has no graph and never changes.
+
+    Args:
+    graph (networkx.Graph): The graph of the loaded model, or None.
+
+    Returns:
+    tuple: The version.
+    """
+    if graph is None:
+        return (None, 0)
+    return (weakref.ref(graph), graph.graph.get('version', 0))
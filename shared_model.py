@@ -0,0 +1,294 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import argparse
+import hashlib
+import json
+import os
+import time
+from collections.abc import Mapping, Sequence
+
+import numpy as np
+
+from snapshot import _encode_strings
+
+MODEL_FILE = 'movie_model.bin'
+MODEL_VERSION = 1
+_MAGIC = b'MOVIEIDX'
+# Every array starts at a multiple of this many bytes of the file.
+_ALIGN = 64
+
+# The keys of the movie index that are not plain arrays, by how they are stored.
+_STRING_LISTS = ('titles', 'sorted_titles', 'node_titles', 'genres')
+_STRING_LOOKUPS = ('title_positions', 'normalized_title_positions', 'genre_positions')
+_POSTINGS = ('genre_postings', 'cast_postings', 'crew_postings')
+# Tables that are cheap to rebuild and would only pin memory of the exporting process.
+_SKIPPED = ('bulk_tables', 'walk_model')
+
+def _string_hashes(strings):
+    """
+    Hashes strings to uint64 values that are the same in every process (unlike hash()).
+    """
+    return np.array([int.from_bytes(hashlib.blake2b(string.encode('utf-8'), digest_size=8).digest(), 'little') for string in strings],
+                    dtype=np.uint64)
+
+class PackedStrings(Sequence):
+    """
+    A read-only list of strings stored as one UTF-8 buffer and an offsets array.
+
+    Strings are decoded when they are accessed, so the list costs its two arrays and no Python objects.
+    """
+
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self[item] for item in range(*position.indices(len(self)))]
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError(f"index {position} is out of range")
+        return self.data[self.offsets[position]:self.offsets[position + 1]].tobytes().decode('utf-8')
+
+class StringLookup(Mapping):
+    """
+    A read-only dictionary from strings to integers, stored as sorted 64-bit string hashes.
+
+    A lookup is a binary search for the hash of the key, confirmed by comparing the stored key, so
+    the dictionary costs three arrays and no Python objects. Keys are iterated in hash order.
+    """
+
+    def __init__(self, hashes, key_strings, key_values):
+        self.hashes = hashes
+        self.key_strings = key_strings
+        self.key_values = key_values
+
+    @classmethod
+    def arrays_of(cls, mapping):
+        """
+        Returns the arrays a StringLookup of `mapping` is stored as: 'hashes', 'data', 'offsets' and 'values'.
+        """
+        # Keys that are not strings (a missing title) can never be looked up by the recommenders.
+        keys = [key for key in mapping if isinstance(key, str)]
+        hashes = _string_hashes(keys)
+        order = np.argsort(hashes, kind='stable')
+        data, offsets = _encode_strings([keys[position] for position in order.tolist()])
+        return {'hashes': hashes[order], 'data': data, 'offsets': offsets,
+                'values': np.array([mapping[key] for key in keys], dtype=np.int64)[order]}
+
+    def _slot(self, key):
+        if not isinstance(key, str):
+            return None
+        key_hash = _string_hashes([key])[0]
+        slot = int(np.searchsorted(self.hashes, key_hash))
+        while slot < len(self.hashes) and self.hashes[slot] == key_hash:
+            if self.key_strings[slot] == key:
+                return slot
+            slot += 1
+        return None
+
+    def __getitem__(self, key):
+        slot = self._slot(key)
+        if slot is None:
+            raise KeyError(key)
+        return int(self.key_values[slot])
+
+    def __contains__(self, key):
+        return self._slot(key) is not None
+
+    def __iter__(self):
+        return iter(self.key_strings)
+
+    def __len__(self):
+        return len(self.hashes)
+
+class IdLookup(Mapping):
+    """
+    A read-only dictionary from movie ids to their first position, stored as two sorted arrays.
+    """
+
+    def __init__(self, sorted_ids, positions):
+        self.sorted_ids = sorted_ids
+        self.positions = positions
+
+    def __getitem__(self, movie_id):
+        slot = int(np.searchsorted(self.sorted_ids, movie_id))
+        if slot == len(self.sorted_ids) or self.sorted_ids[slot] != movie_id:
+            raise KeyError(movie_id)
+        return int(self.positions[slot])
+
+    def __iter__(self):
+        return iter(self.sorted_ids.tolist())
+
+    def __len__(self):
+        return len(self.sorted_ids)
+
+class PostingsLookup(Mapping):
+    """
+    A read-only inverted index (see movie_index.build_inverted_index) stored as a CSR matrix.
+
+    The positions of the rows containing a name are a view into one shared positions array.
+    """
+
+    def __init__(self, names, indptr, positions):
+        self.names = names
+        self.indptr = indptr
+        self.positions = positions
+
+    def __getitem__(self, name):
+        slot = self.names[name]
+        return self.positions[self.indptr[slot]:self.indptr[slot + 1]]
+
+    def __contains__(self, name):
+        return name in self.names
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+def _index_arrays(index):
+    """
+    Flattens a movie index into named arrays, and the meta data needed to rebuild it.
+    """
+    arrays, kinds = {}, {}
+    for key, value in index.items():
+        if key in _SKIPPED:
+            continue
+        if key in _STRING_LISTS:
+            kinds[key] = 'strings'
+            arrays[key + '.data'], arrays[key + '.offsets'] = _encode_strings([str(string) for string in value])
+        elif key in _STRING_LOOKUPS:
+            kinds[key] = 'lookup'
+            arrays.update({f"{key}.{name}": array for name, array in StringLookup.arrays_of(value).items()})
+        elif key in _POSTINGS:
+            kinds[key] = 'postings'
+            names = list(value)
+            arrays.update({f"{key}.{name}": array for name, array in StringLookup.arrays_of({name: slot for slot, name in enumerate(names)}).items()})
+            indptr = np.zeros(len(names) + 1, dtype=np.int64)
+            np.cumsum([len(value[name]) for name in names], out=indptr[1:])
+            arrays[key + '.indptr'] = indptr
+            arrays[key + '.positions'] = np.concatenate([value[name] for name in names]).astype(np.int64) if names else np.zeros(0, dtype=np.int64)
+        elif key == 'id_positions':
+            kinds[key] = 'ids'
+            sorted_ids = np.array(sorted(value), dtype=index['ids'].dtype)
+            arrays[key + '.ids'] = sorted_ids
+            arrays[key + '.positions'] = np.array([value[movie_id] for movie_id in sorted_ids.tolist()], dtype=np.int64)
+        else:
+            kinds[key] = 'array'
+            arrays[key] = np.asarray(value)
+            if arrays[key].dtype == object:
+                raise ValueError(f"Cannot share the index entry {key!r} of Python objects")
+    return arrays, kinds
+
+def export_model(index, filename=MODEL_FILE, source_hash=''):
+    """
+    Writes a movie index to one file that worker processes map into memory instead of loading it.
+
+    Numeric arrays (ids, ratings, the genre matrix and bitmasks, the similarity CSR matrix, the
+    similar-movies table) are written as they are. The inverted indexes become CSR matrices of row
+    positions, the title and id dictionaries become sorted hash and id arrays, and string lists
+    become UTF-8 buffers, so that attach_model can serve all of them from the mapped file.
+
+    Args:
+    index (dict): The index from movie_index.build_movie_index.
+    filename (str): The path of the model file.
+    source_hash (str): A digest of the data the index was built from, checked by attach_model.
+
+    Raises:
+    ValueError: If the index holds an entry of Python objects that cannot be shared.
+    """
+    arrays, kinds = _index_arrays(index)
+    entries, offset = {}, 0
+    for name, array in arrays.items():
+        offset = -(-offset // _ALIGN) * _ALIGN
+        entries[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        offset += array.nbytes
+    meta = json.dumps({'version': MODEL_VERSION, 'source_hash': source_hash, 'kinds': kinds, 'arrays': entries}).encode('utf-8')
+    data_start = -(-(len(_MAGIC) + 8 + len(meta)) // _ALIGN) * _ALIGN
+
+    temp_filename = filename + '.tmp'
+    with open(temp_filename, 'wb') as file:
+        file.write(_MAGIC + len(meta).to_bytes(8, 'little') + meta)
+        for name, array in arrays.items():
+            file.seek(data_start + entries[name]['offset'])
+            file.write(np.ascontiguousarray(array).tobytes())
+        file.truncate(data_start + offset)
+    os.replace(temp_filename, filename)
+
+def attach_model(filename=MODEL_FILE, source_hash=None):
+    """
+    Maps a model file written by export_model and returns the movie index it holds.
+
+    Nothing is read or copied: every array of the index is a read-only view of the mapped file, and
+    the dictionaries are array-backed Mappings. All processes attaching the same file share its
+    pages through the operating system's page cache, so a process costs only what it computes.
+
+    Args:
+    filename (str): The path of the model file.
+    source_hash (str): If given, the file is only used when it was exported with this hash.
+
+    Returns:
+    dict: A movie index the recommenders accept, or None if the file does not exist or is stale.
+    """
+    if not os.path.exists(filename):
+        return None
+    raw = np.memmap(filename, dtype=np.uint8, mode='r')
+    if raw[:len(_MAGIC)].tobytes() != _MAGIC:
+        return None
+    meta_length = int.from_bytes(raw[len(_MAGIC):len(_MAGIC) + 8].tobytes(), 'little')
+    meta = json.loads(raw[len(_MAGIC) + 8:len(_MAGIC) + 8 + meta_length].tobytes().decode('utf-8'))
+    if meta['version'] != MODEL_VERSION or (source_hash is not None and meta['source_hash'] != source_hash):
+        return None
+    data_start = -(-(len(_MAGIC) + 8 + meta_length) // _ALIGN) * _ALIGN
+
+    def array(name):
+        entry = meta['arrays'][name]
+        dtype = np.dtype(entry['dtype'])
+        start = data_start + entry['offset']
+        size = int(np.prod(entry['shape'], dtype=np.int64)) * dtype.itemsize
+        return raw[start:start + size].view(dtype).reshape(entry['shape'])
+
+    def lookup(key):
+        return StringLookup(array(key + '.hashes'), PackedStrings(array(key + '.data'), array(key + '.offsets')), array(key + '.values'))
+
+    index = {}
+    for key, kind in meta['kinds'].items():
+        if kind == 'strings':
+            index[key] = PackedStrings(array(key + '.data'), array(key + '.offsets'))
+        elif kind == 'lookup':
+            index[key] = lookup(key)
+        elif kind == 'postings':
+            index[key] = PostingsLookup(lookup(key), array(key + '.indptr'), array(key + '.positions'))
+        elif kind == 'ids':
+            index[key] = IdLookup(array(key + '.ids'), array(key + '.positions'))
+        else:
+            index[key] = array(key)
+    return index
+
+def main():
+    """
+    Exports the movie index of the saved movie table and its graph for batch_recommend.py --model-file.
+    """
+    parser = argparse.ArgumentParser(description='Write the movie index to a file worker processes can map.')
+    parser.add_argument('--graph-mode', default='hub', choices=['hub', 'clique', 'similarity'], help='the graph the recommenders use')
+    parser.add_argument('--output', default=MODEL_FILE, help='the model file')
+    args = parser.parse_args()
+
+    from final_anqi import load_model
+    from snapshot import INPUT_FILES, hash_input_files
+
+    _, _, index = load_model(graph_mode=args.graph_mode)
+    start = time.perf_counter()
+    export_model(index, args.output, f"{hash_input_files(INPUT_FILES)}:{args.graph_mode}")
+    print(f"Wrote the index of {len(index['ids'])} movies to {args.output} ({os.path.getsize(args.output) / 1e6:.1f} MB) "
+          f"in {time.perf_counter() - start:.2f}s")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import argparse
+import hashlib
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from movie_index import quality_ranks
+
+SIMILAR_MOVIES_FILE = 'similar_movies.npz'
+# The number of keys scored at once by one block of compute_similar_movies.
+_BLOCK_KEYS = 1 << 22
+
+def index_signature(index):
+    """
+    Hashes everything the similar-movies table is derived from.
+
+    Args:
+    index (dict): The index from movie_index.build_movie_index.
+
+    Returns:
+    str: A SHA-256 hex digest of the ids, the genre matrix, the graph membership and the rating keys.
+    """
+    digest = hashlib.sha256()
+    for key in ('ids', 'in_graph', 'vote_average', 'popularity'):
+        digest.update(np.ascontiguousarray(index[key]).tobytes())
+    # The order of the genre columns depends on set iteration order, which changes between runs.
+    order = sorted(range(len(index['genres'])), key=index['genres'].__getitem__)
+    digest.update(np.ascontiguousarray(index['genre_matrix'][:, order]).tobytes())
+    digest.update('\0'.join(index['genres'][column] for column in order).encode('utf-8'))
+    return digest.hexdigest()
+
+def compute_similar_movies(index, k=50, workers=None):
+    """
+    Precomputes the k movies recommend_movies_with_detailed_info would suggest for every single liked movie.
+
+    The movies similar to a movie are the other movies of the graph ordered by the number of genres
+    they share with it, then by vote_average, popularity and position, which is the ranking of
+    recommend_movies_with_detailed_info for one liked movie. Movies with the same set of genres have
+    the same ranking, so the ranking is computed once per distinct genre set: the overlaps of a block
+    of genre sets with every movie are one matrix product, and the best movies of each set are found
+    with a partial sort of one integer key per movie. The blocks run in a pool of threads (NumPy
+    releases the GIL for the product and the partition).
+
+    Args:
+    index (dict): The index from movie_index.build_movie_index.
+    k (int): The number of similar movies kept per movie.
+    workers (int): The number of threads; all cores by default.
+
+    Returns:
+    numpy.ndarray: An int32 array of shape (positions, k). Row p holds the positions of the movies
+    most similar to the movie at position p, best first, padded with -1 (rows of movies that are
+    not in the graph are all -1).
+    """
+    ids = index['ids']
+    genre_matrix = index['genre_matrix']
+    num_rows = len(ids)
+    candidates = np.flatnonzero(index['in_graph'])
+    neighbors = np.full((num_rows, k), -1, dtype=np.int32)
+    if candidates.size < 2 or k <= 0:
+        return neighbors
+
+    genre_sets, set_of_movie = np.unique(genre_matrix[candidates], axis=0, return_inverse=True)
+    set_of_movie = set_of_movie.reshape(-1)
+    # A movie is never similar to itself or to another row with its id, so a few extra movies are kept per set.
+    width = min(k + int(np.unique(ids[candidates], return_counts=True)[1].max()), candidates.size)
+    candidate_genres = genre_matrix[candidates].T
+    candidate_quality = quality_ranks(index)[candidates]
+    block_rows = max(1, _BLOCK_KEYS // candidates.size)
+
+    def rank_block(start):
+        overlap = genre_sets[start:start + block_rows] @ candidate_genres
+        keys = overlap.astype(np.int64) * num_rows + candidate_quality
+        if width < candidates.size:
+            top = np.argpartition(-keys, width - 1, axis=1)[:, :width]
+        else:
+            top = np.broadcast_to(np.arange(candidates.size), keys.shape)
+        order = np.argsort(-np.take_along_axis(keys, top, axis=1), axis=1)
+        return candidates[np.take_along_axis(top, order, axis=1)]
+
+    with ThreadPoolExecutor(workers or os.cpu_count() or 1) as executor:
+        set_lists = np.concatenate(list(executor.map(rank_block, range(0, len(genre_sets), block_rows))))
+
+    lists = set_lists[set_of_movie]
+    keep = ids[lists] != ids[candidates][:, None]
+    keep &= np.cumsum(keep, axis=1) <= k
+    # A stable sort moves the kept entries of every row to the front without changing their order.
+    order = np.argsort(~keep, axis=1, kind='stable')[:, :k]
+    kept = np.take_along_axis(keep, order, axis=1)
+    neighbors[candidates, :order.shape[1]] = np.where(kept, np.take_along_axis(lists, order, axis=1), -1)
+    return neighbors
+
+def save_similar_movies(filename, index, neighbors):
+    """
+    Writes the similar-movies table with the signature of the index it was computed from.
+    """
+    temp_filename = filename + '.tmp.npz'
+    np.savez(temp_filename, neighbors=neighbors, signature=np.array(index_signature(index)))
+    os.replace(temp_filename, filename)
+
+def load_similar_movies(filename, index):
+    """
+    Loads a similar-movies table if it was computed from the same data as `index`.
+
+    Returns:
+    numpy.ndarray: The table, or None if the file does not exist or is stale.
+    """
+    if not os.path.exists(filename):
+        return None
+    with np.load(filename) as arrays:
+        if str(arrays['signature']) != index_signature(index) or len(arrays['neighbors']) != len(index['ids']):
+            return None
+        return arrays['neighbors']
+
+def attach_similar_movies(index, filename=SIMILAR_MOVIES_FILE):
+    """
+    Adds the precomputed similar-movies table to a movie index, if there is a fresh one.
+
+    Args:
+    index (dict): The index from movie_index.build_movie_index of a 'hub' or 'clique' graph.
+    filename (str): The table file written by save_similar_movies.
+
+    Returns:
+    bool: Whether the table was added (as 'similar_movies', with the ranking values in 'quality').
+    """
+    table = load_similar_movies(filename, index)
+    if table is None:
+        return False
+    index['similar_movies'] = table
+    index['quality'] = quality_ranks(index)
+    return True
+
+def similar_movie_positions(index, liked_positions, liked_movie_ids, num_recommendations):
+    """
+    Answers a liked-movies query by merging the precomputed lists of the liked movies.
+
+    Every movie missing from the lists of the liked movies shares at most as many genres with each
+    liked movie as the last movie of its list, and is rated lower when it shares as many. The merged
+    movies that beat this bound are therefore ahead of every movie that was not looked at, and if
+    there are num_recommendations of them they are exactly the movies the full ranking of
+    recommend_movies_with_detailed_info would return.
+
+    Args:
+    index (dict): A movie index with the table attached by attach_similar_movies.
+    liked_positions (list): The distinct positions of the liked movies that are in the graph.
+    liked_movie_ids (list): The ids of all liked movies, which are never recommended.
+    num_recommendations (int): The number of movies to return.
+
+    Returns:
+    numpy.ndarray: The positions of the recommended movies in ranking order, or None if the lists
+    cannot decide the answer and the whole catalogue has to be ranked.
+    """
+    table = index['similar_movies']
+    if not liked_positions or num_recommendations > table.shape[1]:
+        return None
+    num_rows = len(index['ids'])
+    genre_matrix = index['genre_matrix']
+    quality = index['quality']
+    lists = table[liked_positions]
+    seen = np.unique(lists[lists >= 0])
+    seen = seen[~np.isin(index['ids'][seen], liked_movie_ids)]
+    liked_genre_counts = genre_matrix[liked_positions].sum(axis=0)
+    keys = (genre_matrix[seen] @ liked_genre_counts).astype(np.int64) * num_rows + quality[seen]
+
+    if (lists[:, -1] >= 0).all():
+        last = lists[:, -1]
+        overlap_bound = int(np.einsum('ij,ij->i', genre_matrix[last], genre_matrix[liked_positions]).sum())
+        # Unseen movies with overlap_bound shared genres rank below the worst of the last movies.
+        bound = overlap_bound * num_rows + quality[last].min()
+        safe = keys >= bound
+    else:
+        # A list shorter than the table covers every movie of the graph.
+        safe = np.ones(seen.size, dtype=bool)
+    if np.count_nonzero(safe) < num_recommendations:
+        return None
+    best = np.argsort(-keys[safe])[:num_recommendations]
+    return seen[safe][best]
+
+def main():
+    """
+    Precomputes the similar-movies table of the saved movie table and its genre graph.
+    """
+    parser = argparse.ArgumentParser(description='Precompute the most similar movies of every movie.')
+    parser.add_argument('-k', type=int, default=50, help='similar movies kept per movie')
+    parser.add_argument('--output', default=SIMILAR_MOVIES_FILE, help='the table file')
+    args = parser.parse_args()
+
+    from final_anqi import build_graph_model, load_final_df
+
+    final_df = load_final_df()
+    _, index = build_graph_model(final_df)
+    start = time.perf_counter()
+    neighbors = compute_similar_movies(index, args.k)
+    save_similar_movies(args.output, index, neighbors)
+    print(f"Wrote the {args.k} most similar movies of {int(index['in_graph'].sum())} movies to {args.output} "
+          f"in {time.perf_counter() - start:.2f}s")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from name_lists import concat_ranges, name_codes
+
+# The list columns whose names are compared.
+SIMILARITY_COLUMNS = ['genre_names', 'cast_names', 'crew_names', 'keyword_names', 'production_company_names']
+
+# A Mersenne prime larger than any token code, for the universal hash functions (a * x + b) mod p.
+_HASH_PRIME = (1 << 61) - 1
+_EMPTY_SIGNATURE = np.iinfo(np.uint32).max
+
+def movie_tokens(df, columns=SIMILARITY_COLUMNS):
+    """
+    Collects the attribute tokens of every movie as a CSR list of integer codes.
+
+    Args:
+    df (pandas.DataFrame): The movie table.
+    columns (list): The list columns to use.
+
+    Returns:
+    tuple: (indptr, codes, num_tokens) - the codes of row i are codes[indptr[i]:indptr[i + 1]],
+    sorted and without duplicates; num_tokens is the size of the vocabulary.
+    """
+    rows, codes = [], []
+    num_tokens = 0
+    for column in columns:
+        if column not in df.columns:
+            continue
+        column_rows, column_codes, _ = name_codes(df[column])
+        # Renumbering the codes in order of first appearance gives the same tokens whichever way the
+        # column is stored. Each column gets its own range of codes, which keeps equal names in
+        # different columns apart.
+        column_codes, vocabulary = pd.factorize(column_codes)
+        rows.append(column_rows)
+        codes.append(column_codes + num_tokens)
+        num_tokens += len(vocabulary)
+    if not rows:
+        return np.zeros(len(df) + 1, dtype=np.int64), np.zeros(0, dtype=np.int64), 0
+    pairs = np.unique(np.concatenate(rows) * max(num_tokens, 1) + np.concatenate(codes))
+    rows, codes = pairs // max(num_tokens, 1), pairs % max(num_tokens, 1)
+    indptr = np.zeros(len(df) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=len(df)), out=indptr[1:])
+    return indptr, codes, num_tokens
+
+def minhash_signatures(indptr, codes, num_permutations=128, seed=0):
+    """
+    Computes a MinHash signature of every token set.
+
+    The fraction of positions at which two signatures agree estimates the Jaccard similarity of the two sets.
+
+    Args:
+    indptr (numpy.ndarray): The CSR row pointers from movie_tokens.
+    codes (numpy.ndarray): The token codes from movie_tokens.
+    num_permutations (int): The length of the signatures.
+    seed (int): The random seed of the hash functions.
+
+    Returns:
+    numpy.ndarray: A uint32 array of shape (rows, num_permutations). Rows without tokens are all
+    set to the largest uint32, and never agree with a non-empty row.
+    """
+    rng = np.random.default_rng(seed)
+    multipliers = rng.integers(1, 1 << 31, num_permutations, dtype=np.uint64)
+    offsets = rng.integers(0, 1 << 31, num_permutations, dtype=np.uint64)
+    num_rows = len(indptr) - 1
+    nonempty = np.flatnonzero(np.diff(indptr) > 0)
+    codes = codes.astype(np.uint64)
+    signatures = np.full((num_rows, num_permutations), _EMPTY_SIGNATURE, dtype=np.uint32)
+    if codes.size == 0:
+        return signatures
+    for permutation in range(num_permutations):
+        hashes = (multipliers[permutation] * codes + offsets[permutation]) % _HASH_PRIME
+        # reduceat takes the minimum of each row's slice; empty rows are skipped via `nonempty`.
+        signatures[nonempty, permutation] = np.minimum.reduceat(hashes & 0xFFFFFFFF, indptr[nonempty]).astype(np.uint32)
+    return signatures
+
+def _pairs_within_runs(order, run_starts, run_ends):
+    """
+    Lists every pair of elements of `order` that lie in the same run [start, end).
+    """
+    sizes = run_ends - run_starts
+    first_positions = concat_ranges(run_starts, run_ends - 1)
+    if first_positions.size == 0:
+        return np.zeros((0, 2), dtype=np.int64)
+    run_of = np.repeat(np.arange(len(sizes)), sizes - 1)
+    counts = run_ends[run_of] - 1 - first_positions
+    total = int(counts.sum())
+    within = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    first = np.repeat(first_positions, counts)
+    second = first + 1 + within
+    return np.stack([order[first], order[second]], axis=1)
+
+def lsh_candidate_pairs(signatures, bands=64, max_bucket=50):
+    """
+    Finds pairs of rows whose signatures agree on at least one band, without comparing all pairs.
+
+    The signatures are cut into `bands` bands of equal width. Rows whose band values are all equal
+    fall into the same bucket, and every pair of rows sharing a bucket is a candidate. Two sets with
+    Jaccard similarity s become candidates with probability 1 - (1 - s^r)^bands, where r is the
+    band width. Buckets with more than `max_bucket` rows (e.g. movies that only have a common
+    genre) are skipped, which bounds the work per band by the number of rows times max_bucket.
+
+    Args:
+    signatures (numpy.ndarray): The MinHash signatures.
+    bands (int): The number of bands; it must divide the signature length.
+    max_bucket (int): The largest bucket whose pairs are listed.
+
+    Returns:
+    numpy.ndarray: An int64 array of shape (pairs, 2) with i < j in every row and no duplicates.
+    """
+    num_rows, num_permutations = signatures.shape
+    if num_permutations % bands:
+        raise ValueError(f"{bands} bands do not divide signatures of length {num_permutations}")
+    width = num_permutations // bands
+    nonempty = np.flatnonzero(signatures[:, 0] != _EMPTY_SIGNATURE)
+    mixers = np.random.default_rng(0).integers(1, 1 << 63, width, dtype=np.uint64) | np.uint64(1)
+    pair_codes = []
+    for band in range(bands):
+        band_values = signatures[nonempty, band * width:(band + 1) * width].astype(np.uint64)
+        # Overflowing uint64 arithmetic wraps around, which is what a hash of the band needs.
+        keys = (band_values * mixers).sum(axis=1, dtype=np.uint64) + np.uint64(band)
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        boundaries = np.flatnonzero(np.diff(sorted_keys)) + 1
+        run_starts = np.concatenate([[0], boundaries])
+        run_ends = np.concatenate([boundaries, [len(sorted_keys)]])
+        sizes = run_ends - run_starts
+        keep = (sizes >= 2) & (sizes <= max_bucket)
+        pairs = _pairs_within_runs(nonempty[order], run_starts[keep], run_ends[keep])
+        if pairs.size:
+            low, high = pairs.min(axis=1), pairs.max(axis=1)
+            pair_codes.append(np.unique(low * num_rows + high))
+    if not pair_codes:
+        return np.zeros((0, 2), dtype=np.int64)
+    pair_codes = np.unique(np.concatenate(pair_codes))
+    return np.stack([pair_codes // num_rows, pair_codes % num_rows], axis=1)
+
+def estimate_similarity(signatures, pairs, chunk_size=200000):
+    """
+    Estimates the Jaccard similarity of every pair as the fraction of agreeing signature values.
+
+    Returns:
+    numpy.ndarray: A float32 array with one similarity per pair.
+    """
+    similarities = np.empty(len(pairs), dtype=np.float32)
+    for start in range(0, len(pairs), chunk_size):
+        chunk = pairs[start:start + chunk_size]
+        similarities[start:start + chunk_size] = (signatures[chunk[:, 0]] == signatures[chunk[:, 1]]).mean(axis=1)
+    return similarities
+
+def top_k_neighbors(pairs, similarities, num_rows, k=10, min_similarity=0.05):
+    """
+    Keeps, for every row, the k candidate pairs with the highest similarity.
+
+    A pair is kept if it is among the k best of either of its rows, so every row keeps at most k
+    neighbours of its own choosing and the average degree is at most 2k.
+
+    Args:
+    pairs (numpy.ndarray): Candidate pairs (i < j).
+    similarities (numpy.ndarray): Their similarities.
+    num_rows (int): The number of rows.
+    k (int): The number of neighbours each row keeps.
+    min_similarity (float): Pairs below this similarity are dropped.
+
+    Returns:
+    tuple: (pairs, similarities) of the kept pairs, ordered by (i, j).
+    """
+    keep = similarities >= min_similarity
+    pairs, similarities = pairs[keep], similarities[keep]
+    sources = np.concatenate([pairs[:, 0], pairs[:, 1]])
+    targets = np.concatenate([pairs[:, 1], pairs[:, 0]])
+    weights = np.concatenate([similarities, similarities])
+    order = np.lexsort((targets, -weights, sources))
+    sorted_sources = sources[order]
+    group_starts = np.searchsorted(sorted_sources, np.arange(num_rows))
+    ranks = np.arange(len(order)) - group_starts[sorted_sources]
+    chosen = order[ranks < k]
+    low = np.minimum(sources[chosen], targets[chosen])
+    high = np.maximum(sources[chosen], targets[chosen])
+    codes, first = np.unique(low * num_rows + high, return_index=True)
+    return np.stack([codes // num_rows, codes % num_rows], axis=1), weights[chosen][first]
+
+def similarity_edges(df, k=10, num_permutations=128, bands=64, max_bucket=50, min_similarity=0.05, seed=0):
+    """
+    Finds approximately the k most similar movies of every movie by their genres, cast, crew, keywords and companies.
+
+    Similarity is the Jaccard similarity of the movies' combined attribute sets, estimated with
+    MinHash. Locality-sensitive hashing proposes the candidate pairs, so the cost grows with the
+    number of movies times the bucket size rather than with the number of movie pairs.
+
+    Args:
+    df (pandas.DataFrame): The movie table.
+    k (int): The number of neighbours kept per movie.
+    num_permutations (int): The MinHash signature length.
+    bands (int): The number of LSH bands (num_permutations / bands values per band).
+    max_bucket (int): LSH buckets with more movies are ignored.
+    min_similarity (float): Pairs with a lower estimated similarity are dropped.
+    seed (int): The random seed of the hash functions.
+
+    Returns:
+    tuple: (pairs, weights) - an int64 array of (i, j) row positions with i < j and the estimated similarity of each.
+    """
+    indptr, codes, _ = movie_tokens(df)
+    signatures = minhash_signatures(indptr, codes, num_permutations, seed)
+    pairs = lsh_candidate_pairs(signatures, bands, max_bucket)
+    return top_k_neighbors(pairs, estimate_similarity(signatures, pairs), len(df), k, min_similarity)
+
+def main():
+    """
+    Builds the similarity graph of the saved movie table and prints its size and degree statistics.
+    """
+    parser = argparse.ArgumentParser(description='Build the MinHash/LSH similarity graph of the movie table.')
+    parser.add_argument('-k', type=int, default=10, help='neighbours kept per movie')
+    parser.add_argument('--output', help='save the graph in the binary format to this directory')
+    args = parser.parse_args()
+
+    from construct_graph import create_movie_graph, save_graph_binary
+    from final_anqi import load_final_df
+
+    final_df = load_final_df()
+    start = time.perf_counter()
+    G = create_movie_graph(final_df, mode='similarity', k=args.k)
+    degrees = np.array([degree for _, degree in G.degree()])
+    weights = np.array([weight for _, _, weight in G.edges(data='weight')])
+    print(f"{G.number_of_nodes()} movies, {G.number_of_edges()} edges in {time.perf_counter() - start:.2f}s; "
+          f"degree mean {degrees.mean():.1f}, max {degrees.max()}; "
+          f"similarity median {np.median(weights) if weights.size else 0:.3f}")
+    if args.output:
+        save_graph_binary(G, args.output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from name_lists import NameListArray, _is_missing
+
+SNAPSHOT_VERSION = 1
+SNAPSHOT_FILE = 'movie_data.npz'
+# The movies added, removed and modified with update_movies.py, replayed after every rebuild.
+CHANGES_FILE = 'movie_changes.jsonl'
+INPUT_FILES = ['tmdb_5000_movies.csv', 'tmdb_5000_credits.csv', 'cache.sqlite', CHANGES_FILE]
+
+def hash_input_files(filenames):
+    """
+    Computes a content hash of the files a snapshot is built from.
+
+    Args:
+    filenames (list): Paths of the input files. Missing files are hashed as empty.
+
+    Returns:
+    str: A SHA-256 hex digest of the snapshot version and the contents of the files.
+    """
+    digest = hashlib.sha256(f"snapshot-v{SNAPSHOT_VERSION}".encode())
+    for filename in filenames:
+        digest.update(filename.encode() + b'\0')
+        if os.path.exists(filename):
+            with open(filename, 'rb') as file:
+                for block in iter(lambda: file.read(1 << 20), b''):
+                    digest.update(block)
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+def _encode_strings(strings):
+    """
+    Packs a list of strings into a UTF-8 byte buffer and an offsets array.
+    """
+    encoded = [string.encode('utf-8') for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(data) for data in encoded], out=offsets[1:])
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+def _decode_strings(data, offsets):
+    """
+    Unpacks strings packed by _encode_strings.
+    """
+    buffer = data.tobytes()
+    bounds = offsets.tolist()
+    return [buffer[start:end].decode('utf-8') for start, end in zip(bounds[:-1], bounds[1:])]
+
+def _column_kind(values):
+    """
+    Classifies an object column as 'string', 'list' or 'json'.
+    """
+    present = [value for value in values if not _is_missing(value)]
+    if all(isinstance(value, str) for value in present):
+        return 'string'
+    if all(isinstance(value, list) and all(isinstance(item, str) for item in value) for value in values):
+        return 'list'
+    return 'json'
+
+def save_snapshot(df, filename, source_hash):
+    """
+    Writes a DataFrame to a binary columnar snapshot.
+
+    Numeric columns are stored as-is. String columns are stored as one UTF-8 buffer with offsets
+    and a missing-value mask. List columns (e.g. cast_names) are stored as offsets into an array of
+    integer codes plus the vocabulary of distinct names, and are loaded back as NameListArrays
+    without decoding a single name. Any other column is stored as JSON text.
+
+    Args:
+    df (pandas.DataFrame): The DataFrame to save, e.g. final_df.
+    filename (str): The path of the snapshot file (.npz).
+    source_hash (str): The hash_input_files digest of the inputs the DataFrame was built from.
+    """
+    arrays = {}
+    columns = []
+    for position, column in enumerate(df.columns):
+        key = f"c{position}"
+        series = df[column]
+        if isinstance(series.array, NameListArray):
+            kind = 'list'
+            values = series.array
+        elif pd.api.types.is_numeric_dtype(series.dtype) or pd.api.types.is_bool_dtype(series.dtype):
+            kind = 'numeric'
+            arrays[key] = series.to_numpy()
+        else:
+            values = series.tolist()
+            kind = _column_kind(values)
+            if kind == 'list':
+                values = NameListArray.from_lists(values)
+            else:
+                missing = np.array([_is_missing(value) for value in values], dtype=bool)
+                if kind == 'json':
+                    values = [json.dumps(value) for value in values]
+                strings = ['' if is_missing else value for value, is_missing in zip(values, missing)]
+                arrays[key + '.data'], arrays[key + '.offsets'] = _encode_strings(strings)
+                arrays[key + '.missing'] = missing
+        if kind == 'list':
+            arrays[key + '.codes'] = values.row_codes()
+            arrays[key + '.offsets'] = values.offsets - values.offsets[0]
+            arrays[key + '.vocab'], arrays[key + '.vocab_offsets'] = _encode_strings(values.vocabulary)
+        columns.append({'name': column, 'key': key, 'kind': kind})
+
+    meta = {'version': SNAPSHOT_VERSION, 'source_hash': source_hash, 'num_rows': len(df), 'columns': columns}
+    arrays['meta'] = np.frombuffer(json.dumps(meta).encode('utf-8'), dtype=np.uint8)
+
+    temp_filename = filename + '.tmp.npz'
+    np.savez(temp_filename, **arrays)
+    os.replace(temp_filename, filename)
+
+def load_snapshot(filename, source_hash=None):
+    """
+    Loads a DataFrame written by save_snapshot.
+
+    Args:
+    filename (str): The path of the snapshot file (.npz).
+    source_hash (str): If given, the snapshot is only used when it was built from inputs with this hash.
+
+    Returns:
+    pandas.DataFrame: The DataFrame, or None if the snapshot does not exist or is stale.
+    """
+    if not os.path.exists(filename):
+        return None
+
+    with np.load(filename) as arrays:
+        meta = json.loads(arrays['meta'].tobytes().decode('utf-8'))
+        if meta['version'] != SNAPSHOT_VERSION:
+            return None
+        if source_hash is not None and meta['source_hash'] != source_hash:
+            return None
+
+        data = {}
+        for column in meta['columns']:
+            key = column['key']
+            if column['kind'] == 'numeric':
+                data[column['name']] = arrays[key]
+            elif column['kind'] == 'list':
+                vocabulary = _decode_strings(arrays[key + '.vocab'], arrays[key + '.vocab_offsets'])
+                data[column['name']] = pd.Series(NameListArray(vocabulary, arrays[key + '.codes'], arrays[key + '.offsets']))
+            else:
+                strings = _decode_strings(arrays[key + '.data'], arrays[key + '.offsets'])
+                missing = arrays[key + '.missing'].tolist()
+                # Missing values are stored as empty strings, which are not JSON.
+                decode = json.loads if column['kind'] == 'json' else str
+                data[column['name']] = [np.nan if is_missing else decode(value) for value, is_missing in zip(strings, missing)]
+
+    return pd.DataFrame(data, columns=[column['name'] for column in meta['columns']])
+
+def _replay_changes(final_df, changes_file=CHANGES_FILE):
+    """
+    Applies the change log of update_movies.py, if there is one, to a table built from the CSVs and cache.
+    """
+    if not os.path.exists(changes_file):
+        return final_df
+    from update_movies import replay_changes
+
+    return replay_changes(final_df, changes_file)
+
+def load_or_build(build_final_df, snapshot_file=SNAPSHOT_FILE, input_files=INPUT_FILES, changes_file=CHANGES_FILE):
+    """
+    Returns the merged movie table from a fresh snapshot, or builds it and writes a new snapshot.
+
+    A built table gets the changes logged by update_movies.py replayed, so they are not lost when
+    an input file changes.
+
+    Args:
+    build_final_df (callable): A function taking no arguments that builds final_df from the CSVs and cache.
+    snapshot_file (str): The path of the snapshot file.
+    input_files (list): The files whose contents decide whether the snapshot is fresh.
+    changes_file (str): The change log of update_movies.py.
+
+    Returns:
+    pandas.DataFrame: The merged movie table.
+    """
+    final_df = load_snapshot(snapshot_file, hash_input_files(input_files))
+    if final_df is None:
+        final_df = _replay_changes(build_final_df(), changes_file)
+        # Hash after building: building may have added entries to the cache.
+        save_snapshot(final_df, snapshot_file, hash_input_files(input_files))
+    return final_df
+
+def main():
+    """
+    Builds the snapshot of the merged movie table from the CSVs and the TMDB cache.
+
+    Both final_anqi.main and construct_graph.main load the snapshot instead of parsing the CSVs
+    as long as none of the input files has changed since it was written. The changes logged by
+    update_movies.py are applied to the built table.
+    """
+    from construct_graph import build_final_df
+    from tmdb_client import TMDB_API_KEY
+
+    final_df = _replay_changes(build_final_df('cache.sqlite', TMDB_API_KEY))
+    save_snapshot(final_df, SNAPSHOT_FILE, hash_input_files(INPUT_FILES))
+    print(f"Wrote {len(final_df)} movies to {SNAPSHOT_FILE}")
+
+if __name__ == '__main__':
+    main()
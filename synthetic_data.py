@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import argparse
+import csv
+import json
+import os
+
+import numpy as np
+
+# TMDB genres with their approximate share of tmdb_5000_movies.csv.
+GENRE_WEIGHTS = {
+    'Drama': 2297, 'Comedy': 1722, 'Thriller': 1274, 'Action': 1154, 'Romance': 894, 'Adventure': 790,
+    'Crime': 696, 'Science Fiction': 535, 'Horror': 519, 'Family': 513, 'Fantasy': 424, 'Mystery': 348,
+    'Animation': 234, 'History': 197, 'Music': 185, 'War': 144, 'Documentary': 110, 'Western': 82,
+    'Foreign': 34, 'TV Movie': 8,
+}
+GENRE_IDS = {genre: genre_id for genre_id, genre in enumerate(GENRE_WEIGHTS, start=1)}
+
+MOVIE_COLUMNS = [
+    'budget', 'genres', 'homepage', 'id', 'keywords', 'original_language', 'original_title', 'overview',
+    'popularity', 'production_companies', 'production_countries', 'release_date', 'revenue', 'runtime',
+    'spoken_languages', 'status', 'tagline', 'title', 'vote_average', 'vote_count',
+]
+CREDIT_COLUMNS = ['movie_id', 'title', 'cast', 'crew']
+
+def _zipf_choice(rng, pool_size, size, exponent=1.2):
+    """
+    Draws indices in [0, pool_size) where low indices are much more frequent, like prolific actors.
+    """
+    return (rng.zipf(exponent, size) - 1) % pool_size
+
+def _named_list(names, ids, extra=None):
+    """
+    Formats a TMDB-style JSON list of {"id": ..., "name": ...} objects.
+    """
+    return json.dumps([dict(id=int(item_id), name=name, **(extra or {})) for item_id, name in zip(ids, names)])
+
+def generate_dataset(num_movies, output_dir, seed=0, cache_fraction=0.8, chunk_size=10000):
+    """
+    Writes a synthetic dataset with the schema of the TMDB 5000 files.
+
+    The output directory receives tmdb_5000_movies.csv, tmdb_5000_credits.csv and cache.json.
+    Genres follow the TMDB genre frequencies, and cast, crew, keywords and production companies are
+    drawn from Zipf distributions so that a few names appear in many movies. About 0.5% of the
+    movies have no overview (and are dropped by the loaders), a few titles are duplicated, and the
+    first `cache_fraction` of the movies are in the TMDB cache. Rows are generated and written in
+    chunks, so memory use does not grow with `num_movies`.
+
+    Args:
+    num_movies (int): The number of movies to generate.
+    output_dir (str): The directory to write the files into; it is created if needed.
+    seed (int): The random seed.
+    cache_fraction (float): The fraction of movies written to cache.json.
+    chunk_size (int): The number of movies generated at a time.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    genres = list(GENRE_WEIGHTS)
+    genre_probabilities = np.array(list(GENRE_WEIGHTS.values()), dtype=float)
+    genre_probabilities /= genre_probabilities.sum()
+    num_people = max(1000, num_movies * 4)
+    num_keywords = max(500, num_movies // 2)
+    num_companies = max(200, num_movies // 5)
+    num_cached = int(num_movies * cache_fraction)
+
+    with open(os.path.join(output_dir, 'tmdb_5000_movies.csv'), 'w', newline='') as movies_file, \
+            open(os.path.join(output_dir, 'tmdb_5000_credits.csv'), 'w', newline='') as credits_file, \
+            open(os.path.join(output_dir, 'cache.json'), 'w') as cache_file:
+        movies_writer = csv.writer(movies_file)
+        credits_writer = csv.writer(credits_file)
+        movies_writer.writerow(MOVIE_COLUMNS)
+        credits_writer.writerow(CREDIT_COLUMNS)
+        cache_file.write('{')
+
+        for chunk_start in range(0, num_movies, chunk_size):
+            size = min(chunk_size, num_movies - chunk_start)
+            movie_ids = 10 + 7 * np.arange(chunk_start, chunk_start + size)
+            genre_counts = rng.choice([0, 1, 2, 3, 4], size=size, p=[0.01, 0.25, 0.37, 0.27, 0.10])
+            cast_counts = rng.integers(3, 30, size)
+            crew_counts = rng.integers(2, 40, size)
+            keyword_counts = rng.integers(0, 12, size)
+            popularity = rng.gamma(1.2, 15, size).round(6)
+            vote_average = rng.normal(6.2, 1.0, size).clip(0, 10).round(1)
+            vote_count = rng.zipf(1.5, size) % 15000
+            budget = (rng.lognormal(16, 1.5, size) * (rng.random(size) > 0.2)).astype(np.int64)
+            revenue = (budget * rng.gamma(2, 1.2, size)).astype(np.int64)
+
+            for row in range(size):
+                number = chunk_start + row
+                movie_id = int(movie_ids[row])
+                title = f"Synthetic Movie {number // 2 if number % 997 == 1 else number}"
+                movie_genres = rng.choice(genres, size=genre_counts[row], replace=False, p=genre_probabilities)
+                cast_ids = _zipf_choice(rng, num_people, cast_counts[row])
+                crew_ids = _zipf_choice(rng, num_people, crew_counts[row])
+                keyword_ids = _zipf_choice(rng, num_keywords, keyword_counts[row])
+                company_ids = _zipf_choice(rng, num_companies, 2)
+                movies_writer.writerow([
+                    int(budget[row]),
+                    _named_list(movie_genres, [GENRE_IDS[genre] for genre in movie_genres]),
+                    f"https://example.com/movie/{movie_id}" if number % 3 == 0 else '',
+                    movie_id,
+                    _named_list([f"keyword {keyword}" for keyword in keyword_ids], keyword_ids),
+                    'en',
+                    title,
+                    '' if number % 200 == 199 else f"Overview of synthetic movie {number}.",
+                    float(popularity[row]),
+                    _named_list([f"Company {company}" for company in company_ids], company_ids),
+                    json.dumps([{'iso_3166_1': 'US', 'name': 'United States of America'}]),
+                    f"{1950 + number % 70}-{1 + number % 12:02d}-{1 + number % 28:02d}",
+                    int(revenue[row]),
+                    float(80 + number % 90),
+                    json.dumps([{'iso_639_1': 'en', 'name': 'English'}]),
+                    'Released',
+                    f"Tagline {number}",
+                    title,
+                    float(vote_average[row]),
+                    int(vote_count[row]),
+                ])
+                credits_writer.writerow([
+                    movie_id,
+                    title,
+                    _named_list([f"Actor {person}" for person in cast_ids], cast_ids, {'character': 'Self'}),
+                    _named_list([f"Crew {person}" for person in crew_ids], crew_ids, {'job': 'Director'}),
+                ])
+                if number < num_cached:
+                    entry = {
+                        'popularity': float(popularity[row]), 'revenue': int(revenue[row]), 'tagline': f"Tagline {number}",
+                        'vote_average': float(vote_average[row]), 'vote_count': int(vote_count[row]),
+                    }
+                    cache_file.write(('' if number == 0 else ', ') + f'"{movie_id}": ' + json.dumps(entry))
+
+        cache_file.write('}')
+
+def main():
+    """
+    Generates a synthetic TMDB-shaped dataset from the command line.
+    """
+    parser = argparse.ArgumentParser(description='Generate a synthetic dataset with the TMDB 5000 schema.')
+    parser.add_argument('num_movies', type=int)
+    parser.add_argument('output_dir')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--cache-fraction', type=float, default=0.8)
+    args = parser.parse_args()
+    generate_dataset(args.num_movies, args.output_dir, args.seed, args.cache_fraction)
+
+if __name__ == '__main__':
+    main()
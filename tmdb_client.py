@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+TMDB_API_URL = 'https://api.themoviedb.org/3'
+# The TMDb API key used by every entry point: the TMDB_API_KEY environment variable, or the project's key.
+TMDB_API_KEY = os.environ.get('TMDB_API_KEY', "2bd7f718b7eaf4479d7e043103aaaaaf")
+TMDB_FIELDS = ('popularity', 'revenue', 'tagline', 'vote_average', 'vote_count')
+# Every cache entry also records when it was fetched, in seconds since the epoch (see tmdb_refresh.py).
+FETCHED_AT_FIELD = 'fetched_at'
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+class RateLimiter:
+    """
+    Spaces out calls so that at most `requests_per_second` start in any second, across threads.
+    """
+
+    def __init__(self, requests_per_second):
+        self.interval = 1.0 / requests_per_second if requests_per_second else 0.0
+        self.next_time = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """
+        Blocks until the caller may send its next request.
+        """
+        with self.lock:
+            now = time.monotonic()
+            start = max(self.next_time, now)
+            self.next_time = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+def create_session(pool_size):
+    """
+    Creates a requests session that keeps up to `pool_size` connections to TMDB alive.
+
+    Args:
+    pool_size (int): The number of pooled connections, normally the number of worker threads.
+
+    Returns:
+    requests.Session: The session.
+    """
+    # requests is only imported when the cache misses, to keep it out of the startup path.
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+def fetch_movie(session, movie_id, api_key, rate_limiter, base_url=TMDB_API_URL, timeout=10, max_retries=3, backoff=0.5):
+    """
+    Fetches the TMDB fields of one movie, retrying on rate limiting, server errors, network errors and unreadable responses.
+
+    Args:
+    session (requests.Session): The pooled session to send the request with.
+    movie_id (int): The unique identifier of the movie.
+    api_key (str): TMDb API key.
+    rate_limiter (RateLimiter): The limiter shared by all workers.
+    base_url (str): The API root, e.g. a local stub server for testing.
+    timeout (float): Per-request timeout in seconds.
+    max_retries (int): How many times a failed request is retried.
+    backoff (float): The first retry delay in seconds; it doubles on each retry. A Retry-After header takes precedence.
+
+    Returns:
+    dict: The TMDB fields of the movie, or None if the request failed.
+    """
+    import requests
+
+    url = f"{base_url}/movie/{movie_id}"
+    for attempt in range(max_retries + 1):
+        rate_limiter.wait()
+        retry_after = None
+        try:
+            response = session.get(url, params={'api_key': api_key}, timeout=timeout)
+            if response.status_code == 200:
+                data = response.json()
+                if not isinstance(data, dict):
+                    raise ValueError(f"Unexpected response body for movie {movie_id}")
+                return {field: data.get(field) for field in TMDB_FIELDS}
+        except (requests.RequestException, ValueError):
+            # Connection errors, timeouts, broken transfers and truncated or malformed bodies are retried.
+            pass
+        else:
+            if response.status_code not in RETRY_STATUS_CODES:
+                return None
+            retry_after = response.headers.get('Retry-After')
+        if attempt < max_retries:
+            delay = float(retry_after) if retry_after and retry_after.isdigit() else backoff * 2 ** attempt
+            time.sleep(delay)
+    return None
+
+def fetch_tmdb_data_bulk(movie_ids, api_key, cache_data, max_workers=16, requests_per_second=40, base_url=TMDB_API_URL,
+                         timeout=10, max_retries=3, progress=True):
+    """
+    Fetches many movies from TMDB concurrently and adds them to the cache.
+
+    Movies already in the cache are skipped. Requests are sent from a thread pool over one pooled
+    session and limited to `requests_per_second` in total. Every fetched entry is stamped with the
+    time it was fetched (FETCHED_AT_FIELD).
+
+    Args:
+    movie_ids (iterable): The ids of the movies to fetch.
+    api_key (str): TMDb API key.
+    cache_data (dict): The current cache of movie data; fetched movies are added to it under their string id.
+    max_workers (int): The number of requests kept in flight.
+    requests_per_second (float): The overall request rate limit, or None for no limit.
+    base_url (str): The API root, e.g. a local stub server for testing.
+    timeout (float): Per-request timeout in seconds.
+    max_retries (int): How many times a failed request is retried.
+    progress (bool): Whether to print progress and throughput to stderr while fetching.
+
+    Returns:
+    dict: Counts of 'fetched', 'failed' and 'cached' movies, the 'elapsed' seconds and the 'rate' in movies per second.
+    """
+    movie_ids = list(dict.fromkeys(movie_ids))
+    missing_ids = [movie_id for movie_id in movie_ids if str(movie_id) not in cache_data]
+    stats = {'fetched': 0, 'failed': 0, 'cached': len(movie_ids) - len(missing_ids), 'elapsed': 0.0, 'rate': 0.0}
+    if not missing_ids:
+        return stats
+
+    rate_limiter = RateLimiter(requests_per_second)
+    start = time.monotonic()
+    with create_session(max_workers) as session, ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(fetch_movie, session, movie_id, api_key, rate_limiter, base_url, timeout, max_retries): movie_id
+            for movie_id in missing_ids
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            movie_data = future.result()
+            if movie_data is None:
+                stats['failed'] += 1
+            else:
+                cache_data[str(futures[future])] = {**movie_data, FETCHED_AT_FIELD: time.time()}
+                stats['fetched'] += 1
+            if progress and (done % 100 == 0 or done == len(missing_ids)):
+                elapsed = time.monotonic() - start
+                # On stderr, so that it never mixes with results written to stdout (e.g. by batch_recommend).
+                print(f"Fetched {done}/{len(missing_ids)} movies ({done / elapsed:.1f} movies/s)", file=sys.stderr)
+
+    stats['elapsed'] = time.monotonic() - start
+    stats['rate'] = len(missing_ids) / stats['elapsed'] if stats['elapsed'] else 0.0
+    return stats
@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import argparse
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from cache_store import cache_to_dataframe
+from snapshot import INPUT_FILES, SNAPSHOT_FILE, hash_input_files, load_snapshot, save_snapshot
+from tmdb_client import FETCHED_AT_FIELD, TMDB_API_KEY, TMDB_API_URL, TMDB_FIELDS, fetch_tmdb_data_bulk
+
+# Entries older than this many seconds are re-fetched.
+DEFAULT_TTL = 7 * 24 * 3600
+
+def stale_movie_ids(cache_data, ttl, now=None, movie_ids=None, limit=None):
+    """
+    Lists the cached movies whose entries were fetched more than `ttl` seconds ago, most popular first.
+
+    Entries without a fetch time (written before entries were timestamped) are always stale.
+
+    Args:
+    cache_data (dict or cache_store.SqliteCache or cache_store.JsonlCache): The TMDB cache.
+    ttl (float): The number of seconds an entry stays fresh.
+    now (float): The current time in seconds since the epoch; time.time() by default.
+    movie_ids (iterable): If given, only the entries of these movies are considered.
+    limit (int): The largest number of ids returned, or None for all of them.
+
+    Returns:
+    list: The integer ids of the stale entries, by decreasing cached popularity (unknown popularity last).
+    """
+    now = time.time() if now is None else now
+    entries = cache_to_dataframe(cache_data, ('popularity', FETCHED_AT_FIELD))
+    if movie_ids is not None:
+        entries = entries[entries['id'].isin(list(movie_ids))]
+    fetched_at = pd.to_numeric(entries[FETCHED_AT_FIELD], errors='coerce').to_numpy(dtype=float)
+    # NaN compares false, so entries without a fetch time are stale.
+    stale = ~(fetched_at >= now - ttl)
+    popularity = pd.to_numeric(entries['popularity'], errors='coerce').to_numpy(dtype=float)[stale]
+    order = np.argsort(-np.nan_to_num(popularity, nan=-np.inf), kind='stable')
+    ids = entries['id'].to_numpy()[stale][order].tolist()
+    return ids if limit is None else ids[:limit]
+
+def fetch_stale_entries(cache_data, api_key, ttl=DEFAULT_TTL, movie_ids=None, limit=None, now=None, max_workers=4,
+                        requests_per_second=20, base_url=TMDB_API_URL, timeout=10, max_retries=3):
+    """
+    Re-fetches the stale entries of a TMDB cache, leaving the cache itself unchanged.
+
+    Only the entries stale_movie_ids selects are requested, most popular first, from a pool of
+    `max_workers` threads (see tmdb_client.fetch_tmdb_data_bulk). Entries that fail keep their
+    old values and fetch time, so they are tried again by the next refresh.
+
+    Args:
+    cache_data (dict or cache_store.SqliteCache or cache_store.JsonlCache): The TMDB cache.
+    api_key (str): TMDb API key.
+    ttl, movie_ids, limit, now: See stale_movie_ids.
+    max_workers (int): The number of requests kept in flight.
+    requests_per_second (float): The overall request rate limit, or None for no limit.
+    base_url (str): The API root, e.g. a local tmdb_stub.py server for testing.
+    timeout (float): Per-request timeout in seconds.
+    max_retries (int): How many times a failed request is retried.
+
+    Returns:
+    tuple: (entries, stats) - the fetched entries keyed by string movie id, and counts of 'stale',
+    'fetched', 'failed' and 'changed' entries (those with a TMDB field that differs from the cache)
+    and the 'elapsed' seconds.
+    """
+    stale_ids = stale_movie_ids(cache_data, ttl, now, movie_ids, limit)
+    entries = {}
+    fetch_stats = fetch_tmdb_data_bulk(stale_ids, api_key, entries, max_workers, requests_per_second, base_url, timeout, max_retries,
+                                       progress=False)
+    changed = sum(any(entry.get(field) != (cache_data.get(movie_id) or {}).get(field) for field in TMDB_FIELDS)
+                  for movie_id, entry in entries.items())
+    stats = {'stale': len(stale_ids), 'fetched': fetch_stats['fetched'], 'failed': fetch_stats['failed'], 'changed': changed,
+             'elapsed': fetch_stats['elapsed']}
+    return entries, stats
+
+def updated_table(final_df, entries):
+    """
+    Returns a copy of a movie table with the TMDB fields of `entries`.
+
+    Args:
+    final_df (pandas.DataFrame): The merged movie table.
+    entries (dict): Cache entries keyed by movie id, e.g. from fetch_stale_entries.
+
+    Returns:
+    pandas.DataFrame: The updated copy.
+    """
+    updates = pd.DataFrame.from_dict(entries, orient='index')
+    updates.index = updates.index.astype(int)
+    rows = final_df['id'].isin(updates.index)
+    final_df = final_df.copy()
+    for field in TMDB_FIELDS:
+        if field in final_df.columns and field in updates.columns:
+            final_df.loc[rows, field] = updates[field].reindex(final_df.loc[rows, 'id']).to_numpy()
+    return final_df
+
+def updated_model(model, entries):
+    """
+    Builds a copy of a loaded model with the TMDB fields of `entries`, leaving the model untouched.
+
+    The graph does not depend on the TMDB fields, but it is copied so that the new model has a new
+    data version and no result cached for the old model is served for it (see result_cache.data_version).
+    The movie index is rebuilt from the new table, and so is the similar-movies table if the model had one.
+
+    Args:
+    model (tuple): The (final_df, graph, index) tuple from final_anqi.load_model.
+    entries (dict): Cache entries keyed by movie id, e.g. from fetch_stale_entries.
+
+    Returns:
+    tuple: The new (final_df, graph, index).
+    """
+    from movie_index import build_movie_index, quality_ranks
+    from similar_movies import compute_similar_movies
+
+    final_df, graph, index = model
+    final_df = updated_table(final_df, entries)
+    graph = graph.copy()
+    new_index = build_movie_index(final_df, graph)
+    if 'similar_movies' in index:
+        new_index['similar_movies'] = compute_similar_movies(new_index, index['similar_movies'].shape[1])
+        new_index['quality'] = quality_ranks(new_index)
+    return final_df, graph, new_index
+
+def save_entries(cache_data, entries, cache_file, snapshot_file=SNAPSHOT_FILE):
+    """
+    Writes fetched entries to the cache and, if it was up to date, to the snapshot of the movie table.
+
+    Writing the cache changes the hash the snapshot is stamped with (see snapshot.load_or_build), so
+    the snapshot is rewritten with the new fields and the new hash; otherwise the next start would
+    rebuild the table from the CSVs. A snapshot that was already stale, or that is not built from
+    `cache_file`, is left alone.
+
+    Args:
+    cache_data (dict or cache_store.SqliteCache or cache_store.JsonlCache): The TMDB cache, loaded from `cache_file`.
+    entries (dict): The entries keyed by movie id, e.g. from fetch_stale_entries.
+    cache_file (str): The file of the cache.
+    snapshot_file (str): The snapshot of the movie table, or None to leave it alone.
+    """
+    from final_anqi import save_cache
+
+    if not entries:
+        return
+    if snapshot_file is not None and os.path.abspath(cache_file) not in {os.path.abspath(filename) for filename in INPUT_FILES}:
+        snapshot_file = None
+    # Hashed before the cache is written: a cache store may write some entries as soon as they are added.
+    source_hash = hash_input_files(INPUT_FILES) if snapshot_file is not None else None
+    cache_data.update(entries)
+    save_cache(cache_data, cache_file)
+    final_df = load_snapshot(snapshot_file, source_hash) if snapshot_file is not None else None
+    if final_df is not None:
+        save_snapshot(updated_table(final_df, entries), snapshot_file, hash_input_files(INPUT_FILES))
+
+class StatsRefresher:
+    """
+    Keeps the TMDB fields of a served model fresh from a background thread.
+
+    Every `interval` seconds the thread re-fetches the entries older than `ttl` of the movies of
+    the served model (at most `batch_size`, most popular first), writes them to the cache (and the
+    snapshot of the table, see save_entries) and, if
+    any TMDB field changed, builds an updated model with updated_model. Requests keep being answered
+    from the old model meanwhile; the new one then replaces it in a single assignment to
+    `target.model`, so every request sees either the old or the new model as a whole.
+    """
+
+    def __init__(self, target, cache_file, api_key, ttl=DEFAULT_TTL, interval=3600, batch_size=500, snapshot_file=SNAPSHOT_FILE,
+                 **fetch_options):
+        """
+        Args:
+        target (object): Holds the served model in its 'model' attribute, e.g. the server of recommend_server.create_server.
+        cache_file (str): The TMDB cache the entries are read from and written to (see final_anqi.load_cache).
+        api_key (str): TMDb API key.
+        ttl (float): The number of seconds an entry stays fresh.
+        interval (float): The number of seconds between two refreshes.
+        batch_size (int): The largest number of entries re-fetched by one refresh.
+        snapshot_file (str): The snapshot of the movie table kept up to date with the cache, or None.
+        fetch_options: max_workers, requests_per_second, base_url, timeout and max_retries (see fetch_stale_entries).
+        """
+        self.target = target
+        self.cache_file = cache_file
+        self.api_key = api_key
+        self.ttl = ttl
+        self.interval = interval
+        self.batch_size = batch_size
+        self.snapshot_file = snapshot_file
+        self.fetch_options = fetch_options
+        self.stopped = threading.Event()
+        self.thread = None
+        self.lock = threading.Lock()
+        self.runs = self.swaps = 0
+        self.last_run = None
+
+    def refresh_once(self):
+        """
+        Runs one refresh in the calling thread.
+
+        Returns:
+        dict: The fetch_stale_entries counts, plus whether the model was 'swapped'.
+        """
+        from final_anqi import load_cache
+
+        model = self.target.model
+        new_model = None
+        cache_data = load_cache(self.cache_file)
+        try:
+            entries, stats = fetch_stale_entries(cache_data, self.api_key, self.ttl, model[0]['id'].tolist(), self.batch_size,
+                                                 **self.fetch_options)
+            # The model is updated before the entries are saved, so that a failed update is retried by the next refresh.
+            if stats['changed']:
+                new_model = updated_model(model, entries)
+            if entries:
+                save_entries(cache_data, entries, self.cache_file, self.snapshot_file)
+        finally:
+            if not isinstance(cache_data, dict):
+                cache_data.close()
+        stats['swapped'] = new_model is not None
+        if new_model is not None:
+            self.target.model = new_model
+        with self.lock:
+            self.runs += 1
+            self.swaps += stats['swapped']
+            self.last_run = dict(stats, finished=time.time())
+        return stats
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                self.refresh_once()
+            except Exception as error:
+                # A failed refresh (e.g. TMDB unreachable) leaves the served model as it is and is retried later.
+                with self.lock:
+                    self.runs += 1
+                    self.last_run = {'error': f"{type(error).__name__}: {error}", 'finished': time.time()}
+            self.stopped.wait(self.interval)
+
+    def start(self):
+        """
+        Starts refreshing in a daemon thread, beginning with an immediate refresh.
+        """
+        self.thread = threading.Thread(target=self.run, name='tmdb-refresh', daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=None):
+        """
+        Stops the thread after the refresh in progress, if any.
+        """
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def stats(self):
+        """
+        Returns the number of 'runs' and model 'swaps' and the counts of the 'last_run'.
+        """
+        with self.lock:
+            return {'runs': self.runs, 'swaps': self.swaps, 'ttl': self.ttl, 'last_run': self.last_run}
+
+def main():
+    """
+    Re-fetches the stale entries of the TMDB cache once.
+    """
+    parser = argparse.ArgumentParser(description='Re-fetch TMDB cache entries older than a time-to-live, most popular first.')
+    parser.add_argument('--cache-file', default='cache.sqlite', help='the TMDB cache')
+    parser.add_argument('--ttl', type=float, default=DEFAULT_TTL, help='seconds an entry stays fresh')
+    parser.add_argument('--limit', type=int, default=None, help='largest number of entries re-fetched')
+    parser.add_argument('--workers', type=int, default=4, help='requests kept in flight')
+    parser.add_argument('--requests-per-second', type=float, default=20, help='overall request rate limit')
+    parser.add_argument('--base-url', default=TMDB_API_URL, help='the API root, e.g. http://127.0.0.1:8765/3 for tmdb_stub.py')
+    parser.add_argument('--api-key', default=TMDB_API_KEY, help='TMDb API key (default: the TMDB_API_KEY environment variable)')
+    args = parser.parse_args()
+
+    from final_anqi import load_cache
+
+    cache_data = load_cache(args.cache_file)
+    try:
+        entries, stats = fetch_stale_entries(cache_data, args.api_key, args.ttl, limit=args.limit, max_workers=args.workers,
+                                             requests_per_second=args.requests_per_second, base_url=args.base_url)
+        save_entries(cache_data, entries, args.cache_file)
+    finally:
+        if not isinstance(cache_data, dict):
+            cache_data.close()
+    print(f"Refreshed {stats['fetched']} of {stats['stale']} stale entries ({stats['changed']} changed, {stats['failed']} failed) "
+          f"in {stats['elapsed']:.2f}s")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import argparse
+import json
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MOVIE_PATH = re.compile(r'^/3/movie/(\d+)(\?.*)?$')
+
+def stub_movie_data(movie_id):
+    """
+    Returns deterministic TMDB-like fields for a movie id.
+
+    Args:
+    movie_id (int): The unique identifier of the movie.
+
+    Returns:
+    dict: The fields the TMDB /3/movie/{id} endpoint returns that the project uses.
+    """
+    rng = random.Random(movie_id)
+    return {
+        'id': movie_id,
+        'popularity': round(rng.uniform(0, 150), 3),
+        'revenue': rng.randrange(0, 3000000000),
+        'tagline': f"Tagline of movie {movie_id}",
+        'vote_average': round(rng.uniform(0, 10), 3),
+        'vote_count': rng.randrange(0, 30000),
+    }
+
+def create_stub_server(port=0, latency=0.0, failure_rate=0.0, movie_data=stub_movie_data):
+    """
+    Creates a local HTTP server mimicking the TMDB /3/movie/{id} endpoint.
+
+    Args:
+    port (int): The port to listen on; 0 picks a free port (see server.server_address).
+    latency (float): Seconds to wait before answering each request.
+    failure_rate (float): Fraction of requests answered with 429 or 503 instead of the movie.
+    movie_data (callable): Returns the JSON body for a movie id, or None to answer 404.
+
+    Returns:
+    http.server.ThreadingHTTPServer: The server, with 'request_count' and 'request_times' (time.monotonic() of every
+    request) attributes. Call serve_forever() to run it.
+    """
+    lock = threading.Lock()
+
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            with lock:
+                server.request_count += 1
+                server.request_times.append(time.monotonic())
+            if latency:
+                time.sleep(latency)
+            match = MOVIE_PATH.match(self.path)
+            if match is None:
+                self.send_json(404, {'status_message': 'The resource you requested could not be found.'})
+            elif failure_rate and random.random() < failure_rate:
+                self.send_json(random.choice((429, 503)), {'status_message': 'Try again later.'}, {'Retry-After': '0'})
+            else:
+                data = movie_data(int(match.group(1)))
+                if data is None:
+                    self.send_json(404, {'status_message': 'The resource you requested could not be found.'})
+                else:
+                    self.send_json(200, data)
+
+        def send_json(self, status, data, headers=None):
+            body = json.dumps(data).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), StubHandler)
+    server.daemon_threads = True
+    server.request_count = 0
+    server.request_times = []
+    return server
+
+def check_fetching(num_movies=200, failure_rate=0.3, max_workers=8, requests_per_second=150):
+    """
+    Runs the TMDB fetchers against a stub server on localhost and compares what they report with what it served.
+
+    Every 10th movie is answered with 404 and a `failure_rate` fraction of requests with 429/503, so
+    the retry and rate-limit path of tmdb_client.fetch_tmdb_data_bulk is exercised, and then
+    tmdb_refresh.fetch_stale_entries re-fetches a third of the entries after they are made stale.
+
+    Args:
+    num_movies (int): The number of movie ids fetched.
+    failure_rate (float): Fraction of requests answered with 429 or 503.
+    max_workers (int): The number of requests the fetchers keep in flight.
+    requests_per_second (float): The rate limit the fetchers are given.
+
+    Returns:
+    list: Descriptions of the problems found; empty if the counts, the cache contents and the request rate are as expected.
+    """
+    from tmdb_client import FETCHED_AT_FIELD, TMDB_FIELDS, fetch_tmdb_data_bulk
+    from tmdb_refresh import fetch_stale_entries
+
+    def movie_data(movie_id):
+        return None if movie_id % 10 == 0 else stub_movie_data(movie_id)
+
+    def expected_entry(movie_id):
+        return {field: stub_movie_data(movie_id)[field] for field in TMDB_FIELDS}
+
+    server = create_stub_server(failure_rate=failure_rate, movie_data=movie_data)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/3"
+    problems = []
+    try:
+        movie_ids = list(range(1, num_movies + 1))
+        found_ids = [movie_id for movie_id in movie_ids if movie_data(movie_id) is not None]
+        cache_data = {}
+        # Enough retries that a movie the stub knows is practically never given up on.
+        stats = fetch_tmdb_data_bulk(movie_ids, 'stub-key', cache_data, max_workers=max_workers, requests_per_second=requests_per_second,
+                                     base_url=base_url, max_retries=12, progress=False)
+        if (stats['fetched'], stats['failed']) != (len(found_ids), len(movie_ids) - len(found_ids)):
+            problems.append(f"bulk fetch: fetched={stats['fetched']} failed={stats['failed']}, "
+                            f"expected {len(found_ids)} and {len(movie_ids) - len(found_ids)}")
+        if sorted(cache_data) != sorted(str(movie_id) for movie_id in found_ids):
+            problems.append(f"bulk fetch: the cache holds {len(cache_data)} entries, expected {len(found_ids)}")
+        wrong = [movie_id for movie_id, entry in cache_data.items()
+                 if {field: entry.get(field) for field in TMDB_FIELDS} != expected_entry(int(movie_id)) or FETCHED_AT_FIELD not in entry]
+        if wrong:
+            problems.append(f"bulk fetch: {len(wrong)} cache entries differ from the stub, e.g. movie {wrong[0]}")
+        if failure_rate and server.request_count <= len(movie_ids):
+            problems.append(f"bulk fetch: {server.request_count} requests for {len(movie_ids)} movies, so nothing was retried")
+        # The limiter spaces requests by 1 / requests_per_second, so no `max_workers` consecutive requests arrive in a burst
+        # (the margin absorbs network jitter).
+        times = sorted(server.request_times)
+        shortest = min(end - start for start, end in zip(times, times[max_workers:]))
+        if shortest < 0.5 * max_workers / requests_per_second:
+            problems.append(f"bulk fetch: {max_workers + 1} requests arrived within {shortest * 1000:.1f}ms, above {requests_per_second}/s")
+
+        # Make every third entry stale, with a changed value, including entries of movies the stub does not know.
+        stale_ids = movie_ids[::3]
+        for movie_id in stale_ids:
+            cache_data[str(movie_id)] = {**expected_entry(movie_id), 'vote_count': -1, FETCHED_AT_FIELD: 0.0}
+        before = {movie_id: dict(entry) for movie_id, entry in cache_data.items()}
+        entries, refresh_stats = fetch_stale_entries(cache_data, 'stub-key', ttl=3600, max_workers=max_workers,
+                                                     requests_per_second=requests_per_second, base_url=base_url, max_retries=12)
+        refreshed_ids = [movie_id for movie_id in stale_ids if movie_data(movie_id) is not None]
+        expected_stats = {'stale': len(stale_ids), 'fetched': len(refreshed_ids), 'failed': len(stale_ids) - len(refreshed_ids),
+                          'changed': len(refreshed_ids)}
+        if {key: refresh_stats[key] for key in expected_stats} != expected_stats:
+            problems.append(f"refresh: {refresh_stats}, expected {expected_stats}")
+        if sorted(entries) != sorted(str(movie_id) for movie_id in refreshed_ids):
+            problems.append(f"refresh: fetched {len(entries)} entries, expected {len(refreshed_ids)}")
+        elif any({field: entry.get(field) for field in TMDB_FIELDS} != expected_entry(int(movie_id)) for movie_id, entry in entries.items()):
+            problems.append("refresh: fetched entries differ from the stub")
+        if cache_data != before:
+            problems.append("refresh: the cache was modified")
+    finally:
+        server.shutdown()
+        server.server_close()
+    return problems
+
+def main():
+    """
+    Runs the stub TMDB server until interrupted.
+
+    Point the fetchers at it with base_url='http://127.0.0.1:<port>/3'.
+    """
+    parser = argparse.ArgumentParser(description='Local stub of the TMDB /3/movie/{id} endpoint.')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds to wait before each response')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='fraction of requests answered with 429/503')
+    parser.add_argument('--check', action='store_true', help='run the fetchers against a stub on a free port and exit')
+    args = parser.parse_args()
+
+    if args.check:
+        problems = check_fetching(failure_rate=args.failure_rate or 0.3)
+        print('The fetchers work against the stub.' if not problems else 'Problems: ' + '; '.join(problems))
+        sys.exit(1 if problems else 0)
+
+    server = create_stub_server(args.port, args.latency, args.failure_rate)
+    print(f"Stub TMDB API listening on http://127.0.0.1:{server.server_address[1]}/3")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,424 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import argparse
+import json
+import os
+import weakref
+
+import numpy as np
+import pandas as pd
+
+from cache_store import DEFAULT_CACHE_FILE, open_cache
+from construct_graph import MOVIE_LIMIT, create_movie_graph, genre_node, movie_nodes, save_graph_binary, save_graph_to_json
+from instrumentation import enable, format_report, is_enabled, stage
+from name_lists import NameListDtype
+from snapshot import CHANGES_FILE, INPUT_FILES, SNAPSHOT_FILE, hash_input_files, save_snapshot
+from tmdb_client import TMDB_FIELDS
+
+# The genre map of each 'clique' graph, with the graph version it is up to date with (see _genre_members).
+_GENRE_MEMBERS = weakref.WeakKeyDictionary()
+
+def _remove_movie_node(graph, movie_id, genre_members):
+    """
+    Removes a movie from a graph, together with the genre hubs it leaves without movies.
+    """
+    for genre in graph.nodes[movie_id]['genres']:
+        genre_members.get(genre, set()).discard(movie_id)
+    hubs = [node for node in graph.neighbors(movie_id) if graph.nodes[node].get('kind') == 'genre']
+    graph.remove_node(movie_id)
+    graph.remove_nodes_from([hub for hub in hubs if graph.degree(hub) == 0])
+
+def _connect_movie(graph, movie_id, genres, genre_members):
+    """
+    Adds the genre edges of a movie node: to its genre hubs in 'hub' mode, or to every movie sharing one of its genres.
+    """
+    for genre in genres:
+        if graph.graph.get('mode') == 'hub':
+            hub = genre_node(genre)
+            if hub not in graph:
+                graph.add_node(hub, kind='genre', title=genre, genres=[genre])
+            graph.add_edge(movie_id, hub)
+        else:
+            members = genre_members.setdefault(genre, set())
+            graph.add_edges_from((movie_id, other_movie_id) for other_movie_id in members if other_movie_id != movie_id)
+            members.add(movie_id)
+
+def _genre_members(graph):
+    """
+    Maps every genre to the movies of a 'clique' graph that have it. 'hub' graphs do not need the map.
+
+    The map is built on the first change of a graph and then kept up to date by apply_changes, which
+    hands it back with _GENRE_MEMBERS; it is rebuilt if graph.graph['version'] shows that the graph
+    was changed in another way meanwhile. It is taken out of _GENRE_MEMBERS until then, so that a
+    change that fails half-way does not leave a wrong map behind.
+    """
+    if graph.graph.get('mode') == 'hub':
+        return {}
+    version, members = _GENRE_MEMBERS.pop(graph, (None, None))
+    if members is not None and version == graph.graph.get('version', 0):
+        return members
+    members = {}
+    for movie_id, data in movie_nodes(graph):
+        for genre in data['genres']:
+            members.setdefault(genre, set()).add(movie_id)
+    return members
+
+def _sync_graph(final_df, graph, left_ids, kept, refreshed, genre_members):
+    """
+    Makes the movies of a graph match the first MOVIE_LIMIT rows of the table again after a change.
+
+    Only the changed movies are visited: the movies in `left_ids` are removed, the movies of the
+    rows in `refreshed` get their title, genres and edges refreshed, and the rows that moved into
+    the first MOVIE_LIMIT rows (all rows from `kept` on) are added in row order, as create_movie_graph
+    would add them.
+
+    Args:
+    final_df (pandas.DataFrame): The changed movie table.
+    graph (networkx.Graph): The graph of the first MOVIE_LIMIT rows of the table before the change.
+    left_ids (list): The removed movies that were in the graph.
+    kept (int): The number of movies of the graph that are still in the table; they are its first rows.
+    refreshed (dict): The row positions of the modified movies, by movie id.
+    genre_members (dict): The _genre_members map of the graph, updated in place.
+
+    Returns:
+    dict: The number of movie nodes 'added', 'removed' and 'refreshed'.
+    """
+    for movie_id in left_ids:
+        _remove_movie_node(graph, movie_id, genre_members)
+
+    counts = {'added': 0, 'removed': len(left_ids), 'refreshed': 0}
+    titles, genre_names = final_df['original_title'], final_df['genre_names']
+    for movie_id, position in refreshed.items():
+        # Rows from `kept` on are added below.
+        if position >= kept:
+            continue
+        data = graph.nodes[movie_id]
+        old_genres = data['genres']
+        genres = genre_names.iat[position]
+        data['title'] = titles.iat[position]
+        data['genres'] = genres
+        if list(old_genres) == list(genres):
+            continue
+        for genre in old_genres:
+            genre_members.get(genre, set()).discard(movie_id)
+        neighbors = list(graph.neighbors(movie_id))
+        graph.remove_edges_from((movie_id, neighbor) for neighbor in neighbors)
+        graph.remove_nodes_from([node for node in neighbors if graph.nodes[node].get('kind') == 'genre' and graph.degree(node) == 0])
+        _connect_movie(graph, movie_id, genres, genre_members)
+        counts['refreshed'] += 1
+
+    entering = final_df[kept:MOVIE_LIMIT]
+    for movie_id, title, genres in zip(entering['id'].tolist(), entering['original_title'], entering['genre_names']):
+        graph.add_node(movie_id, title=title, genres=genres)
+        _connect_movie(graph, movie_id, genres, genre_members)
+        counts['added'] += 1
+    return counts
+
+def _new_rows(final_df, movies):
+    """
+    Turns a list of movie dictionaries into rows with the columns of final_df.
+
+    Missing list columns (genre_names, cast_names, ...) default to empty lists and other missing
+    columns to NaN; 'original_title' defaults to 'title_x'.
+    """
+    rows = []
+    for movie in movies:
+        row = {column: [] if column.endswith('_names') else np.nan for column in final_df.columns}
+        row['original_title'] = movie.get('title_x')
+        row.update(movie)
+        rows.append(row)
+    new_df = pd.DataFrame(rows, columns=final_df.columns)
+    for column in final_df.columns:
+        if final_df[column].dtype.kind in 'iuf':
+            # None (e.g. JSON null) becomes NaN, so the column stays numeric.
+            values = pd.to_numeric(new_df[column])
+            new_df[column] = values.astype(final_df[column].dtype) if values.notna().all() else values
+        elif isinstance(final_df[column].dtype, NameListDtype):
+            new_df[column] = new_df[column].astype(final_df[column].dtype)
+    return new_df
+
+def _update_cache(cache, movie_id, values):
+    """
+    Writes the TMDB fields among `values` to the cache entry of a movie, so that a rebuild keeps them.
+    """
+    fields = {field: values[field] for field in TMDB_FIELDS if field in values}
+    if cache is None or not fields:
+        return
+    entry = dict(cache.get(str(movie_id)) or {})
+    entry.update(fields)
+    cache[str(movie_id)] = entry
+
+def _parse_changes(changes):
+    """
+    Reads the removed ids, the modifications by id and the added movies of a changes dictionary (see apply_changes).
+    """
+    removed = list(dict.fromkeys(int(movie_id) for movie_id in changes.get('remove', [])))
+    modified = {int(movie_id): values for movie_id, values in changes.get('modify', {}).items()}
+    added = [dict(movie, id=int(movie['id'])) for movie in changes.get('add', [])]
+    return removed, modified, added
+
+def _update_table(final_df, ids, removed, modified, added, cache=None):
+    """
+    Applies validated changes to the movie table, leaving the given table unchanged.
+
+    Args:
+    final_df (pandas.DataFrame): The movie table.
+    ids (pandas.Index): The index of final_df['id'].
+    removed, modified, added: The changes, as returned by _parse_changes.
+    cache (dict or cache_store.SqliteCache): The TMDB cache the TMDB fields are written to, or None.
+
+    Returns:
+    tuple: (final_df, positions) - the new table and the row positions of the modified movies in it, by movie id.
+    """
+    positions = ids.get_indexer(list(modified))
+    if removed:
+        removed_positions = np.sort(ids.get_indexer(removed))
+        final_df = final_df[~ids.isin(removed)].reset_index(drop=True)
+        # Every row moves up by the number of removed rows before it.
+        positions = positions - np.searchsorted(removed_positions, positions)
+    positions = dict(zip(modified, positions.tolist()))
+    if modified:
+        # Only the modified columns are copied (and set on a shallow copy of the table), so the
+        # caller's table is left unchanged; a name list column is edited row by row.
+        columns = {}
+        for movie_id, values in modified.items():
+            for column, value in values.items():
+                if column not in final_df.columns or column == 'id':
+                    raise ValueError(f"Cannot modify column {column!r}")
+                if column not in columns:
+                    columns[column] = final_df[column].copy()
+                columns[column].iat[positions[movie_id]] = value
+            _update_cache(cache, movie_id, values)
+        final_df = final_df.copy(deep=False)
+        for column, values in columns.items():
+            final_df[column] = values
+    if added:
+        final_df = pd.concat([final_df, _new_rows(final_df, added)], ignore_index=True)
+        for movie in added:
+            _update_cache(cache, movie['id'], movie)
+    return final_df, positions
+
+def apply_changes(final_df, graph, changes, cache=None):
+    """
+    Adds, removes and modifies movies in the movie table and updates the graph in place.
+
+    `changes` is a dictionary with any of:
+    - 'add': a list of movies, as dictionaries with final_df columns. 'id', 'title_x' and 'genre_names' are required.
+    - 'remove': a list of movie ids.
+    - 'modify': a dictionary from movie id to the columns to change, e.g. {"19995": {"vote_average": 7.3}}.
+    Removals are applied first, then modifications, then additions (which are appended at the end of the table).
+
+    Only the nodes and edges of the changed movies are touched, plus the movies that enter or leave
+    the first MOVIE_LIMIT rows the graph is built from; the graph then equals create_movie_graph of
+    the new table (see check_consistency). TMDB fields (popularity, vote_average, ...) are also
+    written to `cache`, so that they survive a rebuild of the table. graph.graph['version'] is
+    incremented, which invalidates cached recommendations (see result_cache.data_version).
+
+    Args:
+    final_df (pandas.DataFrame): The merged movie table.
+    graph (networkx.Graph): The graph of its first MOVIE_LIMIT movies, in 'hub' or 'clique' mode.
+    changes (dict): The changes.
+    cache (dict or cache_store.SqliteCache): The TMDB cache, or None to leave it alone.
+
+    Returns:
+    tuple: (final_df, counts) - the new movie table and the number of movies 'added', 'removed' and
+    'modified' in the table and of movie nodes 'graph_added', 'graph_removed' and 'graph_refreshed'.
+
+    Raises:
+    ValueError: If an added movie already exists or is added twice, a removed or modified movie does not exist,
+    a movie is both removed and modified, or the graph is a 'similarity' graph.
+    """
+    if graph.graph.get('mode') == 'similarity':
+        raise ValueError("Similarity graphs cannot be updated incrementally; rebuild them with create_movie_graph")
+    removed, modified, added = _parse_changes(changes)
+    # One hash index of the ids answers every membership check.
+    ids = pd.Index(final_df['id'])
+
+    missing = [movie_id for movie_id in removed + list(modified) if movie_id not in ids]
+    if missing:
+        raise ValueError(f"Unknown movie ids: {missing}")
+    conflicting = [movie_id for movie_id in modified if movie_id in removed]
+    if conflicting:
+        raise ValueError(f"Movies both removed and modified: {conflicting}")
+    added_ids = pd.Index([movie['id'] for movie in added], dtype='int64')
+    if added_ids.has_duplicates:
+        raise ValueError(f"Movies added more than once: {sorted(set(added_ids[added_ids.duplicated()].tolist()))}")
+    duplicates = [movie_id for movie_id in added_ids.tolist() if movie_id in ids and movie_id not in removed]
+    if duplicates:
+        raise ValueError(f"Movies already exist: {duplicates}")
+
+    # The graph holds the first MOVIE_LIMIT rows; the rows of it that are not removed stay first.
+    left_ids = [movie_id for movie_id, position in zip(removed, ids.get_indexer(removed).tolist()) if position < MOVIE_LIMIT]
+    kept = min(len(final_df), MOVIE_LIMIT) - len(left_ids)
+
+    with stage('update_table') as timer:
+        final_df, positions = _update_table(final_df, ids, removed, modified, added, cache)
+        timer.count(added=len(added), removed=len(removed), modified=len(modified))
+
+    with stage('update_graph') as timer:
+        genre_members = _genre_members(graph)
+        graph_counts = _sync_graph(final_df, graph, left_ids, kept, positions, genre_members)
+        timer.count(**graph_counts)
+
+    graph.graph['version'] = graph.graph.get('version', 0) + 1
+    if graph.graph.get('mode') != 'hub':
+        _GENRE_MEMBERS[graph] = (graph.graph['version'], genre_members)
+    counts = {'added': len(added), 'removed': len(removed), 'modified': len(modified)}
+    counts.update({'graph_' + key: value for key, value in graph_counts.items()})
+    return final_df, counts
+
+def replay_changes(final_df, changes_file=CHANGES_FILE, cache_file=DEFAULT_CACHE_FILE):
+    """
+    Applies the changes logged by save_updates to a movie table rebuilt from the source files.
+
+    snapshot.load_or_build calls it after every rebuild, so that the movies added, removed and
+    modified with apply_changes are not lost when the CSVs or the cache change. The cache is the
+    record of the TMDB fields: modified TMDB fields are not replayed (apply_changes wrote them to the
+    cache, which the rebuilt table already joined, possibly with newer values from tmdb_refresh.py),
+    and added movies take the TMDB fields of their cache entries. Changes that no longer apply to the
+    rebuilt table (e.g. a removed movie that left the CSVs) are skipped.
+
+    Args:
+    final_df (pandas.DataFrame): The movie table built from the CSVs and the cache.
+    changes_file (str): The change log.
+    cache_file (str): The TMDB cache.
+
+    Returns:
+    pandas.DataFrame: The table with the changes applied.
+    """
+    with open(changes_file, 'r') as f:
+        logged = [json.loads(line) for line in f if line.strip()]
+    if not any(changes.get('add') for changes in logged) or not os.path.exists(cache_file):
+        cache = {}
+    else:
+        cache = open_cache(cache_file)
+    try:
+        with stage('replay_changes') as timer:
+            for changes in logged:
+                removed, modified, added = _parse_changes(changes)
+                ids = pd.Index(final_df['id'])
+                removed = [movie_id for movie_id in removed if movie_id in ids]
+                modified = {movie_id: {column: value for column, value in values.items() if column not in TMDB_FIELDS}
+                            for movie_id, values in modified.items() if movie_id in ids and movie_id not in removed}
+                modified = {movie_id: values for movie_id, values in modified.items() if values}
+                added = [dict(movie, **{field: entry[field] for field in TMDB_FIELDS if entry.get(field) is not None})
+                         for movie, entry in ((movie, cache.get(str(movie['id'])) or {}) for movie in added)
+                         if movie['id'] not in ids or movie['id'] in removed]
+                final_df, _ = _update_table(final_df, ids, removed, modified, added)
+            timer.count(changes=len(logged), rows=len(final_df))
+    finally:
+        if not isinstance(cache, dict):
+            cache.close()
+    return final_df
+
+def check_consistency(final_df, graph):
+    """
+    Compares an incrementally updated graph with a graph built from scratch from the same table.
+
+    Args:
+    final_df (pandas.DataFrame): The movie table.
+    graph (networkx.Graph): The updated graph.
+
+    Returns:
+    list: Descriptions of the differences; empty if the graphs have the same nodes with the same
+    attributes, the same edges and the same order of movie nodes.
+    """
+    expected = create_movie_graph(final_df[:MOVIE_LIMIT], mode=graph.graph.get('mode', 'hub'))
+    problems = []
+    if set(graph.nodes) != set(expected.nodes):
+        problems.append(f"nodes differ: {len(set(graph.nodes) - set(expected.nodes))} extra, "
+                        f"{len(set(expected.nodes) - set(graph.nodes))} missing")
+    else:
+        different = [node for node, data in expected.nodes(data=True)
+                     if {key: list(value) if key == 'genres' else value for key, value in graph.nodes[node].items()}
+                     != {key: list(value) if key == 'genres' else value for key, value in data.items()}]
+        if different:
+            problems.append(f"attributes differ for {len(different)} nodes, e.g. {different[0]!r}")
+    if [node for node, _ in movie_nodes(graph)] != [node for node, _ in movie_nodes(expected)]:
+        problems.append("movie nodes are in a different order")
+    edges = {frozenset(edge) for edge in graph.edges()}
+    expected_edges = {frozenset(edge) for edge in expected.edges()}
+    if edges != expected_edges:
+        problems.append(f"edges differ: {len(edges - expected_edges)} extra, {len(expected_edges - edges)} missing")
+    return problems
+
+def log_changes(changes, changes_file=CHANGES_FILE):
+    """
+    Appends applied changes (see apply_changes) to the change log that replay_changes applies after every rebuild of the table.
+    """
+    with open(changes_file, 'a') as f:
+        f.write(json.dumps(changes) + '\n')
+
+def save_updates(final_df, graph, cache=None, snapshot_file=SNAPSHOT_FILE, graph_dir='movie_graph', graph_json=None, changes=None,
+                 changes_file=CHANGES_FILE):
+    """
+    Persists an updated movie table and graph.
+
+    The cache is flushed and the changes are logged first, so that the snapshot is stamped with the
+    hash of the updated cache and change log and is loaded (instead of being rebuilt from the CSVs)
+    until an input file changes again. A rebuild replays the change log (see replay_changes), so the
+    changes survive later writes to the cache, e.g. by tmdb_refresh.py.
+
+    Args:
+    final_df (pandas.DataFrame): The movie table.
+    graph (networkx.Graph): The graph.
+    cache (cache_store.SqliteCache): The TMDB cache to flush, if any.
+    snapshot_file (str): The snapshot of the table.
+    graph_dir (str): The directory of the binary graph, or None to skip it.
+    graph_json (str): The JSON graph file, or None to skip it (it is slow to write for large graphs).
+    changes (dict): The changes applied to the table, appended to `changes_file`; None if they are already logged.
+    changes_file (str): The change log.
+    """
+    with stage('save_updates'):
+        if cache is not None and hasattr(cache, 'flush'):
+            cache.flush()
+        if changes is not None:
+            log_changes(changes, changes_file)
+        save_snapshot(final_df, snapshot_file, hash_input_files(INPUT_FILES))
+        if graph_dir:
+            save_graph_binary(graph, graph_dir)
+        if graph_json:
+            save_graph_to_json(graph, graph_json)
+
+def main():
+    """
+    Applies a JSON file of changes (see apply_changes) to the saved movie table, graph and cache.
+
+    The graph is read from the binary graph files when they exist, so nothing is rebuilt from the CSVs.
+    """
+    parser = argparse.ArgumentParser(description='Add, remove or modify movies without rebuilding everything.')
+    parser.add_argument('changes', help='JSON file with "add", "remove" and/or "modify"')
+    parser.add_argument('--check', action='store_true', help='compare the updated graph with one built from scratch')
+    parser.add_argument('--json', action='store_true', help='also rewrite movie_graph.json')
+    args = parser.parse_args()
+    if os.environ.get('MOVIE_STATS'):
+        enable(trace_memory=os.environ['MOVIE_STATS'] == 'memory')
+
+    from final_anqi import load_final_df
+    from read_json_graph import binary_graph_to_networkx, load_graph_binary
+
+    with open(args.changes, 'r') as f:
+        changes = json.load(f)
+    final_df = load_final_df()
+    with stage('load_graph'):
+        if os.path.exists(os.path.join('movie_graph', 'header.json')):
+            graph = binary_graph_to_networkx(load_graph_binary('movie_graph'))
+        else:
+            graph = create_movie_graph(final_df[:MOVIE_LIMIT])
+
+    cache = open_cache()
+    try:
+        final_df, counts = apply_changes(final_df, graph, changes, cache)
+        print(', '.join(f"{key}={value}" for key, value in counts.items()))
+        if args.check:
+            problems = check_consistency(final_df, graph)
+            print('Consistent with a full rebuild.' if not problems else 'Inconsistent: ' + '; '.join(problems))
+        save_updates(final_df, graph, cache, graph_json='movie_graph.json' if args.json else None, changes=changes)
+    finally:
+        cache.close()
+    if is_enabled():
+        print(format_report())
+
+if __name__ == '__main__':
+    main()
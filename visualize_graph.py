@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import argparse
+import hashlib
+import itertools
+import json
+import os
+
+import numpy as np
+
+LAYOUT_FILE = 'movie_graph_layout.npz'
+NETWORK_IMAGE = 'movie_network.png'
+
+# Movies without genres are put on a ring outside the genre hubs.
+NO_GENRE_RADIUS = 1.4
+
+def graph_signature(graph):
+    """
+    Fingerprints the parts of a graph the layout depends on: its nodes, their genres and the number of edges.
+
+    Args:
+    graph (networkx.Graph): The movie graph.
+
+    Returns:
+    str: A hex digest that changes whenever a node, a genre or the edge count changes.
+    """
+    digest = hashlib.sha256()
+    digest.update(f"{graph.number_of_nodes()} {graph.number_of_edges()}".encode('utf-8'))
+    for node, data in graph.nodes(data=True):
+        digest.update(json.dumps([str(node), data.get('kind', 'movie'), data.get('genres', [])]).encode('utf-8'))
+    return digest.hexdigest()
+
+def genre_cooccurrence(graph):
+    """
+    Counts how many movies of a graph share each pair of genres.
+
+    Args:
+    graph (networkx.Graph): The movie graph; genre hub nodes are skipped.
+
+    Returns:
+    tuple: (genres, counts) - the genres in order of first appearance, and a symmetric matrix whose
+    [i, j] entry is the number of movies with both genres (the diagonal holds the genre sizes).
+    """
+    genre_positions = {}
+    rows = []
+    for _, data in graph.nodes(data=True):
+        if data.get('kind', 'movie') != 'movie':
+            continue
+        rows.append([genre_positions.setdefault(genre, len(genre_positions)) for genre in set(data.get('genres', []))])
+    multi_hot = np.zeros((len(rows), len(genre_positions)), dtype=np.float32)
+    for row, codes in enumerate(rows):
+        multi_hot[row, codes] = 1
+    return list(genre_positions), multi_hot.T @ multi_hot
+
+def compute_layout(graph, seed=0):
+    """
+    Computes 2D positions for every node of a movie graph in time linear in the number of nodes.
+
+    Instead of a force-directed layout over all movies, only the genres are laid out: a spring layout
+    of the genre co-occurrence graph places genres that share many movies close together. Each genre
+    hub sits at its genre's position, and each movie at the mean position of its genres plus a small
+    random offset, so that movies with the same genres form a cloud. The layout only depends on the
+    nodes and their genres, not on how the movies are connected, so it is the same for the 'hub' and
+    the 'clique' graph.
+
+    Args:
+    graph (networkx.Graph): The movie graph.
+    seed (int): The random seed of the genre layout and the offsets.
+
+    Returns:
+    tuple: (nodes, positions) - the node keys in graph order and a float32 array of shape (nodes, 2).
+    """
+    import networkx as nx
+
+    genres, counts = genre_cooccurrence(graph)
+    genre_graph = nx.Graph()
+    genre_graph.add_nodes_from(range(len(genres)))
+    for i, j in zip(*np.nonzero(np.triu(counts, k=1))):
+        genre_graph.add_edge(int(i), int(j), weight=float(counts[i, j]))
+    if len(genres) > 1:
+        genre_layout = nx.spring_layout(genre_graph, weight='weight', seed=seed)
+        genre_points = np.array([genre_layout[i] for i in range(len(genres))], dtype=np.float32)
+    else:
+        genre_points = np.zeros((len(genres), 2), dtype=np.float32)
+    genre_positions = {genre: position for position, genre in enumerate(genres)}
+
+    rng = np.random.default_rng(seed)
+    nodes = list(graph.nodes)
+    positions = np.zeros((len(nodes), 2), dtype=np.float32)
+    offsets = rng.normal(0, 0.06, (len(nodes), 2)).astype(np.float32)
+    angles = rng.uniform(0, 2 * np.pi, len(nodes))
+    for position, (node, data) in enumerate(graph.nodes(data=True)):
+        codes = [genre_positions[genre] for genre in set(data.get('genres', [])) if genre in genre_positions]
+        if data.get('kind', 'movie') == 'genre':
+            positions[position] = genre_points[codes[0]] if codes else 0
+        elif codes:
+            positions[position] = genre_points[codes].mean(axis=0) + offsets[position]
+        else:
+            positions[position] = NO_GENRE_RADIUS * np.array([np.cos(angles[position]), np.sin(angles[position])])
+    return nodes, positions
+
+def save_layout(filename, signature, nodes, positions):
+    """
+    Saves node positions with the signature of the graph they were computed for.
+
+    The file is written to a temporary name and then renamed, so readers never see a partial layout.
+
+    Args:
+    filename (str): The .npz file to write.
+    signature (str): The graph_signature of the graph.
+    nodes (list): The node keys.
+    positions (numpy.ndarray): The positions, one row per node.
+    """
+    temp_filename = filename + '.tmp.npz'
+    np.savez(temp_filename, signature=np.array(signature), nodes=np.array([str(node) for node in nodes]), positions=positions)
+    os.replace(temp_filename, filename)
+
+def load_layout(filename, signature):
+    """
+    Loads saved node positions if they were computed for a graph with the given signature.
+
+    Args:
+    filename (str): The .npz file written by save_layout.
+    signature (str): The graph_signature of the current graph.
+
+    Returns:
+    tuple: (node keys as strings, positions), or None if there is no layout for this graph.
+    """
+    if not os.path.exists(filename):
+        return None
+    try:
+        with np.load(filename) as data:
+            if str(data['signature']) != signature:
+                return None
+            return data['nodes'].tolist(), data['positions']
+    except (OSError, ValueError, KeyError):
+        return None
+
+def get_layout(graph, filename=LAYOUT_FILE, seed=0):
+    """
+    Returns the positions of the nodes of a graph, computing and saving them only if the graph changed.
+
+    Args:
+    graph (networkx.Graph): The movie graph.
+    filename (str): The layout file kept next to the graph files.
+    seed (int): The random seed used if the layout is computed.
+
+    Returns:
+    tuple: (positions, reused) - a float32 array with one row per node in graph order, and whether it
+    was loaded from the file.
+    """
+    signature = graph_signature(graph)
+    saved = load_layout(filename, signature)
+    if saved is not None:
+        return saved[1], True
+    nodes, positions = compute_layout(graph, seed)
+    save_layout(filename, signature, nodes, positions)
+    return positions, False
+
+def sample_edges(graph, max_edges, seed=0):
+    """
+    Picks at most `max_edges` edges of a graph, spread evenly over the edge list.
+
+    Args:
+    graph (networkx.Graph): The graph.
+    max_edges (int): The largest number of edges returned.
+    seed (int): Chooses the offset of the first edge taken.
+
+    Returns:
+    list: (u, v) pairs.
+    """
+    num_edges = graph.number_of_edges()
+    if num_edges <= max_edges:
+        return list(graph.edges())
+    step = -(-num_edges // max_edges)
+    start = np.random.default_rng(seed).integers(step)
+    return list(itertools.islice(graph.edges(), int(start), None, step))
+
+def render_network(graph, positions, filename=NETWORK_IMAGE, max_edges=5000, seed=0):
+    """
+    Draws a movie graph into an image file without opening a window.
+
+    Movies are drawn as small points coloured by their first genre. Instead of all edges, the
+    drawing shows one line per pair of genres that share movies, whose width grows with the number
+    of shared movies, plus an evenly spread sample of at most `max_edges` real edges. Genre hubs
+    (or, in a clique graph, the centres of the genres' movies) are labelled. Movies without genres are grey.
+
+    Args:
+    graph (networkx.Graph): The movie graph.
+    positions (numpy.ndarray): The node positions from get_layout, in graph order.
+    filename (str): The output file; the extension (.png, .svg, .pdf) selects the format.
+    max_edges (int): The largest number of graph edges drawn.
+    seed (int): The random seed of the edge sample.
+
+    Returns:
+    str: The filename.
+    """
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.collections import LineCollection
+    from matplotlib.figure import Figure
+
+    node_positions = {node: position for position, node in enumerate(graph.nodes)}
+    genres, counts = genre_cooccurrence(graph)
+    genre_positions = {genre: position for position, genre in enumerate(genres)}
+    movie_rows, movie_colors = [], []
+    genre_sums = np.zeros((len(genres), 2))
+    hub_rows = {}
+    for node, data in graph.nodes(data=True):
+        if data.get('kind', 'movie') != 'movie':
+            hub_rows.update((genre, node_positions[node]) for genre in data.get('genres', []) if genre in genre_positions)
+            continue
+        movie_genres = data.get('genres', [])
+        movie_rows.append(node_positions[node])
+        movie_colors.append(genre_positions[movie_genres[0]] % 20 if movie_genres else -1)
+        for genre in set(movie_genres):
+            genre_sums[genre_positions[genre]] += positions[node_positions[node]]
+    sizes = np.diag(counts)
+    genre_centres = genre_sums / np.maximum(sizes, 1)[:, None]
+    for genre, row in hub_rows.items():
+        genre_centres[genre_positions[genre]] = positions[row]
+
+    figure = Figure(figsize=(12, 12))
+    FigureCanvasAgg(figure)
+    axes = figure.add_subplot()
+    axes.set_axis_off()
+
+    edges = sample_edges(graph, max_edges, seed)
+    if edges:
+        segments = np.array([[positions[node_positions[u]], positions[node_positions[v]]] for u, v in edges])
+        axes.add_collection(LineCollection(segments, colors='grey', linewidths=0.3, alpha=0.15, zorder=1))
+    pairs = list(zip(*np.nonzero(np.triu(counts, k=1))))
+    if pairs:
+        weights = np.array([counts[i, j] for i, j in pairs])
+        axes.add_collection(LineCollection([[genre_centres[i], genre_centres[j]] for i, j in pairs], colors='steelblue',
+                                           linewidths=0.5 + 6 * weights / weights.max(), alpha=0.4, zorder=2))
+
+    movie_points = positions[movie_rows]
+    movie_colors = np.array(movie_colors, dtype=int)
+    has_genre = movie_colors >= 0
+    axes.scatter(movie_points[has_genre, 0], movie_points[has_genre, 1], s=4, c=movie_colors[has_genre], cmap='tab20',
+                 vmin=0, vmax=19, linewidths=0, zorder=3)
+    axes.scatter(movie_points[~has_genre, 0], movie_points[~has_genre, 1], s=4, c='lightgrey', linewidths=0, zorder=3)
+    axes.scatter(genre_centres[:, 0], genre_centres[:, 1], s=20 + 400 * sizes / max(sizes.max(), 1), c='black', alpha=0.6, zorder=4)
+    for genre, (x, y) in zip(genres, genre_centres):
+        axes.annotate(genre, (x, y), fontsize=9, ha='center', va='bottom', xytext=(0, 6), textcoords='offset points', zorder=5)
+    axes.autoscale_view()
+    axes.set_title(f"Network Visualization ({len(movie_rows)} movies, {graph.number_of_edges()} edges, {len(edges)} drawn)")
+    figure.savefig(filename, dpi=150, bbox_inches='tight')
+    return filename
+
+def draw_network(graph, filename=NETWORK_IMAGE, layout_file=LAYOUT_FILE, max_edges=5000, seed=0):
+    """
+    Lays out (or reuses the saved layout of) a movie graph and renders it to an image file.
+
+    Args:
+    graph (networkx.Graph): The movie graph.
+    filename (str): The output image; .png or .svg.
+    layout_file (str): The file the layout is cached in.
+    max_edges (int): The largest number of graph edges drawn.
+    seed (int): The random seed of the layout and the edge sample.
+
+    Returns:
+    tuple: (filename, reused) - the image written and whether the saved layout was reused.
+    """
+    from instrumentation import stage
+
+    with stage('network_layout') as timer:
+        positions, reused = get_layout(graph, layout_file, seed)
+        timer.count(nodes=len(positions), reused=reused)
+    with stage('render_network'):
+        render_network(graph, positions, filename, max_edges, seed)
+    return filename, reused
+
+def main():
+    """
+    Renders the saved movie graph (movie_graph/ or movie_graph.json, written by construct_graph.py) to an image file.
+    """
+    parser = argparse.ArgumentParser(description='Render the movie graph to a PNG or SVG file.')
+    parser.add_argument('output', nargs='?', default=NETWORK_IMAGE)
+    parser.add_argument('--max-edges', type=int, default=5000, help='the largest number of graph edges drawn')
+    parser.add_argument('--layout-file', default=LAYOUT_FILE)
+    args = parser.parse_args()
+
+    from read_json_graph import binary_graph_to_networkx, load_graph_binary, load_graph_from_json
+
+    if os.path.exists(os.path.join('movie_graph', 'header.json')):
+        G = binary_graph_to_networkx(load_graph_binary('movie_graph'))
+    else:
+        G = load_graph_from_json('movie_graph.json')
+    filename, reused = draw_network(G, args.output, args.layout_file, args.max_edges)
+    print(f"Network visualization written to {filename}" + (" (saved layout reused)" if reused else ''))
+
+if __name__ == '__main__':
+    main()